@@ -0,0 +1,94 @@
+#
+# Send node averaging benchmark (host CPython)
+#
+# Compares the old per-interval temp/humid lists (averaged with list
+# comprehensions at publish time) against phonecan.aggregate.NodeAggregator.
+# Traffic is modelled on code_sendnode.py: three remote nodes sending
+# temperature and humidity every second, plus a local reading every
+# read_interval.  Peak heap is measured with tracemalloc for publish intervals
+# from 1 to 60 minutes.
+#
+# Run from the repository root:  python bench/bench_aggregate.py
+#
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.aggregate import NodeAggregator
+
+remote_nodes = [0, 1, 2]
+local_node = 3
+send_interval = 1 # Seconds
+read_interval = 0.5 # Seconds
+intervals = [1, 5, 15, 30, 60] # Minutes
+
+
+def samples(minutes):
+    # Yield (node, quantity, value) in the order collectnodes() sees them
+    rng = random.Random(minutes)
+    reads = int(minutes*60/read_interval)
+    reads_per_send = max(1, int(send_interval/read_interval))
+    for r in range(reads):
+        for node in remote_nodes:
+            # Nodes are not synchronised, so spread their sends across reads
+            if (r + node) % reads_per_send == 0:
+                yield node, 0, 20.0 + rng.random()
+                yield node, 1, 45.0 + rng.random()
+        yield local_node, 0, 21.0 + rng.random()
+        yield local_node, 1, 40.0 + rng.random()
+
+
+def run_lists(minutes):
+    temp = []
+    humid = []
+    for node, quantity, value in samples(minutes):
+        if quantity == 0:
+            temp.append([node, value])
+        else:
+            humid.append([node, value])
+    aves = []
+    for node in remote_nodes + [local_node]:
+        t = [i[1] for i in temp if i[0] == node and i[1] >= 0.0]
+        rh = [i[1] for i in humid if i[0] == node and i[1] >= 0.0]
+        aves.append((sum(t)/len(t), sum(rh)/len(rh)))
+    return aves
+
+
+def run_aggregator(minutes):
+    stats = NodeAggregator()
+    for node, quantity, value in samples(minutes):
+        stats.add(node, quantity, value)
+    return [(stats.stat(node, 0).mean, stats.stat(node, 1).mean) for node in remote_nodes + [local_node]]
+
+
+def measure(func, minutes):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    result = func(minutes)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def main():
+    print("{:>8} {:>10} {:>14} {:>14} {:>14} {:>14}".format(
+        "minutes", "samples", "lists peak B", "agg peak B", "lists ksamp/s", "agg ksamp/s"))
+    for minutes in intervals:
+        nsamples = sum(1 for _s in samples(minutes))
+        old, old_peak, old_time = measure(run_lists, minutes)
+        new, new_peak, new_time = measure(run_aggregator, minutes)
+        for (ot, orh), (nt, nrh) in zip(old, new):
+            assert abs(ot - nt) < 1e-6 and abs(orh - nrh) < 1e-6
+        print("{:>8} {:>10} {:>14} {:>14} {:>14.0f} {:>14.0f}".format(
+            minutes, nsamples, old_peak, new_peak, nsamples/old_time/1000, nsamples/new_time/1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#
+# Boot time and heap per node role (host CPython)
+#
+# Boots each node script alone on sim.harness's fake board and measures:
+#
+#   modules      board modules the script imports (the fake ones) and
+#                phonecan modules loaded by asyncio.run()
+#   import ms    host CPU from the start of the script to asyncio.run(),
+#                i.e. imports and setup; the phonecan modules are compiled
+#                beforehand and imported afresh for every run (from
+#                __pycache__, as a board loads .mpy files, see
+#                tools/build_mpy.py)
+#   heap KB      memory in use at asyncio.run(), after a collection
+#                (tracemalloc; the fake gc.mem_free() reports the fake heap
+#                less this)
+#   first tx ms  host CPU from the start of the script to its first CAN
+#                frame (the shortest over the runs, as for import ms)
+#   first tx s   virtual seconds from boot to the first frame (sensor reads
+#                and other waits; imports take no virtual time)
+#
+# The fake drivers cost next to nothing to import, unlike the real ones on
+# a board, so the import times mostly show the phonecan library and the
+# script itself, and the heap is CPython's, not CircuitPython's.  The counts
+# and the differences between versions are what carry over.
+#
+# With --baseline REV the scripts and phonecan from git revision REV are
+# measured as well (git archive into a temporary directory), e.g.
+#
+#   python bench/bench_boot.py --baseline HEAD~1
+#
+# Run from the repository root.
+#
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import compileall
+import gc
+import contextlib
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim.harness import Harness, ROOT
+
+seconds = 10.0 # Virtual, per run
+runs = 15 # Per role; the import time is the shortest
+
+ROLES = [
+    ("home", "code_homenode.py", 0),
+    ("send", "code_sendnode.py", 3),
+    ("remote1", "code_remote1.py", 1),
+    ("remote2", "code_remote2.py", 2),
+]
+
+
+def purge():
+    # Forget the phonecan modules so the next script imports them again
+    for name in list(sys.modules):
+        if name == "phonecan" or name.startswith("phonecan."):
+            del sys.modules[name]
+
+
+def boot(root, script, nodeid):
+    # (modules imported, import s, heap bytes at asyncio.run(), host s and virtual s to the first frame) for one run
+    purge()
+    sys.path.insert(0, root)
+    harness = Harness()
+    node = harness.add(os.path.join(root, script), nodeid)
+    imported = set()
+    node_import = node._import
+    found = {}
+
+    def _import(name, globals=None, locals=None, fromlist=(), level=0):
+        if name in node.modules:
+            imported.add(name)
+        return node_import(name, globals, locals, fromlist, level)
+
+    node._import = _import
+    asyncio_module = node.modules["asyncio"]
+    run = asyncio_module.run
+
+    def _run(main):
+        found["setup"] = time.perf_counter() - found["start"]
+        gc.collect()
+        found["heap"] = tracemalloc.get_traced_memory()[0]
+        imported.update(name for name in sys.modules if name.startswith("phonecan."))
+        found["modules"] = len(imported)
+        return run(main)
+
+    asyncio_module.run = _run
+    send = node.can_bus.send
+
+    def _send(msg):
+        ok = send(msg)
+        if ok and "first tx" not in found:
+            found["first tx"] = harness.clock.now
+            found["first tx host"] = time.perf_counter() - found["start"]
+        return ok
+
+    node.can_bus.send = _send
+    node_run = node.run
+
+    def _node_run():
+        tracemalloc.start()
+        found["start"] = time.perf_counter()
+        try:
+            node_run()
+        finally:
+            tracemalloc.stop()
+
+    node.run = _node_run
+    try:
+        # The phonecan modules print to the host's stdout, not the node's log
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            harness.run(seconds)
+    finally:
+        sys.path.remove(root)
+        purge()
+    return found["modules"], found["setup"], found["heap"], found.get("first tx host"), found.get("first tx")
+
+
+def measure(roots):
+    # [{role: (modules, shortest import s, heap bytes, shortest host s to the first frame, virtual s to it)}]
+    #   per root; the roots take turns, so none is always measured on a warmer process
+    for root in roots:
+        compileall.compile_dir(os.path.join(root, "phonecan"), quiet=1)
+    results = [{} for _root in roots]
+    for role, script, nodeid in ROLES:
+        samples = [[] for _root in roots]
+        for _i in range(runs):
+            for root, found in zip(roots, samples):
+                found.append(boot(root, script, nodeid))
+        for found, result in zip(samples, results):
+            modules, _setup, heap, _host, first = found[-1]
+            result[role] = (modules, min(sample[1] for sample in found), heap, min(sample[3] for sample in found), first)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Boot time and heap per node role")
+    parser.add_argument("--baseline", help="Git revision to compare with")
+    args = parser.parse_args()
+    names = ["working tree"]
+    roots = [ROOT]
+    directory = None
+    try:
+        if args.baseline:
+            directory = tempfile.mkdtemp()
+            archive = subprocess.run(["git", "archive", args.baseline], cwd=ROOT, check=True, capture_output=True).stdout
+            subprocess.run(["tar", "-x", "-C", directory], input=archive, check=True)
+            names.insert(0, args.baseline)
+            roots.insert(0, directory)
+        versions = list(zip(names, measure(roots)))
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+    print("{0} runs per role, {1:.0f} virtual s each\n".format(runs, seconds))
+    print("{0:>14} {1:>8} {2:>8} {3:>10} {4:>9} {5:>12} {6:>11}".format(
+        "version", "role", "modules", "import ms", "heap KB", "first tx ms", "first tx s"))
+    for name, results in versions:
+        for role, (modules, setup, heap, host, first) in results.items():
+            print("{0:>14} {1:>8} {2:>8} {3:>10.1f} {4:>9.1f} {5:>12.1f} {6:>11.3f}".format(
+                name, role, modules, 1000*setup, heap/1024, 1000*host, first))
+    if len(versions) == 2:
+        print()
+        (_old, old), (_new, new) = versions
+        for role in new:
+            print("{0:>8}: {1:+d} modules, import {2:+.1f} ms, heap {3:+.1f} KB, first tx {4:+.1f} ms".format(
+                role, new[role][0] - old[role][0], 1000*(new[role][1] - old[role][1]),
+                (new[role][2] - old[role][2])/1024, 1000*(new[role][3] - old[role][3])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#
+# Bus health and fault recovery benchmark (host CPython)
+#
+# nnodes remotes send compact telemetry at rate Hz each through a
+# phonecan.tx.TxScheduler, and a home node drains its two receive buffers
+# every few milliseconds, all on sim.fakecan's bus on a sim.vclock virtual
+# clock with its fault injection (corrupted frames move the error counters;
+# a controller above 255 transmit errors goes bus off until restarted).
+# The run goes through these phases:
+#
+#   clean:     no errors
+#   marginal:  every frame corrupted with probability MARGINAL, about where
+#              the transmit error counters stop drifting back to 0, so
+#              they wander into the warning range now and then
+#   faulty:    node 1's frames corrupted with probability FAULTY (a bad
+#              connector), the rest of the bus clean
+#   dead:      every one of node 1's frames corrupted (a cut wire), so it
+#              goes bus off and its sends are refused (the driver raises
+#              RuntimeError when no transmit buffer is free)
+#   recovered: no errors
+#
+# Two restart policies are compared:
+#
+#   old:     restart whenever can_bus.state != 0, checked every second on
+#            the remotes and every receive pass on the home node, as
+#            canstate() and the remote loops did
+#   backoff: phonecan.health.BusHealth on every node (restart only when bus
+#            off, with exponential backoff), which also sends health frames
+#            that the home node keeps in a HealthTable
+#
+# For each phase it reports telemetry frames per second received at the
+# home node from the healthy nodes and from node 1, error frames per second,
+# restarts, sends the remotes' controllers refused, and frames the home node
+# lost to its own restarts.
+#
+# Run from the repository root:  python bench/bench_bus_health.py [nnodes]
+#
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.codec import pack_compact_into
+from phonecan.health import BusHealth, HealthTable
+from phonecan.registry import NodeRegistry
+from phonecan.tx import Transmitter, TxScheduler, compact_slots
+from sim.busload import frame_timer
+from sim.fakecan import FakeBus, FakeMCP2515, Match, Message
+from sim.vclock import VirtualClock
+
+nnodes = 6
+bitrate = 250000
+rate = 10.0 # Telemetry frames per second per remote
+poll_interval = 0.002 # Seconds between home node receive passes
+MARGINAL = 0.11
+FAULTY = 0.3
+PHASES = [("clean", 0.0, 30.0), ("marginal", 30.0, 90.0), ("faulty", 90.0, 150.0), ("dead", 150.0, 180.0),
+          ("recovered", 180.0, 210.0)]
+FAULTY_NODE = 1
+
+
+class Remote():
+    def __init__(self, clock, bus, nodeid, policy):
+        self.clock = clock
+        self.nodeid = nodeid
+        self.policy = policy
+        self.can_bus = FakeMCP2515(bus, rx_buffers=None)
+        self.can_bus.listen(matches=[Match(0, mask=0x1FFFFFFF, extended=True)]) # Sends only
+        self.tx = TxScheduler(Transmitter(self.can_bus, Message, compact_slots(nodeid, True)))
+        self.health = BusHealth(self.can_bus, Message, nodeid, interval=1.0, report_interval=5.0)
+        self.seq = 0
+        self.last_check = 0.0
+
+    def step(self):
+        now = self.clock.now
+        if self.policy == "old":
+            if now - self.last_check >= 1.0:
+                self.last_check = now
+                if self.can_bus.state != 0:
+                    self.can_bus.restart()
+        else:
+            self.health.poll(now)
+        pack_compact_into(self.tx.buffer(0), self.seq, 21.0, 45.0)
+        self.seq = (self.seq + 1) % 256
+        self.tx.submit_all()
+        self.tx.pump(now)
+        self.clock.call_later(1/rate, self.step)
+
+
+class Home():
+    def __init__(self, clock, bus, registry, policy):
+        self.clock = clock
+        self.registry = registry
+        self.policy = policy
+        self.can_bus = FakeMCP2515(bus)
+        self.listener = self.can_bus.listen(matches=registry.matches(Match), timeout=0)
+        self.table = HealthTable()
+        self.health = BusHealth(self.can_bus, interval=1.0)
+        self.received = {} # nodeid: telemetry frames
+
+    def count(self, _nodeid, _quantity, _value):
+        pass
+
+    def step(self):
+        now = self.clock.now
+        if self.policy == "old":
+            if self.can_bus.state != 0:
+                self.can_bus.restart()
+        else:
+            self.health.poll(now)
+        while self.listener.in_waiting():
+            msg = self.listener.receive()
+            nodeid = self.registry.decode(msg, self.count, lambda n, values: self.table.update(n, values, now))
+            if nodeid is not None:
+                self.received[nodeid] = self.received.get(nodeid, 0) + 1
+        self.clock.call_later(poll_interval, self.step)
+
+
+def run(policy):
+    clock = VirtualClock()
+    bus = FakeBus(frame_timer(bitrate, "typical"), clock=clock)
+    registry = NodeRegistry(range(nnodes + 1))
+    home = Home(clock, bus, registry, policy)
+    remotes = [Remote(clock, bus, nodeid, policy) for nodeid in range(1, nnodes + 1)]
+    faulty = remotes[FAULTY_NODE - 1].can_bus
+
+    def error_rate(_msg, sender):
+        phase = current(clock.now)
+        if phase == "marginal":
+            return MARGINAL
+        if phase == "faulty" and sender is faulty:
+            return FAULTY
+        if phase == "dead" and sender is faulty:
+            return 1.0
+        return 0.0
+    bus.error_rate = error_rate
+
+    rows = []
+
+    def snapshot():
+        rows.append((clock.now, dict(home.received), bus.errors,
+                     sum(remote.can_bus.restarts for remote in remotes) + home.can_bus.restarts,
+                     home.can_bus.restart_losses, sum(remote.can_bus.send_failures for remote in remotes)))
+    for _name, start, _end in PHASES:
+        clock.call_at(start, snapshot)
+    clock.call_at(PHASES[-1][2], snapshot)
+    clock.call_later(0.0, home.step)
+    for i, remote in enumerate(remotes):
+        clock.call_later(i/rate/nnodes, remote.step)
+    clock.run(PHASES[-1][2] + 0.001)
+    return rows, home
+
+
+def current(now):
+    for name, start, end in PHASES:
+        if start <= now < end:
+            return name
+    return None
+
+
+def report(policy, rows, home):
+    print(policy)
+    print("{:>10} {:>14} {:>14} {:>10} {:>10} {:>10} {:>12}".format("phase", "healthy fr/s", "node 1 fr/s",
+                                                                      "errors/s", "restarts", "refused", "home lost"))
+    for (name, start, end), before, after in zip(PHASES, rows, rows[1:]):
+        seconds = end - start
+        received = {n: after[1].get(n, 0) - before[1].get(n, 0) for n in range(1, nnodes + 1)}
+        healthy = sum(count for n, count in received.items() if n != FAULTY_NODE)/(nnodes - 1)
+        print("{:>10} {:>14.2f} {:>14.2f} {:>10.1f} {:>10} {:>10} {:>12}".format(
+            name, healthy/seconds, received[FAULTY_NODE]/seconds, (after[2] - before[2])/seconds,
+            after[3] - before[3], after[5] - before[5], after[4] - before[4]))
+    for line in home.table.lines(now=PHASES[-1][2]):
+        print("  " + line)
+    print()
+
+
+def main():
+    global nnodes
+    if len(sys.argv) > 1:
+        nnodes = int(sys.argv[1])
+    print("{} remotes at {:g} Hz, {} bit/s; marginal cable p={:g}, node {} faulty p={:g}\n".format(
+        nnodes, rate, bitrate, MARGINAL, FAULTY_NODE, FAULTY))
+    for policy in ("old", "backoff"):
+        report(policy, *run(policy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#
+# Payload codec benchmark and round-trip checks (host CPython)
+#
+# 1. Round-trip checks over the full sensor ranges (SHT4x -40..125 C and
+#    0..100 %RH, MS8607 10..2000 hPa) plus random values and out-of-range
+#    values, which must saturate instead of raising.
+# 2. Encode/decode operations per second and bytes allocated per frame for
+#    the old inline struct code and phonecan.codec.
+#
+# Exits non-zero if a round-trip check fails.
+#
+# Run from the repository root:  python bench/bench_codec.py
+#
+import os
+import sys
+import time
+import random
+import struct
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.codec import (pack_compact_into, decode_compact, pack_legacy_into, decode_legacy,
+                            COMPACT_SIZE, LEGACY_SIZE)
+
+nops = 100000
+
+
+def frange(start, stop, step):
+    n = int(round((stop - start)/step))
+    for i in range(n + 1):
+        yield start + i*step
+
+
+def check_roundtrips():
+    failures = 0
+    cbuf = bytearray(COMPACT_SIZE)
+    lbuf = bytearray(LEGACY_SIZE)
+    # Compact: 0.01 C / 0.01 % / 0.1 hPa resolution, so error within half a step
+    for t in frange(-40.0, 125.0, 0.01):
+        seq, t2, h2, p2 = decode_compact(pack_compact_into(cbuf, 7, t, 50.0))
+        if abs(t2 - t) > 0.005 + 1e-9 or seq != 7 or p2 is not None:
+            failures += 1
+    for h in frange(0.0, 100.0, 0.01):
+        _s, _t, h2, _p = decode_compact(pack_compact_into(cbuf, 0, 20.0, h))
+        if abs(h2 - h) > 0.005 + 1e-9:
+            failures += 1
+    for p in frange(10.0, 2000.0, 0.05):
+        _s, _t, _h, p2 = decode_compact(pack_compact_into(cbuf, 0, 20.0, 50.0, p))
+        if abs(p2 - p) > 0.05 + 1e-9:
+            failures += 1
+    # Legacy: thousandths, truncated
+    for t in frange(-40.0, 125.0, 0.001):
+        t2 = decode_legacy(pack_legacy_into(lbuf, t))
+        if abs(t2 - t) > 0.001 + 1e-9:
+            failures += 1
+    # Random values, including the sequence number wrapping
+    rng = random.Random(0)
+    for i in range(20000):
+        t = rng.uniform(-40.0, 125.0)
+        h = rng.uniform(0.0, 100.0)
+        p = rng.uniform(10.0, 2000.0)
+        seq, t2, h2, p2 = decode_compact(pack_compact_into(cbuf, i, t, h, p))
+        if seq != i % 256 or abs(t2 - t) > 0.005 + 1e-9 or abs(h2 - h) > 0.005 + 1e-9 or abs(p2 - p) > 0.05 + 1e-9:
+            failures += 1
+    # Saturation
+    saturated = [
+        (decode_compact(pack_compact_into(cbuf, 0, 1000.0, 50.0))[1], 327.67),
+        (decode_compact(pack_compact_into(cbuf, 0, -1000.0, 50.0))[1], -327.68),
+        (decode_compact(pack_compact_into(cbuf, 0, 20.0, -0.5))[2], 0.0),
+        (decode_compact(pack_compact_into(cbuf, 0, 20.0, 50.0, 1e6))[3], 6553.5),
+        (decode_legacy(pack_legacy_into(lbuf, 1e6)), 32767.999),
+        (decode_legacy(pack_legacy_into(lbuf, -1e6)), -32768.0),
+    ]
+    for got, want in saturated:
+        if abs(got - want) > 1e-6:
+            print("saturation: got", got, "want", want)
+            failures += 1
+    if decode_compact(b"\x20" + bytes(7)) is not None: # Unknown version
+        failures += 1
+    return failures
+
+
+def old_encode(temperature, humidity):
+    measlist = []
+    it, st = divmod(temperature, 1)
+    measlist.append(struct.pack('<HH', int(it), int(1000*st)))
+    ih, sh = divmod(humidity, 1)
+    measlist.append(struct.pack('<HH', int(ih), int(1000*sh)))
+    return measlist
+
+
+def old_decode(data):
+    return int(struct.unpack('<HH',data)[0])+float(struct.unpack('<HH',data)[1]/1000)
+
+
+def rate(func, *args):
+    t0 = time.perf_counter()
+    for _i in range(nops):
+        func(*args)
+    return nops/(time.perf_counter() - t0)
+
+
+def bytes_per_op(func, *args):
+    # Peak traced memory of one call, averaged, after a warm-up call
+    func(*args)
+    total = 0
+    tracemalloc.start()
+    for _i in range(1000):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(*args)
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total/1000
+
+
+def main():
+    failures = check_roundtrips()
+    print("round-trip failures:", failures)
+    cbuf = bytearray(COMPACT_SIZE)
+    lbufs = [bytearray(LEGACY_SIZE), bytearray(LEGACY_SIZE)]
+    old_frame = struct.pack('<HH', 21, 370)
+    compact_frame = bytes(pack_compact_into(bytearray(COMPACT_SIZE), 1, 21.37, 45.5))
+
+    def new_legacy_encode(t, h):
+        pack_legacy_into(lbufs[0], t)
+        pack_legacy_into(lbufs[1], h)
+
+    rows = [
+        ("old encode T+RH (2 frames)", old_encode, (21.37, 45.5)),
+        ("legacy pack_into T+RH", new_legacy_encode, (21.37, 45.5)),
+        ("compact pack_into T+RH", pack_compact_into, (cbuf, 1, 21.37, 45.5)),
+        ("old decode (2 unpacks)", old_decode, (old_frame,)),
+        ("legacy decode", decode_legacy, (old_frame,)),
+        ("compact decode", decode_compact, (compact_frame,)),
+    ]
+    print("\n{:<28} {:>12} {:>14}".format("operation", "kops/s", "bytes/op"))
+    for name, func, args in rows:
+        print("{:<28} {:>12.0f} {:>14.1f}".format(name, rate(func, *args)/1000, bytes_per_op(func, *args)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
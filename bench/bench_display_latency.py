@@ -0,0 +1,146 @@
+#
+# Home node button-to-display latency benchmark (host CPython)
+#
+# Three simulated remote nodes send temperature and humidity every second over
+# sim.fakecan's bus to a home node receiving with RxDrain.  A simulated user
+# presses a button every few seconds to select a random remote node; the
+# latency is the time until the OLED (sim.fakedisplay) shows that node.
+#
+#   legacy: button_func() before the cache: a node is only drawn when one of
+#           its frames arrives while its button is selected
+#   cache:  phonecan.cache.NodeCache updated from every frame, and the
+#           selection drawn from the cache as soon as the button is pressed
+#
+# Run from the repository root:  python bench/bench_display_latency.py
+#
+import os
+import sys
+import time
+import random
+import struct
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.cache import NodeCache
+from phonecan.canrx import AsyncReceiver, RxDrain
+from phonecan.display import ValueDisplay
+from sim.fakecan import FakeBus, FakeMCP2515, Message
+from sim.fakedisplay import Group, label, terminalio
+
+remote_nodes = [1, 2, 3]
+send_interval = 1.0 # Seconds
+frame_time = 0.00044 # Seconds per frame at 250 kbit/s
+presses = 20
+press_gap = (1.0, 3.0) # Seconds between button presses
+
+
+class Context():
+    def __init__(self, rxdrain):
+        self.rxdrain = rxdrain
+        self.cache = NodeCache()
+        self.label = label
+        self.terminalio = terminalio
+        self.xpos = [75, 75, 75]
+        self.ypos = [10, 30, 50]
+        self.text_area = [None]*3
+        self.splash = Group()
+        for _i in range(5):
+            self.splash.append(None)
+        self.valuedisplay = ValueDisplay(self.splash, label, terminalio.FONT, self.xpos, self.ypos)
+        self.selected = None
+        self.pressed_at = None
+        self.latencies = []
+
+    def shown(self, node):
+        # Called after drawing; records the latency of the first draw after a press
+        if node == self.selected and self.pressed_at is not None:
+            self.latencies.append(time.perf_counter() - self.pressed_at)
+            self.pressed_at = None
+
+
+async def remote(bus, nodeid):
+    controller = FakeMCP2515(bus)
+    rng = random.Random(nodeid)
+    await asyncio.sleep(rng.random()*send_interval)
+    while True:
+        controller.send(Message(id=2*nodeid, data=struct.pack('<HH', 21, 500), extended=True))
+        controller.send(Message(id=2*nodeid + 1, data=struct.pack('<HH', 45, 250), extended=True))
+        await asyncio.sleep(send_interval)
+
+
+def set_value_text(context, index, text):
+    # The value label update used by button_func() before ValueDisplay
+    context.text_area[index] = context.label.Label(context.terminalio.FONT, text=text, color=0xFFFFFF, x=context.xpos[index], y=context.ypos[index])
+    if len(context.splash) > 5 + index:
+        context.splash.pop(5 + index)
+    context.splash.insert(5 + index, context.text_area[index])
+
+
+def unpack(msg):
+    return int(struct.unpack('<HH',msg.data)[0])+float(struct.unpack('<HH',msg.data)[1]/1000)
+
+
+async def legacy_display(context):
+    while True:
+        msg = await context.rxdrain.recv(timeout=5.0)
+        if msg is None:
+            continue
+        rxnodeid = msg.id // 2
+        if rxnodeid == context.selected:
+            set_value_text(context, 0, "Remote "+str(rxnodeid))
+            set_value_text(context, 1 + msg.id % 2, "{:.2f}".format(unpack(msg)))
+            context.shown(rxnodeid)
+
+
+async def cache_display(context):
+    while True:
+        msg = await context.rxdrain.recv(timeout=5.0)
+        if msg is None:
+            continue
+        rxnodeid = msg.id // 2
+        context.cache.update(rxnodeid, msg.id % 2, unpack(msg))
+        if rxnodeid == context.selected:
+            context.valuedisplay.show_node(context.cache, rxnodeid, "Remote "+str(rxnodeid))
+
+
+async def user(context, mode):
+    rng = random.Random(1)
+    await asyncio.sleep(2*send_interval) # Let every node report once
+    for _p in range(presses):
+        await asyncio.sleep(rng.uniform(*press_gap))
+        context.selected = rng.choice([n for n in remote_nodes if n != context.selected])
+        context.pressed_at = time.perf_counter()
+        if mode == "cache":
+            # button_listener() draws the selection straight from the cache
+            context.valuedisplay.show_node(context.cache, context.selected, "Remote "+str(context.selected), force=True)
+            context.shown(context.selected)
+
+
+async def run(mode):
+    bus = FakeBus(frame_time=frame_time)
+    rxdrain = RxDrain(AsyncReceiver(FakeMCP2515(bus)), ring_size=32, node_of=lambda msg_id: msg_id // 2)
+    context = Context(rxdrain)
+    tasks = [asyncio.create_task(bus.run()), asyncio.create_task(rxdrain.run())]
+    tasks += [asyncio.create_task(remote(bus, n)) for n in remote_nodes]
+    if mode == "legacy":
+        tasks.append(asyncio.create_task(legacy_display(context)))
+    else:
+        tasks.append(asyncio.create_task(cache_display(context)))
+    await user(context, mode)
+    await asyncio.sleep(2*send_interval)
+    for task in tasks:
+        task.cancel()
+    return sorted(context.latencies)
+
+
+def main():
+    print("{:>8} {:>8} {:>12} {:>12} {:>12}".format("mode", "presses", "p50 ms", "p90 ms", "max ms"))
+    for mode in ("legacy", "cache"):
+        lat = asyncio.run(run(mode))
+        print("{:>8} {:>8} {:>12.2f} {:>12.2f} {:>12.2f}".format(
+            mode, len(lat), 1000*lat[len(lat)//2], 1000*lat[int(len(lat)*0.9)], 1000*lat[-1]))
+
+
+if __name__ == "__main__":
+    main()
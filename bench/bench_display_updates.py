@@ -0,0 +1,111 @@
+#
+# Home node OLED update cost benchmark (host CPython)
+#
+# Replays one minute of frames from the selected remote node (temperature and
+# humidity every second, drifting slowly as real readings do) into the home
+# node display code, using sim.fakedisplay's Group, Label and Display.
+#
+#   legacy: a new Label plus splash.pop()/insert() per value, per frame, with
+#           the display refreshing automatically after every change
+#   inplace: phonecan.display.ValueDisplay, which only changes .text when the
+#           formatted string differs and rate-limits refreshes
+#
+# Run from the repository root:  python bench/bench_display_updates.py
+#
+import os
+import sys
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.cache import NodeCache
+from phonecan.display import ValueDisplay
+from sim.fakedisplay import Group, Label, Display, label, terminalio
+
+xpos = [75, 75, 75]
+ypos = [10, 30, 50]
+refresh_interval = 0.5 # Seconds, as display_refresh_interval on the home node
+node = 1
+
+
+def frames(seconds=60):
+    # (time, quantity, value) for one node sending every second
+    rng = random.Random(0)
+    temp = 21.0
+    rh = 45.0
+    for t in range(seconds):
+        temp += rng.gauss(0, 0.01)
+        rh += rng.gauss(0, 0.03)
+        yield float(t), 0, round(temp, 2)
+        yield t + 0.001, 1, round(rh, 2)
+
+
+def base_splash():
+    splash = Group()
+    for _i in range(5):
+        splash.append(None)
+    return splash
+
+
+def legacy():
+    splash = base_splash()
+    display = Display()
+    text_area = [None]*3
+
+    def set_value_text(index, text):
+        text_area[index] = label.Label(terminalio.FONT, text=text, color=0xFFFFFF, x=xpos[index], y=ypos[index])
+        if len(splash) > 5 + index:
+            splash.pop(5 + index)
+        splash.insert(5 + index, text_area[index])
+
+    def update(now, quantity, value):
+        set_value_text(0, "Remote "+str(node))
+        set_value_text(1 + quantity, "{:.2f}".format(value))
+        display.changed()
+
+    return update, splash, display
+
+
+def inplace():
+    splash = base_splash()
+    display = Display()
+    cache = NodeCache()
+    valuedisplay = ValueDisplay(splash, label, terminalio.FONT, xpos, ypos, display=display, min_interval=refresh_interval)
+
+    def update(now, quantity, value):
+        cache.update(node, quantity, value, now)
+        valuedisplay.show_node(cache, node, "Remote "+str(node), now)
+
+    return update, splash, display
+
+
+def measure(setup):
+    update, splash, display = setup()
+    labels0 = Label.created
+    changes0 = splash.changes
+    refreshes0 = display.refreshes
+    peaks = []
+    tracemalloc.start()
+    nupdates = 0
+    for now, quantity, value in frames():
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        update(now, quantity, value)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        nupdates += 1
+    tracemalloc.stop()
+    return (nupdates, (Label.created - labels0)/nupdates, (splash.changes - changes0)/nupdates,
+            sum(peaks)/nupdates, display.refreshes - refreshes0)
+
+
+def main():
+    print("{:>8} {:>8} {:>14} {:>14} {:>14} {:>14}".format(
+        "mode", "updates", "labels/update", "group ops/upd", "bytes/update", "refreshes/min"))
+    for name, setup in (("legacy", legacy), ("inplace", inplace)):
+        nupdates, labels, changes, nbytes, refreshes = measure(setup)
+        print("{:>8} {:>8} {:>14.2f} {:>14.2f} {:>14.0f} {:>14}".format(name, nupdates, labels, changes, nbytes, refreshes))
+
+
+if __name__ == "__main__":
+    main()
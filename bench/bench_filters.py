@@ -0,0 +1,82 @@
+#
+# Acceptance filter benchmark (host CPython)
+#
+# A bus carrying measurement frames from nnodes PhoneCAN nodes (compact format,
+# plus one node still on legacy frames) and other traffic the receivers do not
+# use (health/diagnostic frames and a foreign device).  The same receive loop
+# runs with an unfiltered listener and with the listener filtered by
+# phonecan.registry.NodeRegistry.matches(); sim.fakecan applies the matches as
+# the MCP2515's hardware filters.  Reports frames the CPU had to handle per
+# second and the time spent handling them.
+#
+# Run from the repository root:  python bench/bench_filters.py
+#
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.codec import encode_compact, encode_legacy, decode_compact, decode_legacy
+from phonecan.registry import NodeRegistry, compact_id, legacy_id, COMPACT
+from sim.fakecan import FakeBus, FakeMCP2515, Match, Message
+
+nnodes = 12
+seconds = 60
+send_hz = 1 # Measurement frames per node per second
+legacy_node = 1 # Node still sending legacy frames
+foreign_hz = 200 # Frames per second the receivers do not use
+
+
+def traffic(bus, sender):
+    seq = 0
+    for _s in range(seconds):
+        for nodeid in range(nnodes):
+            for _i in range(send_hz):
+                if nodeid == legacy_node:
+                    bus.transmit(Message(legacy_id(nodeid, 0), encode_legacy(21.5), extended=True), sender)
+                    bus.transmit(Message(legacy_id(nodeid, 1), encode_legacy(45.0), extended=True), sender)
+                else:
+                    bus.transmit(Message(compact_id(nodeid), encode_compact(seq, 21.5, 45.0), extended=True), sender)
+        for i in range(foreign_hz):
+            # Diagnostics from other devices on the wire
+            bus.transmit(Message(0x18FF0000 + (i % 64), b"\x00"*8, extended=True), sender)
+        seq += 1
+        yield
+
+
+def run(filtered):
+    registry = NodeRegistry(range(nnodes))
+    bus = FakeBus()
+    sender = FakeMCP2515(bus)
+    receiver = FakeMCP2515(bus, rx_buffers=None)
+    matches = registry.matches(Match) if filtered else None
+    listener = receiver.listen(matches=matches, timeout=0)
+    measurements = 0
+    busy = 0.0
+    for _s in traffic(bus, sender):
+        t0 = time.perf_counter()
+        while listener.in_waiting():
+            msg = listener.receive()
+            entry = registry.lookup(msg.id)
+            if entry is None:
+                continue
+            if entry[1] == COMPACT:
+                decode_compact(msg.data)
+            else:
+                decode_legacy(msg.data)
+            measurements += 1
+        busy += time.perf_counter() - t0
+    return listener.frames_handled/seconds, measurements/seconds, 1e6*busy/seconds
+
+
+def main():
+    print("{} nodes, {} foreign frames/s, {} s".format(nnodes, foreign_hz, seconds))
+    print("{:>10} {:>14} {:>16} {:>14}".format("listener", "frames/s", "measurements/s", "CPU us/s"))
+    for filtered in (False, True):
+        frames, measurements, busy = run(filtered)
+        print("{:>10} {:>14.1f} {:>16.1f} {:>14.0f}".format("filtered" if filtered else "all", frames, measurements, busy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#
+# Gateway ingest benchmark (host CPython, needs python-can: pip install -r gateway/requirements.txt)
+#
+# A sender thread puts nframes PhoneCAN frames (compact frames from nnodes
+# nodes, one node on legacy frames, and some foreign frames) on a python-can
+# virtual bus as fast as it can.  gateway.collector.Collector reads them on a
+# second virtual bus on the same channel and stores every measurement in a
+# fresh SQLite database.  For each batch size this reports frames per second
+# ingested, rows stored, and the lag from the last frame sent until it was
+# committed.  Then it times a range and a downsample query over the stored
+# data.
+#
+# Run from the repository root:  python bench/bench_gateway_ingest.py
+#
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import can
+
+from phonecan.aggregate import TEMPERATURE
+from phonecan.codec import encode_compact, encode_legacy
+from phonecan.registry import NodeRegistry, compact_id, legacy_id
+from gateway.collector import Collector
+from gateway.store import Store
+
+nnodes = 8
+legacy_node = 1
+nframes = 50000
+channel = "phonecan-bench"
+
+
+def frames():
+    out = []
+    seq = 0
+    for i in range(nframes):
+        node = i % (nnodes + 1)
+        if node == nnodes:
+            out.append(can.Message(arbitration_id=0x18FF0000 + (i % 64), data=bytes(8), is_extended_id=True))
+        elif node == legacy_node:
+            out.append(can.Message(arbitration_id=legacy_id(node, i % 2), data=encode_legacy(21.5 + (i % 100)/100),
+                                   is_extended_id=True))
+        else:
+            out.append(can.Message(arbitration_id=compact_id(node), data=encode_compact(seq, 21.5, 45.0, 1013.2),
+                                   is_extended_id=True))
+            seq += 1
+    return out
+
+
+def send_all(messages, done):
+    bus = can.Bus(interface="virtual", channel=channel)
+    for msg in messages:
+        bus.send(msg)
+    done.append(time.perf_counter())
+    bus.shutdown()
+
+
+async def ingest(path, batch_size, messages):
+    registry = NodeRegistry(range(nnodes))
+    store = Store(path)
+    bus = can.Bus(interface="virtual", channel=channel)
+    collector = Collector(bus, store, registry, batch_size=batch_size, flush_interval=0.1)
+    task = asyncio.create_task(collector.run())
+    await asyncio.sleep(0.1) # Let the collector start listening
+    done = []
+    start = time.perf_counter()
+    sender = threading.Thread(target=send_all, args=(messages, done))
+    sender.start()
+    while collector.frames < len(messages):
+        await asyncio.sleep(0.01)
+    collector.stop()
+    await task
+    end = time.perf_counter()
+    sender.join()
+    bus.shutdown()
+    rows = store.count()
+    store.close()
+    return len(messages)/(end - start), rows, end - done[0]
+
+
+def query_times(path):
+    store = Store(path)
+    t0 = time.perf_counter()
+    rows = store.range(2, TEMPERATURE, 0, time.time() + 1)
+    t1 = time.perf_counter()
+    buckets = store.downsample(2, TEMPERATURE, 0, time.time() + 1, 1.0)
+    t2 = time.perf_counter()
+    store.close()
+    return len(rows), t1 - t0, len(buckets), t2 - t1
+
+
+def main():
+    messages = frames()
+    print("{} frames, {} nodes, python-can virtual bus".format(nframes, nnodes))
+    print("{:>10} {:>12} {:>10} {:>10}".format("batch", "frames/s", "rows", "lag s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for batch_size in (1, 100, 1000, 5000):
+            path = os.path.join(tmp, "ingest{}.db".format(batch_size))
+            fps, rows, lag = asyncio.run(ingest(path, batch_size, messages))
+            print("{:>10} {:>12.0f} {:>10} {:>10.3f}".format(batch_size, fps, rows, lag))
+        nrows, trange, nbuckets, tdown = query_times(path)
+        print("range query: {} rows in {:.1f} ms; 1 s downsample: {} buckets in {:.1f} ms".format(
+            nrows, 1000*trange, nbuckets, 1000*tdown))
+
+
+if __name__ == "__main__":
+    main()
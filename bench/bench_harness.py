@@ -0,0 +1,108 @@
+#
+# Whole-network benchmarks on the simulation harness (host CPython)
+#
+# Runs the unchanged node scripts (code_homenode.py, code_sendnode.py and
+# nremotes copies of code_remote1/2.py) together on sim.harness in virtual
+# time and reports:
+#
+#   bus load:        frames per second on the shared bus and the fraction of
+#                    the time the wire was busy
+#   receive loss:    frames the home and send nodes lost to MCP2515 receive
+#                    buffer overflows, against the frames they received
+#   display latency: time from a button press on the home node to the OLED
+#                    refresh showing the selected node
+#   send-node memory: heap growth on the send node over two publish
+#                    intervals (tracemalloc, allocations made by
+#                    code_sendnode.py and phonecan), and gc.mem_free() as it
+#                    prints it
+#
+# Run from the repository root:  python bench/bench_harness.py [seconds]
+#
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim.fakeboard import Button
+from sim.harness import Harness
+
+seconds = 120.0 # Virtual seconds per bus load / receive loss / display run
+remote_ids = [1, 2, 4, 5, 6, 7]
+presses = [(20.0, "b"), (40.0, "c"), (60.0, "a"), (80.0, "b"), (100.0, "a")] # (virtual time, button)
+button_node = {"a": 0, "b": 1, "c": 2} # Node shown after a single click of each button
+
+
+def network(nremotes, send=True):
+    harness = Harness()
+    home = harness.add("code_homenode.py", 0)
+    sendnode = harness.add("code_sendnode.py", 3) if send else None
+    for i, nodeid in enumerate(remote_ids[:nremotes]):
+        harness.add("code_remote1.py" if i % 2 == 0 else "code_remote2.py", nodeid)
+    return harness, home, sendnode
+
+
+def received(node):
+    return sum(listener.frames_handled for listener in node.can_bus.listeners)
+
+
+def bus_and_loss():
+    print("{:>8} {:>10} {:>9} {:>14} {:>14} {:>8}".format("remotes", "frames/s", "bus load", "home rx/lost",
+                                                         "send rx/lost", "wall s"))
+    for nremotes in (0, 2, 4, 6):
+        harness, home, sendnode = network(nremotes)
+        t0 = time.perf_counter()
+        harness.run(seconds)
+        wall = time.perf_counter() - t0
+        print("{:>8} {:>10.1f} {:>9.2%} {:>14} {:>14} {:>8.1f}".format(
+            nremotes, harness.bus.frames_sent/seconds, harness.bus_load(),
+            "{}/{}".format(received(home), home.can_bus.rx_overflows),
+            "{}/{}".format(received(sendnode), sendnode.can_bus.rx_overflows), wall))
+
+
+def display_latency():
+    harness, home, _sendnode = network(2, send=False)
+    for when, button in presses:
+        harness.at(when, lambda button=button: home.press(button, Button.SINGLE))
+    harness.run(seconds)
+    latencies = []
+    for when, button in presses:
+        node = button_node[button]
+        title = "Home" if node == 0 else "Remote " + str(node)
+        shown = [t for t, text in home.display.history if t >= when and text == title]
+        latencies.append(shown[0] - when if shown else None)
+    print("button-to-display latency (s): " + "  ".join(
+        "{}:{}".format(button, "never" if latency is None else "{:.3f}".format(latency))
+        for (_when, button), latency in zip(presses, latencies)))
+
+
+def sendnode_memory():
+    harness, _home, sendnode = network(2)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    filters = [tracemalloc.Filter(True, os.path.join(root, "code_sendnode.py")),
+               tracemalloc.Filter(True, os.path.join(root, "phonecan", "*"))]
+    snapshots = []
+    harness.at(950.0, lambda: snapshots.append(tracemalloc.take_snapshot().filter_traces(filters)))
+    harness.at(1850.0, lambda: snapshots.append(tracemalloc.take_snapshot().filter_traces(filters)))
+    tracemalloc.start()
+    harness.run(1900.0)
+    tracemalloc.stop()
+    growth = sum(stat.size_diff for stat in snapshots[1].compare_to(snapshots[0], "filename"))
+    mem_free = [line for _t, line in sendnode.log if line.startswith("Free Memory")]
+    print("send node heap growth over two publish intervals: {} bytes; {}".format(
+        growth, mem_free[-1] if mem_free else "no gc.mem_free() report"))
+
+
+def main():
+    global seconds
+    if len(sys.argv) > 1:
+        seconds = float(sys.argv[1])
+    print("node scripts on sim.harness, {:.0f} virtual s per run".format(seconds))
+    bus_and_loss()
+    display_latency()
+    sendnode_memory()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#
+# Event-loop profiler benchmark (host CPython)
+#
+# 1. Overhead: ntasks asyncio tasks that only yield (await asyncio.sleep(0))
+#    run for a fixed number of steps, created with asyncio.create_task() and
+#    with phonecan.profile.LoopProfiler.task(); the difference per step is
+#    the cost of the wrapper.
+# 2. Stall detection: code_homenode.py runs on sim.harness with two remotes,
+#    showing its own sensor values (the default selection), with the profile
+#    printed every profile_interval virtual seconds.  It runs once as it is
+#    and once with button_func() calling the blocking sleep(1) it used to;
+#    the profile must flag button_func (steps of 1 s, stalls) and event-loop
+#    lag in the second run only.  Frames sent and receive overflows show
+#    what the stall did to the rest of the node.
+#
+# Run from the repository root:  python bench/bench_loop_profile.py
+#
+import os
+import re
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.profile import LoopProfiler
+from sim.harness import Harness, ROOT
+
+ntasks = 8
+steps = 20000 # Per task
+seconds = 60.0 # Virtual, per harness run
+profile_interval = 20.0
+
+TASK_LINE = re.compile(r"Task (\w+): (\d+) steps, [\d.]+% busy, longest (\d+) ms, stalls (\d+) \((\d+) total\)")
+LAG_LINE = re.compile(r"Event loop lag: longest (\d+) ms")
+
+# (text in code_homenode.py, text it had with the blocking sleep)
+BLOCKING = [("import os\n", "from time import sleep\nimport os\n"),
+            ("            await asyncio.sleep(1)\n", "            sleep(1)\n")]
+
+
+async def yielder():
+    for _i in range(steps):
+        await asyncio.sleep(0)
+
+
+async def spin(profiler):
+    if profiler is None:
+        tasks = [asyncio.create_task(yielder()) for _i in range(ntasks)]
+    else:
+        tasks = [profiler.task("yielder{0}".format(i), yielder()) for i in range(ntasks)]
+    await asyncio.gather(*tasks)
+
+
+def overhead():
+    times = []
+    for profiler in (None, LoopProfiler()):
+        t0 = time.perf_counter()
+        asyncio.run(spin(profiler))
+        times.append((time.perf_counter() - t0)/(ntasks*steps))
+    return times
+
+
+def homenode(directory, blocking):
+    # Run code_homenode.py (with the old blocking sleep if blocking); returns the node
+    with open(os.path.join(ROOT, "code_homenode.py")) as f:
+        source = f.read()
+    source = re.sub(r"^profile_interval = [^#\n]*", "profile_interval = {0} ".format(profile_interval), source,
+                    count=1, flags=re.M)
+    if blocking:
+        for now, before in BLOCKING:
+            if now not in source:
+                raise ValueError("code_homenode.py no longer has {0!r}".format(now))
+            source = source.replace(now, before, 1)
+    path = os.path.join(directory, "code_homenode.py")
+    with open(path, "w") as f:
+        f.write(source)
+    harness = Harness()
+    home = harness.add(path, 0)
+    harness.add("code_remote1.py", 1)
+    harness.add("code_remote2.py", 2)
+    harness.run(seconds)
+    return home
+
+
+def profile(node):
+    # {task: (steps, longest ms, stalls total)} and the longest lag, from the last profile printed
+    tasks = {}
+    lag = None
+    for _t, line in node.log:
+        match = TASK_LINE.match(line)
+        if match:
+            name, count, longest, _stalls, total = match.groups()
+            tasks[name] = (int(count), int(longest), int(total))
+        match = LAG_LINE.match(line)
+        if match:
+            lag = int(match.group(1))
+    return tasks, lag
+
+
+def main():
+    plain, wrapped = overhead()
+    print("overhead: {0} tasks x {1} steps: {2:.2f} us per step plain, {3:.2f} us profiled (+{4:.2f} us)\n".format(
+        ntasks, steps, 1e6*plain, 1e6*wrapped, 1e6*(wrapped - plain)))
+    print("code_homenode.py, {0:.0f} virtual s, profile every {1:.0f} s (last one shown)".format(seconds, profile_interval))
+    directory = tempfile.mkdtemp()
+    ok = True
+    try:
+        for name, blocking in (("as it is", False), ("blocking sleep(1)", True)):
+            node = homenode(directory, blocking)
+            tasks, lag = profile(node)
+            print("\n{0}: sent {1} frames, {2} receive overflows, longest event-loop lag {3} ms".format(
+                name, node.can_bus.frames_sent, node.can_bus.rx_overflows, lag))
+            print("{0:>18} {1:>8} {2:>12} {3:>8}".format("task", "steps", "longest ms", "stalls"))
+            for task, (count, longest, total) in tasks.items():
+                print("{0:>18} {1:>8} {2:>12} {3:>8}".format(task, count, longest, total))
+            stalled = [task for task, (_count, _longest, total) in tasks.items() if total]
+            print("flagged:", ", ".join(stalled) if stalled else "nothing")
+            if blocking:
+                ok = ok and stalled == ["button_func"] and tasks["button_func"][1] >= 1000 and lag >= 500
+            else:
+                ok = ok and not stalled and lag is not None and lag < 200
+    finally:
+        shutil.rmtree(directory)
+    if not ok:
+        print("\nFAIL: the profile does not show the blocking sleep")
+        sys.exit(1)
+    print("\nPASS: the blocking sleep is flagged")
+
+
+if __name__ == "__main__":
+    main()
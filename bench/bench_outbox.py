@@ -0,0 +1,160 @@
+#
+# Store-and-forward check against a flaky broker (host CPython)
+#
+# Runs the send node's publish path (phonecan.outbox.Outbox queued by
+# publishtoaio() every publish_interval, phonecan.publish.Publisher flushing
+# it from its run() loop every loop_interval) on a virtual clock against
+# sim.fakemqtt's local broker, which goes down for outage intervals partway
+# through.  Every node's average in every interval has a distinct value, so
+# the broker's received group payloads can be checked record by record.
+#
+# For each outage length this reports the records sent and lost, and how
+# much heap allocated by phonecan code grew during the outage (the broker and
+# its threads share the process, so they are left out).  Exits non-zero if records
+# are lost or duplicated for an outage the outbox can hold, if the losses
+# for a longer outage are anything but the oldest evicted records, or if
+# the heap grows during an outage.
+#
+# Run from the repository root:  python bench/bench_outbox.py
+#
+import os
+import sys
+import json
+import tracemalloc
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.aggregate import NodeAggregator, TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.outbox import Outbox
+from phonecan.publish import Publisher, feed_key, iso_time
+from sim.fakemqtt import FakeBroker, FakeIO
+
+nnodes = 8
+capacity_intervals = 12 # Intervals the outbox holds
+nintervals = 40
+outage_start = 4 # Interval at which the broker goes down
+publish_interval = 900.0 # Seconds
+loop_interval = 5.0 # Seconds
+flush_interval = 60.0 # Seconds
+start_time = 1700000000 # Wall clock of interval 0
+heap_growth_limit = 512 # Bytes
+
+
+def interval_value(interval, node, q):
+    # Distinct per interval, node and quantity, at the outbox's resolution (0.01 C/%, 0.1 hPa)
+    if q == PRESSURE:
+        return round(1000.0 + interval + node/10, 1)
+    return round(10.0 + interval + node/10 + q/100, 2)
+
+
+def fill_stats(stats, interval):
+    for node in range(nnodes):
+        stats.add(node, TEMPERATURE, interval_value(interval, node, TEMPERATURE))
+        stats.add(node, HUMIDITY, interval_value(interval, node, HUMIDITY))
+        if node == 1:
+            stats.add(node, PRESSURE, interval_value(interval, node, PRESSURE))
+
+
+def expected_records(intervals):
+    records = set()
+    for interval in intervals:
+        created = iso_time(start_time + interval*int(publish_interval))
+        for node in range(nnodes):
+            for q in (TEMPERATURE, HUMIDITY, PRESSURE):
+                if q != PRESSURE or node == 1:
+                    records.add((created, feed_key(node, q), interval_value(interval, node, q)))
+    return records
+
+
+def received_records(broker):
+    records = []
+    for _t, _topic, payload in broker.publishes:
+        message = json.loads(payload)
+        for key, value in message["feeds"].items():
+            records.append((message["created_at"], key, value))
+    return records
+
+
+class Discard():
+    # stdout for the run: the publisher prints every connect attempt
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def phonecan_heap():
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, "*phonecan*")])
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+def run(outage):
+    broker = FakeBroker()
+    io = FakeIO(broker.port, time_scale=0.0001)
+    outbox = Outbox(nnodes*capacity_intervals)
+    publisher = Publisher(io, "cannetwork", outbox=outbox, flush_interval=flush_interval,
+                          mqtt=io.mqtt_client, username="user", qos=1)
+    stats = NodeAggregator()
+    growth = 0
+    now = 0.0
+    tracemalloc.start()
+    with contextlib.redirect_stdout(Discard()):
+        publisher.connect()
+        for interval in range(nintervals + capacity_intervals):
+            if interval == outage_start:
+                broker.set_down(True)
+                outage_heap = phonecan_heap()
+            if interval < nintervals:
+                fill_stats(stats, interval)
+                # publishtoaio()
+                outbox.put_stats(start_time + interval*int(publish_interval), stats, range(nnodes))
+                stats.reset()
+                publisher.flush(now)
+            if interval == outage_start + outage:
+                growth = phonecan_heap() - outage_heap
+                broker.set_down(False)
+            # The publisher task's loop until the next interval
+            for _tick in range(int(publish_interval/loop_interval)):
+                now += loop_interval
+                publisher.flush(now)
+    tracemalloc.stop()
+    broker.close()
+    return outbox, received_records(broker), growth
+
+
+def main():
+    failures = 0
+    print("outbox: {} records ({} bytes), {} nodes".format(nnodes*capacity_intervals, len(Outbox(nnodes*capacity_intervals).buf), nnodes))
+    # Values are feed values (node, quantity, interval); evicted counts outbox records (node, interval)
+    print("{:>9} {:>9} {:>9} {:>9} {:>9} {:>14}".format("outage", "values", "received", "lost", "evicted", "heap growth B"))
+    for outage in (1, capacity_intervals//2, capacity_intervals - 1, capacity_intervals + 4):
+        outbox, received, growth = run(outage)
+        expected = expected_records(range(nintervals))
+        got = set(received)
+        lost = expected - got
+        print("{:>9} {:>9} {:>9} {:>9} {:>9} {:>14}".format(outage, len(expected), len(received), len(lost), outbox.evicted, growth))
+        if len(received) != len(got) or got - expected:
+            print("FAIL: duplicated or unexpected records")
+            failures += 1
+        if outage < capacity_intervals:
+            if lost:
+                print("FAIL: lost records in an outage the outbox can hold")
+                failures += 1
+        else:
+            # Intervals queued while down: outage + 1 (the one ending as it comes back); the oldest go
+            nlost = outage + 1 - capacity_intervals
+            if lost != expected_records(range(outage_start, outage_start + nlost)):
+                print("FAIL: lost records other than the oldest")
+                failures += 1
+        if growth > heap_growth_limit:
+            print("FAIL: heap grew during the outage")
+            failures += 1
+    if failures:
+        sys.exit(1)
+    print("PASS: no loss within capacity, oldest-first eviction beyond it, bounded memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#
+# Adafruit IO publish benchmark (host CPython)
+#
+# Publishes nnodes nodes' averages every publish_interval to sim.fakemqtt's
+# local stand-in broker:
+#   old:       the previous publishtoaio(): reconnect, one publish_multiple
+#              per node (timeout=1 between feeds), disconnect
+#   publisher: phonecan.publish.Publisher, one long-lived session kept alive
+#              by its run() task and one group publish per interval
+# Reports connects, bytes on the wire (including an estimated TLS handshake
+# per connect and the keepalive pings) and the publish latency per interval:
+# from the start of the publish until the call has returned (it blocks the
+# other tasks) and the broker has the last message.  Modelled
+# waits (handshake round trips, publish_multiple sleeps) run time_scale times
+# faster so the run is quick and are scaled back up in the reported latency.
+#
+# Run from the repository root:  python bench/bench_publish.py
+#
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.aggregate import NodeAggregator, TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.publish import Publisher
+from sim.fakemqtt import FakeBroker, FakeIO
+
+nnodes = 8
+nintervals = 8
+publish_interval = 900.0 # Seconds (node time)
+loop_interval = 5.0 # Seconds (node time)
+time_scale = 0.0005
+group = "cannetwork"
+
+
+def fill_stats(stats, interval):
+    for node in range(nnodes):
+        for i in range(10):
+            stats.add(node, TEMPERATURE, 20.0 + node + 0.01*i + interval)
+            stats.add(node, HUMIDITY, 40.0 + node + 0.02*i)
+            if node == 1:
+                stats.add(node, PRESSURE, 1013.2 + 0.1*i)
+
+
+def last_arrival(broker, count):
+    # Time the broker received publish number count (it runs in another thread)
+    while len(broker.publishes) < count:
+        time.sleep(0.0001)
+    return broker.publishes[count - 1][0]
+
+
+def latency(io, waited, start, arrival):
+    # Modelled waits at full length plus the real time spent outside them
+    modelled = io.waited - waited
+    return modelled + (arrival - start - modelled*time_scale)
+
+
+def old_publish(io, stats):
+    if not io.is_connected:
+        io.reconnect()
+    for node in range(nnodes):
+        tstat = stats.stat(node, TEMPERATURE)
+        rhstat = stats.stat(node, HUMIDITY)
+        if tstat.count > 0 and rhstat.count > 0:
+            io.publish_multiple([("cannetwork.nodeid", node), ("cannetwork.nodetemp", tstat.mean),
+                                 ("cannetwork.nodehumid", rhstat.mean)], timeout=1, is_group=True)
+    stats.reset()
+    io.disconnect()
+
+
+async def run_old(broker, io, stats, latencies):
+    io.connect()
+    for interval in range(nintervals):
+        fill_stats(stats, interval)
+        waited, start = io.waited, time.perf_counter()
+        old_publish(io, stats)
+        latencies.append(latency(io, waited, start, last_arrival(broker, (interval + 1)*3*nnodes)))
+        await asyncio.sleep(publish_interval*time_scale)
+
+
+async def run_publisher(broker, io, stats, latencies):
+    publisher = Publisher(io, group, loop_interval=loop_interval*time_scale)
+    publisher.connect()
+    task = asyncio.create_task(publisher.run())
+    for interval in range(nintervals):
+        fill_stats(stats, interval)
+        waited, start = io.waited, time.perf_counter()
+        publisher.publish(stats, range(nnodes))
+        stats.reset()
+        latencies.append(latency(io, waited, start, last_arrival(broker, interval + 1)))
+        await asyncio.sleep(publish_interval*time_scale)
+    task.cancel()
+
+
+def main():
+    print("{} nodes, {} intervals of {:.0f} s".format(nnodes, nintervals, publish_interval))
+    print("{:>10} {:>9} {:>10} {:>14} {:>14}".format("mode", "connects", "publishes", "bytes/interval", "latency s"))
+    for name, run in (("old", run_old), ("publisher", run_publisher)):
+        broker = FakeBroker()
+        io = FakeIO(broker.port, time_scale=time_scale)
+        latencies = []
+        asyncio.run(run(broker, io, NodeAggregator(), latencies))
+        wire = io.bytes_sent + io.bytes_received
+        print("{:>10} {:>9} {:>10} {:>14.0f} {:>14.4f}".format(
+            name, io.connects, len(broker.publishes), wire/nintervals, sum(latencies)/len(latencies)))
+        broker.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#
+# Remote node light sleep benchmark (host CPython)
+#
+# Runs code_remote1.py and code_remote2.py on sim.harness's fake boards and
+# virtual clock for a few virtual minutes and measures how much of the time
+# each spends in alarm.light_sleep_until_alarms() (the fake alarm module of
+# sim/fakeboard.py), with:
+#
+#   awake, debug 2:  no alarm module (the tasks wait with asyncio.sleep, as
+#                    the old blocking loop did with time.sleep) and every
+#                    reading printed
+#   awake:           no alarm module, nothing printed
+#   sleep, debug 1:  light sleep between task deadlines, sends printed
+#   sleep:           light sleep, nothing printed
+#   sleep, summary:  light sleep with frame_format = "summary"
+#
+# The settings are changed in temporary copies of the scripts.  Time awake
+# covers sensor reads, event-loop passes (sim/harness.py's loop_cost) and
+# printing; prints and frames cost extra current from the energy model of
+# bench_report_policy.py, with the board's current in light sleep below.
+#
+# Run from the repository root:  python bench/bench_remote_sleep.py [seconds]
+#
+import os
+import re
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_report_policy import (battery_mah, idle_ma, frame_ma, frame_s, print_ma, print_s)
+from sim.harness import Harness, ROOT
+
+seconds = 600.0
+sleep_ma = 20.0 # RP2040 in light sleep with the MCP2515, transceiver and sensor still powered (rough)
+
+CONFIGS = [
+    ("awake, debug 2", False, {"debug": "2"}),
+    ("awake", False, {}),
+    ("sleep, debug 1", True, {"debug": "1"}),
+    ("sleep", True, {}),
+    ("sleep, summary", True, {"frame_format": '"summary"'}),
+]
+
+
+def variant(script, settings, directory):
+    # Copy of script with top-level settings replaced (name = value lines)
+    with open(os.path.join(ROOT, script)) as f:
+        source = f.read()
+    for name, value in settings.items():
+        source, n = re.subn(r"^{0} = [^#\n]*".format(name), "{0} = {1} ".format(name, value), source,
+                            count=1, flags=re.M)
+        if not n:
+            raise ValueError("{0} has no setting {1}".format(script, name))
+    path = os.path.join(directory, script)
+    with open(path, "w") as f:
+        f.write(source)
+    return path
+
+
+def run(light_sleep, settings, directory):
+    harness = Harness()
+    nodes = []
+    for nodeid, script in ((1, "code_remote1.py"), (2, "code_remote2.py")):
+        node = harness.add(variant(script, settings, directory), nodeid)
+        if not light_sleep:
+            del node.modules["alarm"] # import alarm fails, so the scripts wait awake
+        nodes.append(node)
+    harness.run(seconds)
+    results = []
+    for node in nodes:
+        # A print keeps the board awake for print_s too
+        awake = min(1.0, 1.0 - node.light_sleep/seconds + print_s*node.lines/seconds)
+        frames = node.can_bus.frames_sent
+        avg_ma = (idle_ma*awake + sleep_ma*(1 - awake) + frame_ma*frame_s*frames/seconds +
+                  print_ma*print_s*node.lines/seconds)
+        results.append((node.name, awake, node.light_sleeps, frames, avg_ma))
+    return results
+
+
+def main():
+    global seconds
+    if len(sys.argv) > 1:
+        seconds = float(sys.argv[1])
+    print("{0:.0f} virtual s per run; {1:.0f} mA awake, {2:.0f} mA in light sleep, {3:.0f} mAh battery\n".format(
+        seconds, idle_ma, sleep_ma, battery_mah))
+    print("{0:>16} {1:>16} {2:>8} {3:>8} {4:>7} {5:>7} {6:>6}".format(
+        "config", "node", "awake", "sleeps", "frames", "mA", "days"))
+    directory = tempfile.mkdtemp()
+    try:
+        for name, light_sleep, settings in CONFIGS:
+            for node, awake, sleeps, frames, avg_ma in run(light_sleep, settings, directory):
+                print("{0:>16} {1:>16} {2:>8.1%} {3:>8} {4:>7} {5:>7.1f} {6:>6.1f}".format(
+                    name, node, awake, sleeps, frames, avg_ma, battery_mah/avg_ma/24))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#
+# Reporting policy simulator (host CPython)
+#
+# Replays a sensor trace through phonecan.policy.ReportPolicy the way the
+# remote node loop does (read every sendint seconds, send when due) and
+# reports for each policy:
+#   - frames sent per hour and bus bits per hour
+#   - longest gap between frames (receivers must use a stale_after above it)
+#   - largest difference between the value a receiver holds and the sensor
+#   - estimated average current and battery life
+#
+# The trace is either a CSV file given on the command line (columns:
+# seconds, temperature C, humidity %rH[, pressure hPa]; a header line is
+# skipped) or a synthetic 24 hour trace at 1 s: daily temperature swing,
+# heating cycles, a shower-like humidity spike, slow pressure drift and
+# SHT4x-sized sensor noise.
+#
+# The energy model is a rough one for the RP2040 CAN Feather on a 2500 mAh
+# LiPo, with the idle current chosen so sending every second with prints
+# matches the README's ~1.5 days.  The idle current dominates while the loop
+# uses time.sleep(), so fewer frames mostly shows up as bus load; see the
+# constants below.
+#
+# Run from the repository root:  python bench/bench_report_policy.py [trace.csv]
+#
+import os
+import sys
+import math
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.policy import ReportPolicy, DEADBANDS, HEARTBEAT
+
+sendint = 1.0 # Seconds between sensor reads (as in the remote scripts)
+
+# Energy model (mA and seconds)
+battery_mah = 2500.0
+idle_ma = 68.0 # Board, MCP2515 and transceiver awake in time.sleep()
+read_ma, read_s = 20.0, 0.010 # Extra current and time for one sensor read
+frame_ma, frame_s = 30.0, 0.003 # Extra current and time to load and send one frame
+print_ma, print_s = 20.0, 0.0015 # Extra current and time per USB serial print line
+prints_per_read = 4 # Lines printed each loop with debug on
+prints_per_frame = 2
+frame_bits = 131 # 29-bit ID, 8 data bytes, with typical stuffing
+
+
+def synthetic_trace(hours=24, seed=1):
+    rng = random.Random(seed)
+    trace = []
+    for i in range(int(hours*3600/sendint)):
+        t = i*sendint
+        day = 2*math.pi*t/86400.0
+        temperature = 20.5 + 1.5*math.sin(day - 2.0)
+        # Heating cycles: 20 minutes on, 40 off, half a degree
+        if (t % 3600) < 1200:
+            temperature += 0.5*(t % 3600)/1200
+        else:
+            temperature += 0.5*(1 - ((t % 3600) - 1200)/2400)
+        humidity = 45.0 - 5.0*math.sin(day - 2.0)
+        # Morning shower: +25 %rH decaying over half an hour
+        if 7*3600 <= t < 9*3600:
+            humidity += 25.0*math.exp(-(t - 7*3600)/1800.0)
+        pressure = 1013.0 + 3.0*math.sin(day/2)
+        trace.append((t,
+                      temperature + rng.gauss(0, 0.02),
+                      humidity + rng.gauss(0, 0.1),
+                      pressure + rng.gauss(0, 0.03)))
+    return trace
+
+
+def load_trace(path):
+    trace = []
+    with open(path) as f:
+        for line in f:
+            fields = line.strip().split(",")
+            try:
+                row = [float(x) for x in fields]
+            except ValueError:
+                continue # Header or blank line
+            if len(row) == 3:
+                row.append(None)
+            trace.append(tuple(row[:4]))
+    return trace
+
+
+def replay(trace, policy, debug=False):
+    frames = 0
+    last_sent_time = trace[0][0]
+    max_gap = 0.0
+    held = None
+    max_error = [0.0, 0.0, 0.0]
+    for row in trace:
+        now = row[0]
+        values = row[1:]
+        if policy.check(values, now):
+            frames += 1
+            max_gap = max(max_gap, now - last_sent_time)
+            last_sent_time = now
+            held = values
+        for q, value in enumerate(values):
+            if value is not None:
+                max_error[q] = max(max_error[q], abs(value - held[q]))
+    seconds = trace[-1][0] - trace[0][0] + sendint
+    reads = len(trace)
+    charge = idle_ma*seconds + read_ma*read_s*reads + frame_ma*frame_s*frames
+    if debug:
+        charge += print_ma*print_s*(prints_per_read*reads + prints_per_frame*frames)
+    avg_ma = charge/seconds
+    return {
+        "frames_hr": frames*3600.0/seconds,
+        "bits_hr": frames*frame_bits*3600.0/seconds,
+        "max_gap": max_gap,
+        "max_error": max_error,
+        "avg_ma": avg_ma,
+        "days": battery_mah/avg_ma/24.0,
+    }
+
+
+def main():
+    if len(sys.argv) > 1:
+        trace = load_trace(sys.argv[1])
+        print("Trace: {} ({} readings)".format(sys.argv[1], len(trace)))
+    else:
+        trace = synthetic_trace()
+        print("Trace: synthetic 24 h at {} s ({} readings)".format(sendint, len(trace)))
+    policies = [
+        ("every read, debug", ReportPolicy(DEADBANDS, 0), True),
+        ("every read", ReportPolicy(DEADBANDS, 0), False),
+        ("default", ReportPolicy(DEADBANDS, HEARTBEAT), False),
+        ("coarse", ReportPolicy([0.2, 1.0, 0.5], 300.0), False),
+        ("heartbeat only", ReportPolicy([None, None, None], HEARTBEAT), False),
+    ]
+    print("{:>18} {:>9} {:>9} {:>8} {:>22} {:>7} {:>6}".format(
+        "policy", "frames/h", "bits/h", "gap s", "max err C/%rH/hPa", "mA", "days"))
+    for name, policy, debug in policies:
+        r = replay(trace, policy, debug)
+        err = "/".join("{:.2f}".format(e) for e in r["max_error"])
+        print("{:>18} {:>9.0f} {:>9.0f} {:>8.0f} {:>22} {:>7.2f} {:>6.2f}".format(
+            name, r["frames_hr"], r["bits_hr"], r["max_gap"], err, r["avg_ma"], r["days"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#
+# Receive frame-loss stress test (host CPython)
+#
+# nnodes simulated nodes each send a temperature and a humidity frame
+# rate_hz times a second onto sim.fakecan's bus.  The receiving MCP2515 has
+# two hardware buffers, as on the real chip.  Two receivers are compared:
+#
+#   legacy: collectnodes() before RxDrain: sample in_waiting(), read that many
+#           frames, then sleep read_interval
+#   drain:  phonecan.canrx.RxDrain task feeding a ring, with the consumer
+#           still only reading every read_interval
+#
+# Exits non-zero if the drain receiver loses any frame.
+#
+# Run from the repository root:  python bench/bench_rx_loss.py [nnodes] [rate_hz]
+#
+import os
+import sys
+import random
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.canrx import AsyncReceiver, RxDrain
+from sim.fakecan import FakeBus, FakeMCP2515, Message
+
+read_interval = 0.5 # Seconds, as on the send node
+ring_size = 128
+poll_interval = 0 # Seconds; drain continuously
+frame_time = 0.00044 # Seconds on the wire per 4-byte extended frame at 250 kbit/s
+spi_delay = 0.0002 # Seconds per frame read
+run_time = 5.0 # Seconds
+
+
+def node_of(msg_id):
+    return msg_id // 2
+
+
+async def sender(bus, nodeid, rate_hz, sent):
+    controller = FakeMCP2515(bus)
+    rng = random.Random(nodeid)
+    await asyncio.sleep(rng.random()/rate_hz)
+    while True:
+        controller.send(Message(id=2*nodeid, data=b"\x14\x00\xf4\x01", extended=True))
+        controller.send(Message(id=2*nodeid + 1, data=b"\x2d\x00\x64\x00", extended=True))
+        sent[nodeid] += 2
+        await asyncio.sleep(1/rate_hz)
+
+
+async def legacy_rx(can_bus, received):
+    while True:
+        with can_bus.listen(timeout=5.0) as listener:
+            message_count = listener.in_waiting()
+            for _i in range(message_count):
+                msg = listener.receive()
+                received[node_of(msg.id)] += 1
+        await asyncio.sleep(read_interval)
+
+
+async def drain_rx(can_bus, received, result):
+    rxdrain = RxDrain(AsyncReceiver(can_bus, poll_interval=poll_interval), ring_size=ring_size, node_of=node_of)
+    result.append(rxdrain)
+    asyncio.create_task(rxdrain.run())
+    while True:
+        while True:
+            msg = rxdrain.get_nowait()
+            if msg is None:
+                break
+            received[node_of(msg.id)] += 1
+        await asyncio.sleep(read_interval)
+
+
+async def run(mode, nnodes, rate_hz):
+    bus = FakeBus(frame_time=frame_time)
+    can_bus = FakeMCP2515(bus, spi_delay=spi_delay)
+    sent = [0]*nnodes
+    received = [0]*nnodes
+    result = []
+    tasks = [asyncio.create_task(sender(bus, n, rate_hz, sent)) for n in range(nnodes)]
+    tasks.append(asyncio.create_task(bus.run()))
+    if mode == "legacy":
+        rx = asyncio.create_task(legacy_rx(can_bus, received))
+    else:
+        rx = asyncio.create_task(drain_rx(can_bus, received, result))
+    await asyncio.sleep(run_time)
+    for task in tasks[:-1]:
+        task.cancel()
+    # Let the bus and the receiver catch up with frames already on their way
+    await asyncio.sleep(2*read_interval)
+    tasks[-1].cancel()
+    rx.cancel()
+    hw_overflows = result[0].stats.hw_overflows if result else None
+    return sent, received, can_bus.rx_overflows, hw_overflows
+
+
+def main():
+    nnodes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rate_hz = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    print("{} nodes x {} Hz x 2 frames, {} s".format(nnodes, rate_hz, run_time))
+    lost_drain = 0
+    for mode in ("legacy", "drain"):
+        sent, received, overflows, flagged = asyncio.run(run(mode, nnodes, rate_hz))
+        print("\n{}: {} overflows at the MCP2515, {} seen in EFLG".format(mode, overflows, flagged))
+        print("{:>6} {:>8} {:>8} {:>8}".format("node", "sent", "recv", "loss %"))
+        for node in range(nnodes):
+            loss = 100.0*(sent[node] - received[node])/sent[node]
+            print("{:>6} {:>8} {:>8} {:>8.1f}".format(node, sent[node], received[node], loss))
+        if mode == "drain":
+            lost_drain = sum(sent) - sum(received)
+    if lost_drain:
+        print("\nFAIL: drain receiver lost {} frames".format(lost_drain))
+        sys.exit(1)
+    print("\nPASS: drain receiver lost no frames")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#
+# CAN receive event-loop stall benchmark (host CPython)
+#
+# Runs a receive task against sim.fakecan under bursty traffic, alongside a
+# ticker task that wants to run every tick_interval (standing in for the
+# button, sendmeas and MQTT tasks).  The ticker records how late it wakes up.
+#
+#   legacy: the old pattern from button_func()/collectnodes(): open
+#           can_bus.listen(), read in_waiting() frames with receive(), sleep
+#   async:  phonecan.canrx.AsyncReceiver, which yields after every frame
+#
+# Run from the repository root:  python bench/bench_rx_stall.py
+#
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.canrx import AsyncReceiver
+from sim.fakecan import FakeBus, FakeMCP2515, Message
+
+burst_size = 40 # Frames per burst
+burst_interval = 0.5 # Seconds between bursts
+spi_delay = 0.002 # Seconds the CPU is blocked per frame read over SPI (CircuitPython driver)
+tick_interval = 0.005 # Seconds
+read_interval = 0.0 # Seconds, as on the home node
+run_time = 5.0 # Seconds
+
+
+async def traffic(bus, sender):
+    seq = 0
+    while True:
+        for _i in range(burst_size):
+            bus.transmit(Message(id=seq % 8, data=b"\x14\x00\xf4\x01", extended=True), sender)
+            seq += 1
+        await asyncio.sleep(burst_interval)
+
+
+async def ticker(lags):
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(tick_interval)
+        lags.append(time.perf_counter() - t0 - tick_interval)
+
+
+async def legacy_rx(can_bus, counter):
+    while True:
+        with can_bus.listen(timeout=5.0) as listener:
+            message_count = listener.in_waiting()
+            for _i in range(message_count):
+                listener.receive()
+                counter[0] += 1
+        await asyncio.sleep(read_interval)
+
+
+async def async_rx(can_bus, counter):
+    receiver = AsyncReceiver(can_bus, poll_interval=0.001)
+    async for _msg in receiver:
+        counter[0] += 1
+
+
+async def run(rx):
+    bus = FakeBus()
+    sender = FakeMCP2515(bus)
+    # Unlimited hardware buffers so both variants see the same bursts
+    receiver = FakeMCP2515(bus, rx_buffers=None, spi_delay=spi_delay)
+    lags = []
+    counter = [0]
+    tasks = [asyncio.create_task(traffic(bus, sender)),
+             asyncio.create_task(ticker(lags)),
+             asyncio.create_task(rx(receiver, counter))]
+    await asyncio.sleep(run_time)
+    for task in tasks:
+        task.cancel()
+    lags.sort()
+    return counter[0], lags
+
+
+def main():
+    print("{:>8} {:>8} {:>12} {:>12} {:>12}".format("mode", "frames", "p50 lag ms", "p99 lag ms", "max lag ms"))
+    for name, rx in (("legacy", legacy_rx), ("async", async_rx)):
+        frames, lags = asyncio.run(run(rx))
+        print("{:>8} {:>8} {:>12.2f} {:>12.2f} {:>12.2f}".format(
+            name, frames, 1000*lags[len(lags)//2], 1000*lags[int(len(lags)*0.99)], 1000*lags[-1]))
+
+
+if __name__ == "__main__":
+    main()
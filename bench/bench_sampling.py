@@ -0,0 +1,86 @@
+#
+# Local sensor sampling benchmark (host CPython)
+#
+# Runs the send node's and home node's local-sensor tasks against
+# sim.fakesensor.FakeSHT4x, which counts I2C measurements and the time the
+# CPU is blocked in them:
+#   old:     every task reads .temperature and .relative_humidity itself
+#            (send node: sendmeas every send_interval, collectnodes every
+#            read_interval; home node: sendmeas and button_func with the
+#            home node selected)
+#   sampler: one phonecan.sampler.Sampler task using .measurements, the other
+#            tasks use its sample
+# Intervals and the sensor's measurement time are divided by speedup so a
+# node-minute takes a few seconds; results are per node-minute.
+#
+# Run from the repository root:  python bench/bench_sampling.py
+#
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.sampler import Sampler
+from sim.fakesensor import FakeSHT4x
+
+speedup = 20.0
+node_seconds = 60.0
+send_interval = 1.0 / speedup # Seconds (both nodes)
+read_interval = 0.5 / speedup # Seconds (send node collectnodes)
+button_interval = 1.0 / speedup # Seconds (home node button_func, home selected)
+sample_interval = 1.0 / speedup
+measure_time = 0.0083 # Seconds per SHT4x measurement on the node
+
+
+async def every(interval, body):
+    while True:
+        body()
+        await asyncio.sleep(interval)
+
+
+def old_tasks(sensor, node):
+    def read_both():
+        return sensor.temperature, sensor.relative_humidity
+    if node == "send":
+        return [every(send_interval, read_both), every(read_interval, read_both)]
+    return [every(send_interval, read_both), every(button_interval, read_both)]
+
+
+def sampler_tasks(sensor, node):
+    sampler = Sampler(sensor, interval=sample_interval)
+    sampler.read()
+    seen = [None]
+
+    def use_sample():
+        return sampler.temperature, sampler.humidity
+
+    def add_new_sample():
+        if sampler.count != seen[0]:
+            seen[0] = sampler.count
+    if node == "send":
+        return [sampler.run(), every(send_interval, use_sample), every(read_interval, add_new_sample)]
+    return [sampler.run(), every(send_interval, use_sample), every(button_interval, use_sample)]
+
+
+async def run(make_tasks, node):
+    sensor = FakeSHT4x(measure_time=measure_time / speedup)
+    tasks = [asyncio.create_task(t) for t in make_tasks(sensor, node)]
+    await asyncio.sleep(node_seconds / speedup)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    minutes = node_seconds / 60.0
+    return sensor.transactions / minutes, 1000.0 * sensor.busy * speedup / minutes
+
+
+def main():
+    print("{:>6} {:>8} {:>20} {:>20}".format("node", "tasks", "transactions/min", "blocked ms/min"))
+    for node in ("send", "home"):
+        for name, make in (("old", old_tasks), ("sampler", sampler_tasks)):
+            transactions, blocked = asyncio.run(run(make, node))
+            print("{:>6} {:>8} {:>20.0f} {:>20.0f}".format(node, name, transactions, blocked))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#
+# Sequence number loss accounting benchmark (host CPython)
+#
+# 1. Synthetic streams: every node sends numbered frames (wrapping at 256);
+#    on the way each frame is dropped, duplicated or swapped with the next
+#    one with the given probabilities, and one node restarts half way
+#    through.  phonecan.sequence.SeqTracker's counts are checked against
+#    what was actually done to the streams.
+# 2. Lossy bus: nnodes nodes send compact frames at rate Hz each through
+#    phonecan.tx on sim.fakecan's bus (arbitration, real frame lengths,
+#    optional corrupted frames) to a receiver with the MCP2515's two receive
+#    buffers read every read_interval seconds, as collectnodes() once did,
+#    so frames are lost to receive overflows.  The loss counted from the
+#    sequence numbers is compared with the frames sent and not received.
+#    With very slow reads a node can go unheard for 128 frames or more,
+#    which 8-bit numbers cannot tell from a shorter gap; those runs are
+#    shown but not checked.
+# 3. The cost of track() per frame.
+#
+# Run from the repository root:  python bench/bench_sequence.py
+#
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.codec import pack_compact_into
+from phonecan.registry import NodeRegistry, COMPACT
+from phonecan.sequence import SeqTracker, MISSING, DUPLICATES, OUT_OF_ORDER, RESYNCS
+from phonecan.tx import Transmitter, compact_slots
+from sim.busload import frame_timer
+from sim.fakecan import FakeBus, FakeMCP2515, Match, Message
+from sim.vclock import VirtualClock
+
+nnodes = 8
+frames = 5000 # Per node, synthetic streams
+drop, duplicate, swap = 0.05, 0.01, 0.01
+rate = 10.0 # Frames per second per node on the bus
+bitrate = 125000
+seconds = 60.0
+
+
+def synthetic(seed=1):
+    rng = random.Random(seed)
+    tracker = SeqTracker()
+    ok = True
+    print("{:>5} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format("node", "dropped", "missing", "dups", "counted",
+                                                           "swapped", "late"))
+    for nodeid in range(nnodes):
+        numbers = list(range(frames))
+        if nodeid == 1:
+            # Restarts, counting from 0 again; a restart is only seen when the count was under 128
+            restart = frames//2 - frames//2 % 256 + 100
+            numbers = numbers[:restart] + list(range(frames - restart))
+        arrived = []
+        dropped = dups = swaps = 0
+        i = 0
+        while i < len(numbers):
+            n = numbers[i]
+            r = rng.random()
+            if r < drop:
+                dropped += 1
+            elif r < drop + swap and i + 1 < len(numbers):
+                arrived += [numbers[i + 1], n]
+                swaps += 1
+                i += 1
+            else:
+                arrived.append(n)
+                if r < drop + swap + duplicate:
+                    arrived.append(n)
+                    dups += 1
+            i += 1
+        passed = sum(1 for n in arrived if tracker.track(nodeid, COMPACT, n % 256))
+        counts = tracker.nodes[nodeid]
+        # Frames dropped at the very end of a stream cannot be seen
+        trailing = 0
+        for n in reversed(numbers):
+            if n in arrived:
+                break
+            trailing += 1
+        good = (counts[MISSING] == dropped - trailing and counts[DUPLICATES] == dups and
+                counts[OUT_OF_ORDER] == swaps and passed == len(arrived) - dups and
+                counts[RESYNCS] == (1 if nodeid == 1 else 0))
+        ok = ok and good
+        print("{:>5} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}{}".format(
+            nodeid, dropped, counts[MISSING], dups, counts[DUPLICATES], swaps, counts[OUT_OF_ORDER],
+            "" if good else "  MISMATCH"))
+    return ok
+
+
+def lossy_bus(read_interval, error_rate=0.0, seed=1):
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    bus = FakeBus(frame_timer(bitrate, "typical"), clock=clock)
+    bus.error_rate = error_rate
+    registry = NodeRegistry(range(nnodes))
+    receiver = FakeMCP2515(bus)
+    listener = receiver.listen(matches=registry.matches(Match), timeout=0)
+    tracker = SeqTracker()
+    received = [0]*nnodes
+
+    def add(_nodeid, _quantity, _value):
+        pass
+
+    def read():
+        while listener.in_waiting():
+            nodeid = registry.decode(listener.receive(), add, seq=tracker.track)
+            if nodeid is not None:
+                received[nodeid] += 1
+        clock.call_later(read_interval, read)
+
+    def sender(tx):
+        seq = [0]
+
+        def send():
+            pack_compact_into(tx.buffer(0), seq[0], 21.0, 45.0)
+            if tx.send(0):
+                seq[0] = (seq[0] + 1) % 256
+            clock.call_later(1/rate + rng.uniform(-0.005, 0.005), send)
+        return send
+
+    senders = []
+    for nodeid in range(nnodes):
+        tx = Transmitter(FakeMCP2515(bus), Message, compact_slots(nodeid, True))
+        senders.append(tx)
+        clock.call_later(rng.uniform(0, 1/rate), sender(tx))
+    clock.call_later(0.0, read)
+    clock.run(seconds)
+    sent = sum(tx.sent for tx in senders)
+    got = sum(received)
+    missing = sum(counts[MISSING] for counts in tracker.nodes.values())
+    rates = [tracker.loss_rate(nodeid) for nodeid in range(nnodes)]
+    print("{:>8.3f} {:>7.2f} {:>8} {:>9} {:>8} {:>9} {:>10.1%} {:>10.1%}".format(
+        read_interval, error_rate, sent, got, sent - got, missing, (sent - got)/sent, sum(rates)/len(rates)))
+    return sent - got, missing
+
+
+def cost():
+    tracker = SeqTracker()
+    n = 200000
+    t0 = time.perf_counter()
+    for i in range(n):
+        tracker.track(i & 7, COMPACT, (i >> 3) & 0xFF)
+    return (time.perf_counter() - t0)/n
+
+
+def main():
+    print("synthetic streams: {} nodes x {} frames, drop {:g}, duplicate {:g}, swap {:g}; node 1 restarts".format(
+        nnodes, frames, drop, duplicate, swap))
+    ok = synthetic()
+    print("\nlossy bus: {} nodes at {:g} Hz, {} bit/s, {:.0f} virtual s, receiver with two buffers".format(
+        nnodes, rate, bitrate, seconds))
+    print("{:>8} {:>7} {:>8} {:>9} {:>8} {:>9} {:>10} {:>10}".format("read s", "errors", "sent", "received", "lost",
+                                                                   "missing", "loss", "rolling"))
+    for read_interval, error_rate, checked in ((0.002, 0.0, True), (0.002, 0.05, True), (0.01, 0.0, True),
+                                               (0.02, 0.0, True), (0.1, 0.0, False), (0.5, 0.0, False)):
+        lost, missing = lossy_bus(read_interval, error_rate)
+        if checked:
+            # Frames lost after a node's last received frame are not seen yet
+            ok = ok and 0 <= lost - missing <= nnodes
+        else:
+            print("         (gaps of 128+ frames alias: not checked)")
+    print("\ntrack(): {:.2f} us per frame".format(1e6*cost()))
+    if not ok:
+        print("FAIL: sequence counts do not match")
+        sys.exit(1)
+    print("PASS: sequence counts match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#
+# Send node startup benchmark (host CPython)
+#
+# Boots code_sendnode.py on sim.harness with two remotes and times, from
+# power on (virtual time 0):
+#
+#   first tx      the send node's first CAN frame
+#   first rx      the first frame it received from a remote
+#   wifi          WiFi joined (the fake wifi.radio, sim/fakeboard.py)
+#   broker        Adafruit IO session open
+#   publish       first group publish to Adafruit IO
+#
+# and the frames it received and lost to receive overflows during the run
+# (frames arriving while a WiFi join blocks the node are lost once its two
+# receive buffers are full; the home node sends its first frame at boot and
+# the remotes theirs about a second later), for access points that join
+# quickly, slowly, fail the first joins, or never answer.
+# Each runs with the script as it is (CAN tasks first, WiFi joined in the
+# background by phonecan.network.WifiLink) and with the WiFi join and
+# io.connect() it used to make at import put back in a temporary copy.  A
+# failed join at import hard reset the board after 30 s, which ends that
+# node's run here (reset); the board would boot and try again, from nothing.
+# The background runs must send and receive their first frames within
+# first_frame seconds and lose no more than max_lost frames.
+#
+# Run from the repository root:  python bench/bench_startup.py [seconds]
+#
+import os
+import sys
+import shutil
+import contextlib
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sim.fakeboard import Reset
+from sim.harness import Harness, ROOT
+
+seconds = 240.0
+step = 0.05 # Seconds between checks of the counters
+first_frame = 1.0 # Seconds from boot the first frame sent and received may take
+max_lost = 2 # Frames the send node may lose to receive overflows in a run
+
+# (name, join_time s, join_failures, network down)
+ACCESS_POINTS = [
+    ("fast AP", 1.0, 0, False),
+    ("slow AP", 8.0, 0, False),
+    ("3 failed joins", 8.0, 3, False),
+    ("no AP", 8.0, 0, True),
+]
+
+# What code_sendnode.py did at import before the CAN tasks existed
+AT_IMPORT = """import microcontroller
+try:
+    print("Connecting to %s" % os.getenv("CIRCUITPY_WIFI_SSID"))
+    wifi.radio.connect(os.getenv("CIRCUITPY_WIFI_SSID"), os.getenv("CIRCUITPY_WIFI_PASSWORD"))
+    print("Connected to %s!" % os.getenv("CIRCUITPY_WIFI_SSID"))
+except Exception as e:  # pylint: disable=broad-except
+    print("Failed to connect to WiFi. Error:", e, "\\nBoard will hard reset in 30 seconds.")
+    time.sleep(30)
+    microcontroller.reset()
+start_mqtt()
+if not io.is_connected:
+    print("Connecting to MQTT Broker...")
+    io.connect()
+"""
+MAIN = "\nasyncio.run(main())"
+
+
+def sendnode(directory, at_import):
+    # Path of code_sendnode.py, or a copy that joins WiFi at import
+    if not at_import:
+        return "code_sendnode.py"
+    with open(os.path.join(ROOT, "code_sendnode.py")) as f:
+        source = f.read()
+    if MAIN not in source:
+        raise ValueError("code_sendnode.py no longer ends with asyncio.run(main())")
+    path = os.path.join(directory, "code_sendnode.py")
+    with open(path, "w") as f:
+        f.write(source.replace(MAIN, "\n" + AT_IMPORT + MAIN, 1))
+    return path
+
+
+def run(directory, at_import, join_time, join_failures, down):
+    harness = Harness()
+    network = harness.network
+    network.join_time = join_time
+    network.join_failures = join_failures
+    network.set_down(down)
+    send = harness.add(sendnode(directory, at_import), 3)
+    harness.add("code_remote1.py", 1)
+    harness.add("code_remote2.py", 2)
+    radio = send.modules["wifi"].radio
+    found = {}
+
+    def first(name, happened):
+        if name not in found and happened:
+            found[name] = harness.clock.now
+
+    def check():
+        can_bus = send.can_bus
+        first("first tx", can_bus.frames_sent)
+        first("first rx", sum(listener.frames_handled for listener in can_bus.listeners))
+        first("wifi", radio.connected)
+        first("broker", network.connects)
+        first("publish", network.published)
+        first("reset", isinstance(send.error, Reset))
+
+    for i in range(int(seconds/step)):
+        harness.at(i*step, check)
+    try:
+        # The phonecan modules print to the host's stdout, not the node's log
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            harness.run(seconds)
+    except RuntimeError:
+        if not isinstance(send.error, Reset):
+            raise
+    received = sum(listener.frames_handled for listener in send.can_bus.listeners)
+    return found, received, send.can_bus.rx_overflows
+
+
+def main():
+    global seconds
+    if len(sys.argv) > 1:
+        seconds = float(sys.argv[1])
+    columns = ("first tx", "first rx", "wifi", "broker", "publish", "reset")
+    print("code_sendnode.py boot with two remotes, {0:.0f} virtual s; times in s from power on\n".format(seconds))
+    print("{0:>15} {1:>10} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>9} {8:>9} {9:>9}".format(
+        "access point", "wifi", *columns, "received", "rx lost"))
+    directory = tempfile.mkdtemp()
+    ok = True
+    try:
+        for name, join_time, join_failures, down in ACCESS_POINTS:
+            for label, at_import in (("at import", True), ("background", False)):
+                found, received, lost = run(directory, at_import, join_time, join_failures, down)
+                times = ["{0:.2f}".format(found[c]) if c in found else "-" for c in columns]
+                print("{0:>15} {1:>10} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>9} {8:>9} {9:>9}".format(
+                    name, label, *times, received, lost))
+                if not at_import:
+                    # CAN traffic must not wait for the network, joins must not cost many frames, uploads
+                    #   must follow the join, and nothing resets
+                    ok = ok and found.get("first tx", seconds) < first_frame and "reset" not in found
+                    ok = ok and found.get("first rx", seconds) < first_frame and lost <= max_lost
+                    ok = ok and (down or found.get("publish", seconds) < found["wifi"] + 1.0)
+    finally:
+        shutil.rmtree(directory)
+    if not ok:
+        print("\nFAIL: CAN waits for the network or loses frames to it")
+        sys.exit(1)
+    print("\nPASS: CAN starts at boot whatever the access point does")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#
+# Edge pre-aggregation benchmark (host CPython)
+#
+# nnodes remotes each read a sensor every second for 24 hours (the synthetic
+# household trace of bench_report_policy.py, a different seed per node) and
+# start at random times, as nodes on a real bus do.  Each sends by one of:
+#
+#   raw N s:     a compact frame every N seconds (N = 1 is what the remote
+#                scripts do with heartbeat = 0)
+#   deadband:    compact frames by the default phonecan.policy.ReportPolicy
+#   summary W s: phonecan.summary.SummaryWindow, one summary frame per
+#                quantity every W seconds (at most MAX_COUNT samples)
+#
+# The frames are packed and sent through phonecan.tx.Transmitter, and the
+# receiver handles them as the send node does: NodeRegistry.decode() with a
+# SeqTracker and a NodeAggregator (add, and merge for summaries), publishing
+# the averages and starting again every publish_interval seconds.  For each
+# scheme it reports:
+#
+#   frames/h      frames per hour, all nodes
+#   load          bus time share at bitrate (typical bit stuffing)
+#   rx ms/h       receiver CPU per hour in decode and aggregate (perf_counter;
+#                 publishing is not timed)
+#   mean err      largest and RMS difference between a published average and
+#                 the mean of every sample taken in that interval, per
+#                 quantity (T C / RH %rH / P hPa)
+#
+# A summary window that spans a publish time lands in the interval it ends
+# in, which is where the summaries' error comes from; windows that divide
+# publish_interval keep it small.
+#
+# Run from the repository root:  python bench/bench_summary.py [nnodes]
+#
+import os
+import sys
+import time
+import math
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_report_policy import synthetic_trace, sendint
+from phonecan.aggregate import NodeAggregator
+from phonecan.codec import pack_compact_into
+from phonecan.policy import ReportPolicy, DEADBANDS, HEARTBEAT
+from phonecan.registry import NodeRegistry
+from phonecan.sequence import SeqTracker
+from phonecan.summary import SummaryWindow
+from phonecan.tx import Transmitter, compact_slots, summary_slots
+from sim.busload import frame_timer
+from sim.fakecan import Message
+
+nnodes = 8
+hours = 24
+bitrate = 125000
+publish_interval = 60*15 # Seconds, as on the send node
+QUANTITIES = (0, 1, 2)
+LABELS = ("C", "%rH", "hPa")
+
+
+class Wire():
+    # can_bus stand-in for Transmitter: keeps a copy of every frame sent
+    def __init__(self):
+        self.frames = []
+        self.now = 0.0
+
+    def send(self, msg):
+        self.frames.append((self.now, Message(msg.id, bytes(msg.data), True)))
+        return True
+
+
+class Sender():
+    def __init__(self, wire, nodeid, scheme, arg):
+        self.wire = wire
+        self.scheme = scheme
+        self.arg = arg
+        self.seq = 0
+        if scheme == "summary":
+            self.summary = SummaryWindow(QUANTITIES, arg)
+            self.tx = Transmitter(wire, Message, summary_slots(nodeid, QUANTITIES))
+        else:
+            self.policy = ReportPolicy(DEADBANDS, HEARTBEAT) if scheme == "deadband" else None
+            self.tx = Transmitter(wire, Message, compact_slots(nodeid, True))
+        self.next_raw = 0.0
+
+    def sample(self, now, values):
+        self.wire.now = now
+        if self.scheme == "summary":
+            if self.summary.due(now):
+                self.summary.pack(self.tx, self.seq)
+                self.tx.send_all()
+                self.seq = (self.seq + 1) % 256
+            self.summary.add(values, now)
+            return
+        if self.scheme == "raw":
+            if now < self.next_raw:
+                return
+            self.next_raw = now + self.arg - sendint/2
+        elif not self.policy.check(values, now):
+            return
+        pack_compact_into(self.tx.buffer(0), self.seq, *values)
+        self.tx.send(0)
+        self.seq = (self.seq + 1) % 256
+
+
+def samples(seed=1):
+    # [(time, node, values)] for every sample of every node, in time order
+    rng = random.Random(seed)
+    events = []
+    for nodeid in range(nnodes):
+        start = rng.uniform(0, publish_interval)
+        for t, temperature, humidity, pressure in synthetic_trace(hours, seed=100 + nodeid):
+            if start + t < hours*3600:
+                events.append((start + t, nodeid, (temperature, humidity, pressure)))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def true_means(events):
+    # {(interval, node, quantity): mean of every sample taken in the interval}
+    sums = {}
+    for t, nodeid, values in events:
+        interval = int(t//publish_interval)
+        for q in QUANTITIES:
+            key = (interval, nodeid, q)
+            total, count = sums.get(key, (0.0, 0))
+            sums[key] = (total + values[q], count + 1)
+    return {key: total/count for key, (total, count) in sums.items()}
+
+
+def run(events, truth, scheme, arg):
+    wire = Wire()
+    senders = [Sender(wire, nodeid, scheme, arg) for nodeid in range(nnodes)]
+    for t, nodeid, values in events:
+        senders[nodeid].sample(t, values)
+    frames = wire.frames
+    frame_time = frame_timer(bitrate, "typical")
+    busy = sum(frame_time(msg) for _t, msg in frames)
+
+    registry = NodeRegistry(range(nnodes))
+    stats = NodeAggregator()
+    seqtrack = SeqTracker()
+    decode = registry.decode
+    add, merge, track = stats.add, stats.merge, seqtrack.track
+    errors = [[] for _q in QUANTITIES]
+    cpu = 0.0
+    i = 0
+    for interval in range(int(hours*3600//publish_interval)):
+        end = (interval + 1)*publish_interval
+        j = i
+        while j < len(frames) and frames[j][0] < end:
+            j += 1
+        batch = [msg for _t, msg in frames[i:j]]
+        i = j
+        t0 = time.perf_counter()
+        for msg in batch:
+            decode(msg, add, None, track, merge)
+        cpu += time.perf_counter() - t0
+        # Publish: compare each average with the mean of the samples taken
+        for nodeid, nodestats in stats.nodes.items():
+            for q in QUANTITIES:
+                expected = truth.get((interval, nodeid, q))
+                if nodestats[q].count and expected is not None:
+                    errors[q].append(nodestats[q].mean - expected)
+        stats.reset()
+    return len(frames), busy, cpu, errors
+
+
+def main():
+    global nnodes
+    if len(sys.argv) > 1:
+        nnodes = int(sys.argv[1])
+    events = samples()
+    truth = true_means(events)
+    print("{} nodes reading every {:g} s for {} h, {} bit/s, averages published every {} s\n".format(
+        nnodes, sendint, hours, bitrate, publish_interval))
+    print("{:>12} {:>9} {:>7} {:>9}   {:>26}   {:>26}".format(
+        "scheme", "frames/h", "load", "rx ms/h", "max mean err " + "/".join(LABELS),
+        "rms mean err " + "/".join(LABELS)))
+    schemes = [("raw", 1.0), ("raw", 10.0), ("raw", 60.0), ("deadband", None),
+               ("summary", 15.0), ("summary", 60.0), ("summary", 180.0)]
+    results = {}
+    for scheme, arg in schemes:
+        nframes, busy, cpu, errors = run(events, truth, scheme, arg)
+        name = scheme if arg is None else "{} {:g} s".format(scheme, arg)
+        worst = [max(abs(e) for e in errs) if errs else 0.0 for errs in errors]
+        rms = [math.sqrt(sum(e*e for e in errs)/len(errs)) if errs else 0.0 for errs in errors]
+        results[name] = (nframes/hours, cpu/hours, worst)
+        print("{:>12} {:>9.0f} {:>7.2%} {:>9.2f}   {:>26}   {:>26}".format(
+            name, nframes/hours, busy/(hours*3600), 1000*cpu/hours,
+            "/".join("{:.4f}".format(e) for e in worst), "/".join("{:.4f}".format(e) for e in rms)))
+    # Raw streaming that matches a summary's accuracy needs a cadence at least as fast as the first raw
+    #   scheme no worse than it in every quantity
+    print()
+    raws = [name for name in results if name.startswith("raw")]
+    for name in results:
+        if not name.startswith("summary"):
+            continue
+        frames, cpu, worst = results[name]
+        matching = [raw for raw in raws if all(r <= w for r, w in zip(results[raw][2], worst))]
+        if not matching:
+            print("{}: no raw cadence tried is as accurate".format(name))
+            continue
+        raw = matching[-1]
+        print("{}: as accurate as {} with {:.1f}x fewer frames and {:.1f}x less receiver CPU".format(
+            name, raw, results[raw][0]/frames, results[raw][1]/cpu))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#
+# Transmit path allocation check (host CPython)
+#
+# Runs the send loop body of the node scripts against sim.fakecan (standing in
+# for adafruit_mcp2515 and its canio Message) under tracemalloc:
+#   old: new list, new struct.pack payloads and a new Message every cycle
+#   new: phonecan.tx.Transmitter, packing into preallocated slot buffers
+#   sender: phonecan.node.MeasurementSender.queue() and pump(), as the node
+#           scripts call them (packing, TxScheduler queues and sequence number)
+# For each, reports the heap left behind per cycle and the peak heap used
+# inside a cycle (objects allocated and freed again, which on the boards is
+# garbage for the collector).  Exits non-zero if the Transmitter or
+# MeasurementSender loops leave anything on the heap or allocate inside a
+# cycle beyond the float/int temporaries of the arithmetic.
+#
+# Run from the repository root:  python bench/bench_tx_alloc.py
+#
+import os
+import sys
+import struct
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.aggregate import TEMPERATURE, HUMIDITY
+from phonecan.codec import pack_compact_into, pack_legacy_into
+from phonecan.tx import Transmitter, node_slots
+from phonecan.node import MeasurementSender
+from sim.fakecan import FakeMCP2515, Message
+
+ncycles = 2000
+nodeid = 1
+offset = 2
+# Temporaries of the float -> int conversions in pack_*_into; anything above this is a real allocation
+transient_limit = 256 # bytes
+
+readings = [(20.0 + 0.01*i, 40.0 + 0.02*i, 1000.0 + 0.1*i) for i in range(16)]
+
+
+def old_legacy(can_bus, cycle):
+    temperature, humidity, _ = readings[cycle % len(readings)]
+    measlist = []
+    for value in (temperature, humidity):
+        ip, fp = divmod(value, 1)
+        measlist.append(struct.pack('<hH', int(ip), int(1000*fp)))
+    for meas in measlist:
+        message = Message(id=measlist.index(meas)+offset, data=meas, extended=True)
+        can_bus.send(message)
+
+
+def make_new_legacy(can_bus):
+    tx = Transmitter(can_bus, Message, node_slots(nodeid, "legacy"))
+
+    def cycle_fn(can_bus, cycle):
+        temperature, humidity, _ = readings[cycle % len(readings)]
+        pack_legacy_into(tx.buffer(TEMPERATURE), temperature)
+        pack_legacy_into(tx.buffer(HUMIDITY), humidity)
+        tx.send_all()
+    return cycle_fn
+
+
+def make_new_compact(can_bus):
+    tx = Transmitter(can_bus, Message, node_slots(nodeid, "compact"))
+
+    def cycle_fn(can_bus, cycle):
+        temperature, humidity, pressure = readings[cycle % len(readings)]
+        pack_compact_into(tx.buffer(0), cycle, temperature, humidity, pressure)
+        tx.send_all()
+    return cycle_fn
+
+
+def make_sender(frame_format):
+    def make(can_bus):
+        sender = MeasurementSender(can_bus, Message, nodeid, frame_format)
+
+        def cycle_fn(can_bus, cycle):
+            sender.queue(readings[cycle % len(readings)])
+            sender.pump()
+        return cycle_fn
+    return make
+
+
+def window(cycle_fn, can_bus):
+    # Run ncycles, returning heap in use afterwards and the largest peak inside one cycle
+    worst_transient = 0
+    for i in range(ncycles):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        cycle_fn(can_bus, i)
+        _, peak = tracemalloc.get_traced_memory()
+        worst_transient = max(worst_transient, peak - before)
+    current, _ = tracemalloc.get_traced_memory()
+    return current, worst_transient
+
+
+def measure(cycle_fn, can_bus):
+    tracemalloc.start()
+    # Warm up caches, free lists and the send counters under tracing, so objects
+    # replaced during the run were traced when they were allocated.  The first
+    # window also settles one-off objects; growth is measured over the second.
+    for i in range(1000):
+        cycle_fn(can_bus, i)
+    start, _ = window(cycle_fn, can_bus)
+    end, worst_transient = window(cycle_fn, can_bus)
+    tracemalloc.stop()
+    return (end - start)/ncycles, worst_transient
+
+
+def main():
+    failures = 0
+    print("{:>16} {:>18} {:>22}".format("send loop", "retained B/cycle", "peak in cycle (B)"))
+    cases = [("old legacy", lambda bus: old_legacy, False),
+             ("tx legacy", make_new_legacy, True),
+             ("tx compact", make_new_compact, True),
+             ("sender legacy", make_sender("legacy"), True),
+             ("sender compact", make_sender("compact"), True)]
+    for name, make, check in cases:
+        can_bus = FakeMCP2515()
+        retained, transient = measure(make(can_bus), can_bus)
+        print("{:>16} {:>18.2f} {:>22}".format(name, retained, transient))
+        if check and (retained != 0 or transient > transient_limit):
+            failures += 1
+            print("FAIL: {} allocates in the steady-state loop".format(name))
+    if failures:
+        sys.exit(1)
+    print("PASS: Transmitter and MeasurementSender loops leave nothing on the heap")
+
+
+if __name__ == "__main__":
+    main()
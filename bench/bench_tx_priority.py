@@ -0,0 +1,247 @@
+#
+# Transmit priority and fairness benchmark (host CPython)
+#
+# nnodes nodes share one bus (sim.fakecan on a sim.vclock virtual clock,
+# arbitration by ID, real frame lengths at bitrate).  Each sends compact
+# telemetry frames at random (Poisson) times, at a rate that keeps the bus
+# load near 80%, through a phonecan.tx.TxScheduler.  Like the MCP2515 used
+# this way, a node has one frame on the wire at a time.  Two ID layouts are
+# compared:
+#
+#   old:  telemetry on COMPACT_BASE + nodeid, so the lowest node always wins
+#   plan: telemetry on the structured IDs with rotation bits, plus an alarm
+#         frame per node every few seconds and a health frame every second
+#
+# For each node it reports telemetry frames per second and queuing latency
+# (from submit to the end of the frame), with Jain's fairness index over the
+# nodes' throughput and mean latency, and alarm/health latency for the plan.
+# Then every node sends telemetry periodically at the same rate and in
+# lockstep, so all of them contend at the start of every round: it counts the
+# rounds each node wins (its frame goes first), and exits non-zero if on the
+# plan these or the mean latencies are not shared out evenly.
+# Then node 0's transmit error counter keeps rising above the warning level
+# for a while (new transmit errors), to show its telemetry backing off while
+# its alarms still go out.
+#
+# Run from the repository root:  python bench/bench_tx_priority.py [nnodes]
+#
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.codec import COMPACT_SIZE
+from phonecan.registry import plan_id, ALARM, HEALTH
+from phonecan.tx import Transmitter, TxScheduler, compact_slots
+from sim.busload import frame_timer
+from sim.fakecan import FakeBus, Message
+from sim.vclock import VirtualClock
+
+nnodes = 12
+bitrate = 250000
+load = 0.8 # Target telemetry bus load
+seconds = 60.0
+alarm_interval = 5.0 # Seconds, mean per node (plan only)
+health_interval = 1.0 # Seconds per node (plan only)
+error_window = (20.0, 40.0) # Virtual seconds node 0's transmit error counter is high
+error_step = (0.5, 4) # Meanwhile its counter rises by [1] every [0] seconds
+min_fairness = 0.95 # Jain index of lockstep round wins and mean latency required on the plan
+
+
+class Controller():
+    # MCP2515 stand-in with one transmit buffer: send() raises, as the driver does, while the previous frame
+    #   is on the wire
+    def __init__(self, bus, node):
+        self.bus = bus
+        self.node = node
+        self.busy = False
+        self.current = None
+        self.transmit_error_count = 0
+
+    def send(self, msg):
+        if self.busy:
+            raise RuntimeError("No transmit buffer available to send")
+        self.busy = True
+        self.current = msg
+        msg.owner = self.node
+        self.bus.transmit(msg, self)
+        return True
+
+    def deliver(self, msg):
+        pass
+
+
+class Node():
+    def __init__(self, clock, bus, nodeid, plan):
+        self.clock = clock
+        self.nodeid = nodeid
+        self.controller = Controller(bus, self)
+        slots = compact_slots(nodeid, plan)
+        if plan:
+            slots += [(plan_id(ALARM, 0, nodeid), 1), (plan_id(HEALTH, 0, nodeid), 2)]
+        self.tx = TxScheduler(Transmitter(self.controller, Message, slots, nnodes=nnodes))
+        self.queued_at = {} # slot: virtual time it was queued
+        self.sent_at = None # Time the frame on the wire was queued
+        self.latency = {slot: [] for slot in range(len(slots))}
+        self.sent_in_window = 0
+        self.wins = 0 # Lockstep rounds in which this node's telemetry frame went first
+
+    def submit(self, slot):
+        if slot not in self.queued_at:
+            self.queued_at[slot] = self.clock.now
+        self.tx.submit(slot)
+        self.pump()
+
+    def pump(self):
+        if not self.controller.busy:
+            self.tx.pump(self.clock.now)
+            if self.controller.busy:
+                slot = self.tx.tx.messages.index(self.controller.current)
+                self.sent_at = self.queued_at.pop(slot)
+
+    def done(self, msg):
+        # End of this node's frame on the wire
+        self.controller.busy = False
+        slot = self.tx.tx.messages.index(msg)
+        self.latency[slot].append(self.clock.now - self.sent_at)
+        if slot == 0 and error_window[0] <= self.clock.now < error_window[1]:
+            self.sent_in_window += 1
+        self.pump()
+        if self.tx.queued() and not self.controller.busy:
+            # Held back: try again when the hold may be over
+            self.clock.call_later(0.05, self.pump)
+
+
+class Probe():
+    def __init__(self):
+        self.first = True # Next telemetry frame is the first of a lockstep round
+
+    def deliver(self, msg):
+        node = msg.owner
+        if self.first and msg is node.tx.tx.messages[0]:
+            node.wins += 1
+            self.first = False
+        node.done(msg)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p/100*len(values)))] if values else 0.0
+
+
+def jain(values):
+    return sum(values)**2/(len(values)*sum(v*v for v in values)) if values else 0.0
+
+
+def run(plan, errors=False, lockstep=False, seed=1):
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    frame_time = frame_timer(bitrate, "typical")
+    bus = FakeBus(frame_time, clock=clock)
+    probe = Probe()
+    bus.attach(probe)
+    nodes = [Node(clock, bus, nodeid, plan) for nodeid in range(nnodes)]
+    telemetry_time = frame_time(Message(0, bytes(COMPACT_SIZE), True))
+    rate = load/telemetry_time/nnodes # Telemetry frames per second per node
+
+    def every(node, slot, interval, poisson):
+        def fire():
+            node.submit(slot)
+            clock.call_later(rng.expovariate(1/interval) if poisson else interval, fire)
+        clock.call_later(rng.uniform(0, interval), fire)
+
+    def tec(value):
+        def set_tec():
+            controller = nodes[0].controller
+            if value is None:
+                # Another transmit error while the window is open
+                if clock.now < error_window[1]:
+                    controller.transmit_error_count = min(controller.transmit_error_count + error_step[1], 255)
+                    clock.call_later(error_step[0], set_tec)
+                return
+            controller.transmit_error_count = value
+            if value == 0:
+                nodes[0].pump()
+            else:
+                clock.call_later(error_step[0], tec(None))
+        return set_tec
+
+    def round_start():
+        probe.first = True
+        for node in nodes:
+            node.submit(0)
+        clock.call_later(1/rate, round_start)
+
+    if lockstep:
+        clock.call_later(0, round_start)
+    for node in nodes:
+        if lockstep:
+            continue
+        every(node, 0, 1/rate, True)
+        if plan:
+            every(node, 1, alarm_interval, True)
+            every(node, 2, health_interval, False)
+    if errors:
+        clock.call_at(error_window[0], tec(128))
+        clock.call_at(error_window[1], tec(0))
+    clock.run(seconds)
+    return nodes, bus.busy_time/seconds
+
+
+def report(name, nodes, busy):
+    print("{}: bus load {:.1%}".format(name, busy))
+    print("{:>6} {:>10} {:>10} {:>10} {:>10}".format("node", "frames/s", "mean ms", "p99 ms", "max ms"))
+    throughput = []
+    means = []
+    for node in nodes:
+        latency = node.latency[0]
+        mean = sum(latency)/len(latency) if latency else 0.0
+        throughput.append(len(latency)/seconds)
+        means.append(mean)
+        print("{:>6} {:>10.1f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            node.nodeid, len(latency)/seconds, 1000*mean, 1000*percentile(latency, 99), 1000*max(latency or [0])))
+    print("Jain fairness: throughput {:.3f}, mean latency {:.3f}".format(jain(throughput), jain(means)))
+    if len(nodes[0].latency) > 1:
+        for slot, label in ((1, "alarm"), (2, "health")):
+            latency = [t for node in nodes for t in node.latency[slot]]
+            if latency:
+                print("{} frames: {}, mean {:.3f} ms, max {:.3f} ms".format(
+                    label, len(latency), 1000*sum(latency)/len(latency), 1000*max(latency)))
+    print()
+    return means
+
+
+def report_lockstep(name, nodes, busy):
+    # Lockstep rounds: who goes first, and the latency each node sees; returns the fairness indexes
+    means = report(name, nodes, busy)
+    wins = [node.wins for node in nodes]
+    print("rounds won: {}  (Jain {:.3f})\n".format(" ".join(str(n) for n in wins), jain(wins)))
+    return jain(wins), jain(means)
+
+
+def main():
+    global nnodes
+    if len(sys.argv) > 1:
+        nnodes = int(sys.argv[1])
+    print("{} nodes, {} bit/s, telemetry load {:.0%}, {:.0f} virtual s\n".format(nnodes, bitrate, load, seconds))
+    report("old IDs", *run(False))
+    report("ID plan", *run(True))
+    nodes, _busy = run(True, errors=True)
+    node = nodes[0]
+    alarms = node.latency[1]
+    print("node 0 transmit errors high from {:.0f} to {:.0f} s: {} telemetry frames sent meanwhile, {} holds, "
+          "its alarms max {:.3f} ms".format(error_window[0], error_window[1], node.sent_in_window, node.tx.holds,
+                                           1000*max(alarms)))
+    print()
+    report_lockstep("old IDs, equal-rate senders in lockstep", *run(False, lockstep=True))
+    wins, means = report_lockstep("ID plan, equal-rate senders in lockstep", *run(True, lockstep=True))
+    if wins < min_fairness or means < min_fairness:
+        print("FAIL: lockstep senders on the plan do not take turns (round wins {:.3f}, mean latency {:.3f})".format(
+            wins, means))
+        sys.exit(1)
+    print("PASS: lockstep senders on the plan take turns winning arbitration")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,16 +10,15 @@
 # Measurements are given ID as follows:
 #   ID = even (0, 2, 4, etc. for nodeid 0, 1, 2, etc.) = temperature
 #   ID = odd (1, 3, 5, etc. for nodeid 0, 1, 2, etc.) = humidity
+#   These are the legacy one-measurement frames.  Compact frames carry all of a node's
+#   measurements in one frame with ID = 0x100 + nodeid (see phonecan/registry.py and phonecan/codec.py).
 #
 # Jeff Mangum 2024-06-23
 
-from time import sleep
-import struct
+import os
 import board
-import busio
-from digitalio import DigitalInOut, Direction, Pull
-import displayio
-from adafruit_mcp2515.canio import Message, RemoteTransmissionRequest, Match
+from digitalio import DigitalInOut
+from adafruit_mcp2515.canio import Message, Match
 from adafruit_mcp2515 import MCP2515 as CAN
 #from adafruit_ms8607 import MS8607
 #import adafruit_bme680
@@ -27,18 +26,53 @@ import adafruit_sht4x
 import asyncio
 from async_button import Button, MultiButton
 import neopixel
-
-# This is nodeid 0, so offset is 0
-nodeid = 0
-offset = 0
-
-# nodeid to measurement ID correspondence
-meastonodeid = [0,0,1,1,2,2,3,3,4,4,5,5]
+from phonecan.aggregate import TEMPERATURE, HUMIDITY
+from phonecan.cache import NodeCache
+from phonecan.canrx import AsyncReceiver, RxDrain
+from phonecan.display import ValueDisplay
+from phonecan.health import BusHealth, ErrorFlags, HealthTable
+from phonecan.node import MeasurementSender, open_can
+from phonecan.profile import LoopProfiler
+from phonecan.registry import NodeRegistry
+from phonecan.sequence import SeqTracker
+from phonecan.sampler import Sampler
+
+# This is nodeid 0, so offset is 0.  PHONECAN_NODEID in settings.toml overrides the node number.
+nodeid = os.getenv("PHONECAN_NODEID", 0)
+offset = 2*nodeid
+
+# Nodes on the bus.  The registry maps each node's CAN IDs to (node, measurement) and sets the MCP2515
+#   acceptance filters so only those frames are received.
+nnodes = 8
+accept_legacy = True # Also accept legacy one-measurement frames while any node still sends them
+registry = NodeRegistry(range(nnodes), legacy=accept_legacy)
 
 read_interval = 0 # Seconds.  For CAN bus read.  Set to 0 to allow continuous CAN bus clearing.
 send_interval = 1 # Seconds.  Send should be much shorter than read to assure values are available on bus.
+sample_interval = 1.0 # Seconds.  The local sensor is read once per interval by one task; everything else uses that sample.
 can_listen_timeout = 5.0 # Interval during which CAN bus messages are read from the bus.  Set to several seconds
                          #   to allow time for all nodes to report.
+display_refresh_interval = 0.5 # Seconds.  Minimum time between OLED refreshes (button presses refresh immediately).
+stale_after = 150.0 # Seconds.  Cached values older than this are marked stale (with a "*") on the display.
+                    #   Keep above the remotes' heartbeat (see phonecan/policy.py) so a quiet node is not marked stale.
+frame_format = "compact" # "compact": all measurements in one frame (see phonecan/codec.py); "legacy": one '<HH' frame each;
+                         #   "summary": each sample goes into a window sent every summary_window seconds (needs id_plan,
+                         #   see phonecan/summary.py).  All formats are always accepted from other nodes.
+summary_window = 60.0 # Seconds
+id_plan = True # Send on the structured, prioritized CAN IDs (see phonecan/registry.py).  Set False, with
+               #   frame_format = "legacy", while a receiver still runs the old code.  Both are always accepted from other nodes.
+rx_ring_size = 32 # Frames buffered between the receive task and button_func
+rx_poll_interval = 0 # Seconds.  Receive task poll interval while the bus is quiet.  0 drains continuously.
+health_interval = 1.0 # Seconds between bus state and error counter samples (see phonecan/health.py)
+health_report_interval = 30.0 # Seconds between this node's bus health frames (sent with id_plan only)
+profile_interval = 300.0 # Seconds between event-loop profiles printed and sent in a CAN frame (id_plan only;
+                         #   see phonecan/profile.py)
+profile_lag_interval = 0.5 # Seconds between event-loop lag checks
+stall_limit = 0.2 # Seconds.  A task step this long without yielding to the other tasks counts as a stall.
+
+# Button and click that select each node for display
+nodetobutton = ["a","b","c","c"]
+nodetoclick = ["Single click","Single click","Single click","Long click"]
 
 # Neopixel settings
 brightval = 0.01 # Use dim setting for bedrooms...
@@ -49,96 +83,91 @@ np = neopixel.NeoPixel(board.NEOPIXEL,1,brightness=brightval)
 
 class Context():
     # Pass variables around to any routine that needs them
-    def __init__(self,selected_button,click_name,can_bus,sensor,label,terminalio,xpos,ypos,text_area,splash,read_interval,send_interval,can_listen_timeout,nodeid,offset):
+    __slots__ = ("selected_button", "click_name", "rxdrain", "sender", "cache", "nodehealth", "seqtrack", "sampler",
+                 "valuedisplay", "read_interval", "send_interval", "can_listen_timeout", "nodeid")
+
+    def __init__(self,selected_button,click_name,rxdrain,sender,cache,nodehealth,seqtrack,sampler,valuedisplay,read_interval,send_interval,can_listen_timeout,nodeid):
         self.selected_button = selected_button
         self.click_name = click_name
-        self.can_bus = can_bus
-        self.sensor = sensor
-        self.label = label
-        self.terminalio = terminalio
-        self.xpos = xpos
-        self.ypos = ypos
-        self.text_area = text_area
-        self.splash = splash
+        self.rxdrain = rxdrain
+        self.sender = sender
+        self.cache = cache
+        self.nodehealth = nodehealth
+        self.seqtrack = seqtrack
+        self.sampler = sampler
+        self.valuedisplay = valuedisplay
         self.read_interval = read_interval
         self.send_interval = send_interval
         self.can_listen_timeout = can_listen_timeout
         self.nodeid = nodeid
-        self.offset = offset
 
 
-def canstate(can_bus):
-    # Check CAN bus state
-    if can_bus.state != 0:
-        print("BUS STATE: ",can_bus.state)
-        can_bus.restart()
+
+def selected_node(context):
+    # Node chosen with the buttons, or None if the button/click combination is not assigned
+    for node in range(len(nodetobutton)):
+        if context.selected_button == nodetobutton[node] and context.click_name == nodetoclick[node]:
+            return node
+    return None
+
+
+def show_selected(context):
+    # Show the selected node straight from the cache, without waiting for its next frame
+    node = selected_node(context)
+    if node is None:
+        return
+    if node == context.nodeid:
+        context.valuedisplay.show_node(context.cache, node, "Home", force=True)
+    else:
+        context.valuedisplay.show_node(context.cache, node, "Remote "+str(node), force=True,
+                                       loss=context.seqtrack.loss_rate(node))
+
+
+def receive_frame(context, msg):
+    # Every frame updates the cache, whichever node is on the display...
+    # (health frames from other nodes go to the health table, and sequence numbers are counted
+    #   for the loss rate; duplicate frames are dropped)
+    rxnodeid = registry.decode(msg, context.cache.update, context.nodehealth.update, context.seqtrack.track) # None if not a measurement frame from a known node
+    if rxnodeid is None:
+        return
+    #print("Receive Error Count: ",context.can_bus.receive_error_count)
+    #print("Message from ", hex(msg.id))
+    #if isinstance(msg, Message):
+        #print("Message Data: ",decode_legacy(msg.data))
+    #if isinstance(msg, RemoteTransmissionRequest):
+        #print("RTR length:", msg.length)
+    print("Message from node: ", rxnodeid, "Message ID: ", hex(msg.id))
+    #
+    # ...and the display is refreshed when the frame is from the selected remote node
+    if rxnodeid != context.nodeid and selected_node(context) == rxnodeid:
+        context.valuedisplay.show_node(context.cache, rxnodeid, "Remote "+str(rxnodeid),
+                                       loss=context.seqtrack.loss_rate(rxnodeid))
 
 
 async def button_func(context: Context):
-    nodetobutton = ["a","b","c","c"]
-    nodetoclick = ["Single click","Single click","Single click","Long click"]
     while True:
-        if context.selected_button == nodetobutton[0] and context.click_name == nodetoclick[0]:
+        # Empty the receive ring on every pass, whichever node is selected, so the remote caches stay
+        #   current and the ring never fills while the home node is shown
+        msg = context.rxdrain.get_nowait()
+        while msg is not None:
+            receive_frame(context, msg)
+            msg = context.rxdrain.get_nowait()
+        if selected_node(context) == context.nodeid:
             #print(context.selected_button,context.click_name)
-            home_temp = context.sensor.temperature
-            home_rh = context.sensor.relative_humidity
-            #print("Local Temp: ",home_temp)
-            #print("Local RH: ",home_rh)
-            context.text_area[0] = context.label.Label(context.terminalio.FONT, text="Home", color=0xFFFFFF, x=context.xpos[0], y=context.ypos[0])
-            if len(context.splash) > 5:
-                context.splash.pop(5)
-            context.splash.insert(5,context.text_area[0])
-            context.text_area[1] = context.label.Label(context.terminalio.FONT, text="{:.2f}".format(home_temp), color=0xFFFFFF, x=context.xpos[1], y=context.ypos[1])
-            if len(context.splash) > 6:
-                context.splash.pop(6)
-            context.splash.insert(6,context.text_area[1])
-            context.text_area[2] = context.label.Label(context.terminalio.FONT, text="{:.2f}".format(home_rh), color=0xFFFFFF, x=context.xpos[2], y=context.ypos[2])
-            if len(context.splash) > 7:
-                context.splash.pop(7)
-            context.splash.insert(7,context.text_area[2])
-            sleep(1)
+            sampler = context.sampler
+            #print("Local Temp: ",sampler.temperature)
+            #print("Local RH: ",sampler.humidity)
+            context.cache.update(context.nodeid, TEMPERATURE, sampler.temperature, now=sampler.time)
+            context.cache.update(context.nodeid, HUMIDITY, sampler.humidity, now=sampler.time)
+            context.valuedisplay.show_node(context.cache, context.nodeid, "Home")
+            await asyncio.sleep(1)
         else:
-            canstate(context.can_bus)
-            # Listen for context.can_listen_timeout seconds to allow all nodes to report...
-            with context.can_bus.listen(timeout=context.can_listen_timeout) as listener:
-                message_count = listener.in_waiting()
-                for _i in range(message_count):
-                    #print(message_count, "messages available")
-                    #print("Receive Error Count: ",context.can_bus.receive_error_count)
-                    msg = listener.receive()
-                    #print("Message from ", hex(msg.id))
-                    #if isinstance(msg, Message):
-                        #print("Message Data: ",struct.unpack('<HH',msg.data))
-                    #if isinstance(msg, RemoteTransmissionRequest):
-                        #print("RTR length:", msg.length)
-                    rxnodeid = meastonodeid[msg.id]
-                    #print("Received message from node: ",nodeid)
-                    print("Message from node: ", rxnodeid, "Message Data: ",struct.unpack('<HH',msg.data))
-                    #
-                    # Display node based on selected button and number of button presses...
-                    if context.selected_button == nodetobutton[rxnodeid] and context.click_name == nodetoclick[rxnodeid]:
-                        msg_unpack = int(struct.unpack('<HH',msg.data)[0])+float(struct.unpack('<HH',msg.data)[1]/1000)
-                        # Message ID to value correspondence: (0,1,2) = (P,T,RH)
-                        #for i in range(3):
-                        #if msg.id == 0:
-                        #    text_area[0] = label.Label(terminalio.FONT, text=str(msg_unpack), color=0xFFFFFF, x=xpos[0], y=ypos[0])
-                        #    if len(splash) > 5:
-                        #        splash.pop(5)
-                        #    splash.insert(5, text_area[0])
-                        context.text_area[0] = context.label.Label(context.terminalio.FONT, text="Remote "+str(rxnodeid), color=0xFFFFFF, x=context.xpos[0], y=context.ypos[0])
-                        if len(context.splash) > 5:
-                            context.splash.pop(5)
-                        context.splash.insert(5,context.text_area[0])
-                        if msg.id % 2 == 0: # Check to see if msg.id is even
-                            context.text_area[1] = context.label.Label(context.terminalio.FONT, text="{:.2f}".format(msg_unpack), color=0xFFFFFF, x=context.xpos[1], y=context.ypos[1])
-                            if len(context.splash) > 6:
-                                context.splash.pop(6)
-                            context.splash.insert(6,context.text_area[1])
-                        else: # If msg.id is not even, it must be odd...
-                            context.text_area[2] = context.label.Label(context.terminalio.FONT, text="{:.2f}".format(msg_unpack), color=0xFFFFFF, x=context.xpos[2], y=context.ypos[2])
-                            if len(context.splash) > 7:
-                                context.splash.pop(7)
-                            context.splash.insert(7,context.text_area[2])
+            # Wait up to context.can_listen_timeout seconds for the next frame, letting the other tasks run meanwhile
+            msg = await context.rxdrain.recv(timeout=context.can_listen_timeout)
+            if msg is not None:
+                receive_frame(context, msg)
+        # Show any text changes held back by the refresh rate limit
+        context.valuedisplay.refresh()
         await asyncio.sleep(context.read_interval)
 
 
@@ -161,6 +190,7 @@ async def button_listener(context: Context, multibutton):
         print("click in button_listener: ",CLICK_NAMES[click])
         context.selected_button = button_name
         context.click_name = CLICK_NAMES[click]
+        show_selected(context)
         # When a click is received, set context.read_interval to 0 to get immediate read and display of sensor values
         if (context.selected_button != old_selected_button) and (context.click_name != old_click_name):
             context.send_interval = 0
@@ -171,31 +201,31 @@ async def button_listener(context: Context, multibutton):
 
 async def sendmeas(context: Context):
     # Send out this node's (nodeid = 3) measurements onto the CAN bus...
+    sender = context.sender
     while True:
-        measlist = []
-        #print("Pressure: %.2f hPa" % sensor.pressure)
-        #print("Temperature: %.2f C" % sensor.temperature)
-        #print("Humidity: %.2f %% rH" % sensor.relative_humidity)
-        #print("\n------------------------------------------------\n")
-        #ip, sp = divmod(sensor.pressure, 1)
-        #ps = struct.pack('<HH', int(ip), int(1000*sp))
-        #measlist.append(ps)
-        it, st = divmod(context.sensor.temperature, 1)
-        ts = struct.pack('<HH', int(it), int(1000*st))
-        measlist.append(ts)
-        ih, sh = divmod(context.sensor.relative_humidity, 1)
-        rs = struct.pack('<HH', int(ih), int(1000*sh))
-        measlist.append(rs)
-        for meas in measlist:
-            #print("len(measlist): ",len(measlist)," and meas: ",meas)
-            np.fill(color)
-            context.message = Message(id=measlist.index(meas)+context.offset, data=meas, extended=True)
-            send_success = context.can_bus.send(context.message)
-            #print("Send measurement ",measlist.index(meas)," success:", send_success)
-            np.fill(0)
+        # Latest local sample (see sampler task)
+        sampler = context.sampler
+        temperature = sampler.temperature
+        humidity = sampler.humidity
+        context.cache.update(context.nodeid, TEMPERATURE, temperature, now=sampler.time)
+        context.cache.update(context.nodeid, HUMIDITY, humidity, now=sampler.time)
+        np.fill(color)
+        # Each new sample goes into a summary window once, however often this loop runs
+        if sender.queue((temperature, humidity, None), now=sampler.time, count=sampler.count):
+            send_success = sender.pump()
+            #print("Send measurements success:", send_success)
+        np.fill(0)
         #print("Transmit Error Count: ",can_bus.transmit_error_count)
         await asyncio.sleep(context.send_interval)
 
+async def loopstats(profiler):
+    # Event-loop lag every profile_lag_interval, and the task profile every profile_interval
+    while True:
+        await profiler.sleep(profile_lag_interval)
+        for line in profiler.poll():
+            print(line)
+
+
 async def main():
     # Define buttons A, B, and C
     # note Button must be created in an async environment
@@ -222,6 +252,9 @@ async def main():
     )
     multibutton = MultiButton(a=button_a, b=button_b, c=button_c)
 
+    # The display modules are only imported here, once the node is running
+    import displayio
+
     # Compatibility with both CircuitPython 8.x.x and 9.x.x.
     # Remove after 8.x.x is no longer a supported release.
     try:
@@ -232,13 +265,7 @@ async def main():
     import terminalio
 
     # Setup CAN bus
-    cs = DigitalInOut(board.CAN_CS)
-    cs.switch_to_output()
-    spi = board.SPI()
-
-    can_bus = CAN(
-        spi, cs, loopback=False, silent=False
-    )  # use loopback and silent True to test without another device
+    can_bus = open_can(CAN, board.SPI(), DigitalInOut(board.CAN_CS))
 
     # can try import bitmap_label below for alternative
     from adafruit_display_text import label
@@ -264,11 +291,10 @@ async def main():
 
     # Initialize size of splash and display variables
     splash_init = 5
-    xposstatic = [8,8,8]
-    yposstatic = [10,30,50]
-    xpos = [75,75,75]
-    ypos = [10,30,50]
-    text_area = [None]*3
+    xposstatic = [8,8,8,8]
+    yposstatic = [8,24,40,56]
+    xpos = [75,75,75,75]
+    ypos = [8,24,40,56]
     selected_button = None
     click_name = None
 
@@ -305,10 +331,39 @@ async def main():
     splash.append(text_static_temp_area)
     text_static_rh_area = label.Label(terminalio.FONT, text='RH (%): ', color=0xFFFFFF, x=xposstatic[2], y=yposstatic[2])
     splash.append(text_static_rh_area)
-    my_context = Context(selected_button, click_name, can_bus, sensor, label, terminalio, xpos, ypos, text_area, splash, read_interval, send_interval, can_listen_timeout, nodeid, offset)
-    button_func_task = asyncio.create_task(button_func(my_context))
-    button_listener_task = asyncio.create_task(button_listener(my_context, multibutton))
-    sendmeas_task = asyncio.create_task(sendmeas(my_context))
-    await asyncio.gather(button_func_task, button_listener_task, sendmeas_task)
+    # Value labels are created once here and then only have their text updated
+    valuedisplay = ValueDisplay(splash, label, terminalio.FONT, xpos, ypos, display=display, min_interval=display_refresh_interval)
+    # Rolling frame loss of the selected remote (see phonecan/sequence.py)
+    text_static_loss_area = label.Label(terminalio.FONT, text='Loss (%): ', color=0xFFFFFF, x=xposstatic[3], y=yposstatic[3])
+    splash.append(text_static_loss_area)
+    # One reader of the MCP2515 error flags, so receive overflows are counted whichever task reads them first
+    eflags = ErrorFlags(can_bus)
+    rxdrain = RxDrain(AsyncReceiver(can_bus, matches=registry.matches(Match), poll_interval=rx_poll_interval), ring_size=rx_ring_size, node_of=registry.node_of, flags=eflags)
+    cache = NodeCache(stale_after=stale_after)
+    nodehealth = HealthTable()
+    seqtrack = SeqTracker()
+    # Restarts the controller only when it is bus off, with backoff; the receive listener is re-opened after a restart
+    health = BusHealth(can_bus, Message if id_plan else None, nodeid, interval=health_interval,
+                       report_interval=health_report_interval, on_restart=[rxdrain.receiver.close], flags=eflags,
+                       nnodes=nnodes)
+    sampler = Sampler(sensor, interval=sample_interval)
+    sampler.read() # First sample before the tasks that use it start
+    # Packs the local sample in frame_format and numbers the frames (see phonecan/node.py)
+    sender = MeasurementSender(can_bus, Message, nodeid, frame_format, id_plan, (TEMPERATURE, HUMIDITY), summary_window,
+                               nnodes=nnodes)
+    my_context = Context(selected_button, click_name, rxdrain, sender, cache, nodehealth, seqtrack, sampler, valuedisplay, read_interval, send_interval, can_listen_timeout, nodeid)
+    # Every task is timed step by step, so a task that blocks the others shows up as a stall
+    profiler = LoopProfiler(stall=stall_limit, report_interval=profile_interval,
+                            message_class=Message if id_plan else None, can_bus=can_bus, nodeid=nodeid,
+                            nnodes=nnodes)
+    rxdrain_task = profiler.task("rxdrain", rxdrain.run())
+    sampler_task = profiler.task("sampler", sampler.run())
+    health_task = profiler.task("health", health.run())
+    button_func_task = profiler.task("button_func", button_func(my_context))
+    button_listener_task = profiler.task("button_listener", button_listener(my_context, multibutton))
+    sendmeas_task = profiler.task("sendmeas", sendmeas(my_context))
+    loopstats_task = asyncio.create_task(loopstats(profiler))
+    await asyncio.gather(rxdrain_task, sampler_task, health_task, button_func_task, button_listener_task, sendmeas_task,
+                         loopstats_task)
 
 asyncio.run(main())
\ No newline at end of file
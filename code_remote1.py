@@ -5,25 +5,71 @@
 # Measurements are given ID as follows:
 #   ID = even (0, 2, 4, etc. for nodeid 0, 1, 2, etc.) = temperature
 #   ID = odd (1, 3, 5, etc. for nodeid 0, 1, 2, etc.) = humidity
+#   These are the legacy one-measurement frames.  Compact frames carry all of a node's
+#   measurements in one frame with ID = 0x100 + nodeid (see phonecan/registry.py and phonecan/codec.py).
+#   Summary frames carry the count/mean/min/max of one measurement over a window (phonecan/summary.py).
+# Sampling, transmitting and bus health run as asyncio tasks; between their deadlines the board
+#   goes into light sleep (see phonecan/sleep.py).
 #
 # Jeff Mangum 2024-06-29
 #
-from time import sleep
-import struct
+import time
+import os
+import asyncio
 import board
-import binascii
 from digitalio import DigitalInOut
-from adafruit_mcp2515.canio import Message, RemoteTransmissionRequest
+from adafruit_mcp2515.canio import Message
 from adafruit_mcp2515 import MCP2515 as CAN
 from adafruit_ms8607 import MS8607
 import neopixel
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.health import BusHealth
+from phonecan.node import MeasurementSender, open_can
+from phonecan.policy import ReportPolicy
+from phonecan.sleep import LightSleep
+from phonecan.profile import LoopProfiler
+try:
+    import alarm
+except ImportError: # No light sleep on this board or build; the tasks wait awake
+    alarm = None
 
-# This is node 1, so offset is 2
-nodeid = 1
-offset = 2
+# This is node 1, so offset is 2.  PHONECAN_NODEID in settings.toml overrides the node number,
+#   so one copy of this file can run on every remote.
+nodeid = os.getenv("PHONECAN_NODEID", 1)
+offset = 2*nodeid
 
-# Set measurement loop sleep time, which sets measurement send interval
+# Sensor read interval, which sets the measurement send interval
 sendint = 1.0 # Seconds
+retry_interval = 0.1 # Seconds between send attempts while frames are held back or the transmit buffers are full
+health_interval = 5.0 # Seconds between bus state and error counter samples
+light_sleep = True # Light sleep between task deadlines when the board has the alarm module
+profile_interval = 300.0 # Seconds between event-loop profiles sent in a CAN frame (id_plan only) and printed
+                         #   with debug (see phonecan/profile.py)
+stall_limit = 0.2 # Seconds.  A task step this long without yielding to the other tasks counts as a stall.
+
+# Frame format: "compact" sends all measurements in one frame (see phonecan/codec.py),
+#   "legacy" sends one '<HH' frame per measurement for receivers not yet updated,
+#   "summary" samples every sendint but only sends a summary of each measurement every
+#   summary_window seconds (needs id_plan; see phonecan/summary.py)
+frame_format = "compact"
+summary_window = 60.0 # Seconds
+quantities = (TEMPERATURE, HUMIDITY, PRESSURE)
+id_plan = True # Send on the structured, prioritized CAN IDs (see phonecan/registry.py).  Set False, with
+               #   frame_format = "legacy", while a receiver still runs the old code.
+nnodes = 8 # Nodes on the bus (as in the receivers' settings); frames take turns in arbitration among them
+health_report_interval = 30.0 # Seconds between bus health frames (sent with id_plan only)
+
+# Reporting policy: the sensor is read every sendint, but measurements are only sent
+#   when one moves by more than its deadband (C, %rH, hPa) or when heartbeat seconds
+#   pass without a frame.  Receivers' stale_after must be longer than heartbeat.
+#   Set heartbeat = 0 to send every reading.
+deadbands = [0.1, 0.5, 0.2]
+heartbeat = 60.0 # Seconds
+policy = ReportPolicy(deadbands, heartbeat)
+
+# Print over USB serial (keeps the CPU awake longer): 0 nothing, 1 sends and the time spent awake,
+#   2 also every reading
+debug = 0
 
 # Neopixel settings
 brightval = 0.01 # Use dim setting for bedrooms...
@@ -33,42 +79,83 @@ color = 0x6600CC # Dark purple
 np = neopixel.NeoPixel(board.NEOPIXEL,1,brightness=brightval)
 
 # Setup CAN bus
-cs = DigitalInOut(board.CAN_CS)
-cs.switch_to_output()
-spi = board.SPI()
+can_bus = open_can(CAN, board.SPI(), DigitalInOut(board.CAN_CS))
+
+# Packs each reading in frame_format, queues the frames the policy says are due (or the window summaries)
+#   and numbers them (receivers count gaps, see phonecan/sequence.py); see phonecan/node.py
+sender = MeasurementSender(can_bus, Message, nodeid, frame_format, id_plan, quantities, summary_window, policy,
+                           nnodes=nnodes)
 
-can_bus = CAN(
-    spi, cs, loopback=False, silent=False
-)  # use loopback and silent True to test without another device
+# Bus health: samples the bus state and error counters every pass, restarts the controller only
+#   when it is bus off (waiting longer after each restart) and reports them in a health frame
+#   (see phonecan/health.py).
+health = BusHealth(can_bus, Message if id_plan else None, nodeid, interval=health_interval,
+                   report_interval=health_report_interval, debug=debug >= 2, nnodes=nnodes)
 
 # Use for I2C
 i2c = board.I2C()  # uses board.SCL and board.SDA
 sensor = MS8607(i2c)
 
-while True:
-    print("BUS STATE: ",can_bus.state)
-    if can_bus.state != 0:
-        can_bus.restart()
-    measlist = []
-    #print("Pressure: %.2f hPa" % sensor.pressure)
-    print("Temperature: %.2f C" % sensor.temperature)
-    print("Humidity: %.2f %% rH" % sensor.relative_humidity)
-    print("\n------------------------------------------------\n")
-    #ip, sp = divmod(sensor.pressure, 1)
-    #ps = struct.pack('<HH', int(ip), int(1000*sp))
-    #measlist.append(ps)
-    it, st = divmod(sensor.temperature, 1)
-    ts = struct.pack('<HH', int(it), int(1000*st))
-    measlist.append(ts)
-    ih, sh = divmod(sensor.relative_humidity, 1)
-    rs = struct.pack('<HH', int(ih), int(1000*sh))
-    measlist.append(rs)
-    sleep(1)
-    for meas in measlist:
-        np.fill(color) #0xADAF00)
-        message = Message(id=measlist.index(meas)+offset, data=meas, extended=True)
-        send_success = can_bus.send(message)
-        print("Send measurement ",measlist.index(meas)," success:", send_success)
-        np.fill(0)
-    print("Transmit Error Count: ",can_bus.transmit_error_count)
-    sleep(sendint)
\ No newline at end of file
+# Every task is timed step by step, and waits through the sleeper, which light-sleeps until the earliest
+#   deadline once all three are waiting (and reports how late each wakes as event-loop lag)
+profiler = LoopProfiler(stall=stall_limit, report_interval=profile_interval,
+                        message_class=Message if id_plan else None, can_bus=can_bus, nodeid=nodeid,
+                        nnodes=nnodes)
+sleeper = LightSleep(alarm if light_sleep else None, ntasks=3, profiler=profiler)
+queued = asyncio.Event() # Set when sample() has queued frames for transmit()
+
+
+async def sample():
+    # Read the sensor every sendint seconds and queue the frames that are due
+    next_time = time.monotonic()
+    while True:
+        temperature = sensor.temperature
+        humidity = sensor.relative_humidity
+        pressure = sensor.pressure
+        values = (temperature, humidity, pressure)
+        if debug >= 2:
+            print("Temperature: %.2f C" % temperature)
+            print("Humidity: %.2f %% rH" % humidity)
+            print("Pressure: %.2f hPa" % pressure)
+        if sender.queue(values):
+            queued.set()
+        # Next read on the sendint grid, skipping reads already missed
+        next_time += sendint
+        now = time.monotonic()
+        if next_time < now:
+            next_time = now
+        await sleeper.sleep("sample", next_time - now)
+
+
+async def transmit():
+    # Send what sample() queued, retrying while frames are held back
+    while True:
+        await sleeper.wait("transmit", queued)
+        while sender.queued():
+            np.fill(color)
+            send_success = sender.pump()
+            np.fill(0)
+            if debug:
+                print("Send measurements success:", send_success, "TEC:", can_bus.transmit_error_count,
+                      "awake: {0:.1%}".format(sleeper.awake_fraction()))
+            if not send_success:
+                await sleeper.sleep("transmit", retry_interval)
+
+
+async def bushealth():
+    while True:
+        health.poll()
+        for line in profiler.poll():
+            if debug:
+                print(line)
+        await sleeper.sleep("health", health_interval)
+
+
+async def main():
+    sample_task = profiler.task("sample", sample())
+    transmit_task = profiler.task("transmit", transmit())
+    health_task = profiler.task("health", bushealth())
+    sleeper_task = asyncio.create_task(sleeper.run())
+    await asyncio.gather(sample_task, transmit_task, health_task, sleeper_task)
+
+asyncio.run(main())
@@ -5,50 +5,94 @@
 # Measurements are given ID as follows:
 #   ID = even (0, 2, 4, etc. for nodeid 0, 1, 2, etc.) = temperature
 #   ID = odd (1, 3, 5, etc. for nodeid 0, 1, 2, etc.) = humidity
+#   These are the legacy one-measurement frames.  Compact frames carry all of a node's
+#   measurements in one frame with ID = 0x100 + nodeid (see phonecan/registry.py and phonecan/codec.py).
 #
 # This node will handle pushing measurements up to AIO
 #
 # Jeff Mangum 2024-07-01
 #
-import struct
-import ulab.numpy
 import board
 import busio
-import binascii
 from digitalio import DigitalInOut
-from adafruit_mcp2515.canio import Message, RemoteTransmissionRequest, Match
+from adafruit_mcp2515.canio import Message, Match
 from adafruit_mcp2515 import MCP2515 as CAN
 #from adafruit_ms8607 import MS8607
 import adafruit_sht4x
 import time
-import ssl
 import os
-from random import randint
-import microcontroller
-import socketpool
 import wifi
 import neopixel
-import adafruit_minimqtt.adafruit_minimqtt as MQTT
-from adafruit_io.adafruit_io import IO_MQTT
 import asyncio
 import gc
+from phonecan.aggregate import NodeAggregator, TEMPERATURE, HUMIDITY
+from phonecan.canrx import AsyncReceiver, RxDrain
+from phonecan.health import BusHealth, ErrorFlags, HealthTable
+from phonecan.network import WifiLink
+from phonecan.node import MeasurementSender, open_can
+from phonecan.profile import LoopProfiler, LoopTable
+from phonecan.registry import NodeRegistry
+from phonecan.sequence import SeqTracker, RECEIVED, MISSING, DUPLICATES, OUT_OF_ORDER
+from phonecan.sampler import Sampler
+from phonecan.publish import Publisher
+from phonecan.clock import WallClock
+from phonecan.outbox import Outbox
 
 gc.enable() # Enable garbage collection
 
-# This is node 3, so offset is 6
-nodeid = 3
-offset = 6
+# This is node 3, so offset is 6.  PHONECAN_NODEID in settings.toml overrides the node number.
+nodeid = os.getenv("PHONECAN_NODEID", 3)
+offset = 2*nodeid
 
 print("This is node :",nodeid)
 
 send_interval = 1 # Seconds
 read_interval = 0.5 # Seconds.  Read should be shorter than send to assure values on the bus.
+sample_interval = 1.0 # Seconds.  The local sensor is read once per interval by one task; everything else uses that sample.
 publish_interval = 60*15 # Seconds
+hold_for = 150.0 # Seconds a node's last value keeps counting towards its averages without a new frame.  Remotes send
+                 #   at least every heartbeat (60 s); a node silent for longer drops out of the averages.
+aio_group = "cannetwork" # Adafruit IO group; each interval's averages go out as one group publish to feeds node<n>-temp/-humid/-pres
+mqtt_loop_interval = 5.0 # Seconds between io.loop() calls, which send the MQTT keepalive on the open session
+mqtt_socket_timeout = 0.1 # Seconds.  Bounds how long io.loop() blocks the other tasks.
+outbox_capacity = 8*96 # Records (one per node per interval) held while WiFi or Adafruit IO is down; 8 nodes for 24 hours.
+                       #   The oldest are dropped when it fills.  14 bytes each.
+outbox_path = None # File to keep the outbox in across resets (needs a writable filesystem), None for RAM only
+aio_flush_interval = 60 # Seconds between publishes while sending a backlog (Adafruit IO free accounts allow 30 data points a minute)
+ntp_timeout = 1.0 # Seconds an NTP request may block the other tasks while setting the clock on a WiFi join
+ntp_retry_interval = 60.0 # Seconds between clock attempts while it is not set
+clock_wait = 600.0 # Seconds queued averages wait for the clock to be set before going up without their time
 can_listen_timeout = 5.0 # Seconds.  Interval during which CAN bus messages are read from the bus.  Set to several seconds
                          #   to allow time for all nodes to report.
+frame_format = "compact" # "compact": all measurements in one frame (see phonecan/codec.py); "legacy": one '<HH' frame each;
+                         #   "summary": each sample goes into a window sent every summary_window seconds (needs id_plan,
+                         #   see phonecan/summary.py).  All formats are always accepted from other nodes.
+summary_window = 60.0 # Seconds
+id_plan = True # Send on the structured, prioritized CAN IDs (see phonecan/registry.py).  Set False, with
+               #   frame_format = "legacy", while a receiver still runs the old code.  Both are always accepted from other nodes.
+rx_ring_size = 64 # Frames buffered between the receive task and collectnodes
+rx_poll_interval = 0 # Seconds.  Receive task poll interval while the bus is quiet.  0 drains continuously, which
+                     #   keeps up with the MCP2515's two receive buffers at 8+ nodes sending at 10 Hz.
+health_interval = 1.0 # Seconds between bus state and error counter samples (see phonecan/health.py)
+health_report_interval = 30.0 # Seconds between this node's bus health frames (sent with id_plan only)
+profile_interval = 300.0 # Seconds between event-loop profiles printed and sent in a CAN frame (id_plan only;
+                         #   see phonecan/profile.py)
+profile_lag_interval = 0.5 # Seconds between event-loop lag checks
+stall_limit = 0.2 # Seconds.  A task step this long without yielding to the other tasks counts as a stall.
+wifi_start_delay = 5.0 # Seconds after boot before the first WiFi join.  The CAN tasks start first and WiFi joins
+                       #   in the background (see phonecan/network.py); averages are queued until it is up.
+wifi_timeout = 3.0 # Seconds the first WiFi join attempt may block the other tasks (no frames are received
+                   #   meanwhile), doubled after each failed attempt up to wifi_max_timeout
+wifi_max_timeout = 10.0
+wifi_backoff = 5.0 # Seconds before retrying a failed join, doubled after each failure up to wifi_max_backoff
+wifi_max_backoff = 300.0
+
+# Nodes on the bus.  The registry maps each node's CAN IDs to (node, measurement) and sets the MCP2515
+#   acceptance filters so only those frames are received.
+nnodes = 8
+accept_legacy = True # Also accept legacy one-measurement frames while any node still sends them
+registry = NodeRegistry(range(nnodes), legacy=accept_legacy)
 
-# nodeid to measurement ID correspondence
-meastonodeid = [0,0,1,1,2,2,3,3,4,4,5,5]
 
 # Neopixel settings
 brightval = 0.3 # Use dim setting for bedrooms...
@@ -58,13 +102,7 @@ color = 0x6600CC # Dark purple
 np = neopixel.NeoPixel(board.NEOPIXEL,1,brightness=brightval)
 
 # Setup CAN bus on featherwing
-cs = DigitalInOut(board.D5)
-cs.switch_to_output()
-spi = busio.SPI(board.SCK, board.MOSI, board.MISO)
-
-can_bus = CAN(
-    spi, cs, loopback=False, silent=False
-)  # use loopback and silent True to test without another device
+can_bus = open_can(CAN, busio.SPI(board.SCK, board.MOSI, board.MISO), DigitalInOut(board.D5))
 print("BUS STATE: ",can_bus.state)
 
 # Use for I2C
@@ -72,18 +110,6 @@ i2c = board.I2C()  # uses board.SCL and board.SDA
 #sensor = MS8607(i2c)
 sensor = adafruit_sht4x.SHT4x(board.I2C())
 
-# WiFi
-try:
-    print("Connecting to %s" % os.getenv("CIRCUITPY_WIFI_SSID"))
-    wifi.radio.connect(os.getenv("CIRCUITPY_WIFI_SSID"), os.getenv("CIRCUITPY_WIFI_PASSWORD"))
-    print("Connected to %s!" % os.getenv("CIRCUITPY_WIFI_SSID"))
-# Wi-Fi connectivity fails with error messages, not specific errors, so this except is broad.
-except Exception as e:  # pylint: disable=broad-except
-    print("Failed to connect to WiFi. Error:", e, "\nBoard will hard reset in 30 seconds.")
-    time.sleep(30)
-    microcontroller.reset()
-
-
 # Define callback functions which will be called when certain events happen.
 def connected(client):
     print("Connected to MQTT Broker!")
@@ -121,82 +147,92 @@ def publish(client, userdata, topic, pid):
     print("Published to {0} with PID {1}".format(topic, pid))
 
 
-# Create a socket pool
-pool = socketpool.SocketPool(wifi.radio)
-
-# Initialize a new MQTT Client object
-mqtt_client = MQTT.MQTT(
-    broker="io.adafruit.com",
-    username=os.getenv("ADAFRUIT_AIO_USERNAME"),
-    password=os.getenv("ADAFRUIT_AIO_KEY"),
-    socket_pool=pool,
-    ssl_context=ssl.create_default_context(),
-)
-
-# Initialize Adafruit IO MQTT "helper"
-io = IO_MQTT(mqtt_client)
-
-# Set up the callback methods above
-io.on_connect = connected
-io.on_disconnect = disconnected
-io.on_message = message
-io.on_subscribe = subscribe
-io.on_publish = publish
-
-
-# If Adafruit IO is not connected...
-if not io.is_connected:
-    # Connect the client to the MQTT broker.
-    print("Connecting to MQTT Broker...")
-    io.connect()
+# The MQTT client and Adafruit IO helper are built by start_mqtt() the first time WiFi is up, so their
+#   modules (and TLS) are not loaded before the CAN tasks start
+mqtt_client = None
+io = None
+pool = None
+
+
+def socket_pool():
+    # The socket pool for MQTT and NTP, created the first time WiFi is up
+    global pool
+    if pool is None:
+        import socketpool
+        pool = socketpool.SocketPool(wifi.radio)
+    return pool
+
+
+def set_clock():
+    # Set the board's clock (UTC) from NTP, so averages go up with the time they were taken
+    import rtc
+    import adafruit_ntp
+    rtc.RTC().datetime = adafruit_ntp.NTP(socket_pool(), tz_offset=0, socket_timeout=ntp_timeout).datetime
+
+
+def start_mqtt(publisher=None):
+    # Build the client and helper if not done yet, and hand them to the publisher
+    global mqtt_client, io
+    if io is None:
+        import ssl
+        import adafruit_minimqtt.adafruit_minimqtt as MQTT
+        from adafruit_io.adafruit_io import IO_MQTT
+
+        # Initialize a new MQTT Client object
+        mqtt_client = MQTT.MQTT(
+            broker="io.adafruit.com",
+            username=os.getenv("ADAFRUIT_AIO_USERNAME"),
+            password=os.getenv("ADAFRUIT_AIO_KEY"),
+            socket_pool=socket_pool(),
+            ssl_context=ssl.create_default_context(),
+            socket_timeout=mqtt_socket_timeout,
+        )
+
+        # Initialize Adafruit IO MQTT "helper"
+        io = IO_MQTT(mqtt_client)
+
+        # Set up the callback methods above
+        io.on_connect = connected
+        io.on_disconnect = disconnected
+        io.on_message = message
+        io.on_subscribe = subscribe
+        io.on_publish = publish
+    if publisher is not None:
+        publisher.attach(io, mqtt_client)
 
 
 class Common():
     # Pass variables around
-    def __init__(self, connected, message, io, sensor, can_bus, nodeid, offset, rxnode, temp, humid, read_interval, send_interval, publish_interval, can_listen_timeout, node_feed, temp_feed, humid_feed):
-        self.connected = connected
-        self.message = message
-        self.io = io
-        self.sensor = sensor
-        self.can_bus = can_bus
+    __slots__ = ("sampler", "sender", "rxdrain", "nodeid", "stats", "nodehealth", "nodeloops", "seqtrack",
+                 "read_interval", "send_interval", "publish_interval", "publisher")
+
+    def __init__(self, sampler, sender, rxdrain, nodeid, stats, nodehealth, nodeloops, seqtrack, read_interval, send_interval, publish_interval, publisher):
+        self.sampler = sampler
+        self.sender = sender
+        self.rxdrain = rxdrain
         self.nodeid = nodeid
-        self.offset = offset
-        self.rxnode = rxnode
-        self.temp = temp
-        self.humid = humid
+        self.stats = stats
+        self.nodehealth = nodehealth
+        self.nodeloops = nodeloops
+        self.seqtrack = seqtrack
         self.read_interval = read_interval
         self.send_interval = send_interval
         self.publish_interval = publish_interval
-        self.can_listen_timeout = can_listen_timeout
-        self.node_feed = node_feed
-        self.temp_feed = temp_feed
-        self.humid_feed = humid_feed
+        self.publisher = publisher
 
 
 async def sendmeas(common: Common):
     # Send out this node's (nodeid = 3) measurements
+    sender = common.sender
     while True:
-        measlist = []
-        #print("Pressure: %.2f hPa" % sensor.pressure)
-        #print("Temperature: %.2f C" % sensor.temperature)
-        #print("Humidity: %.2f %% rH" % sensor.relative_humidity)
-        #print("\n------------------------------------------------\n")
-        #ip, sp = divmod(sensor.pressure, 1)
-        #ps = struct.pack('<HH', int(ip), int(1000*sp))
-        #measlist.append(ps)
-        it, st = divmod(common.sensor.temperature, 1)
-        ts = struct.pack('<HH', int(it), int(1000*st))
-        measlist.append(ts)
-        ih, sh = divmod(common.sensor.relative_humidity, 1)
-        rs = struct.pack('<HH', int(ih), int(1000*sh))
-        measlist.append(rs)
-        for meas in measlist:
-            #print("len(measlist): ",len(measlist)," and meas: ",meas)
-            np.fill(color)
-            common.message = Message(id=measlist.index(meas)+common.offset, data=meas, extended=True)
-            send_success = common.can_bus.send(common.message)
-            #print("Send measurement ",measlist.index(meas)," success:", send_success)
-            np.fill(0)
+        # Latest local sample (see sampler task)
+        sampler = common.sampler
+        np.fill(color)
+        # Each new sample goes into a summary window once, however often this loop runs
+        if sender.queue((sampler.temperature, sampler.humidity, None), now=sampler.time, count=sampler.count):
+            send_success = sender.pump()
+            #print("Send measurements success:", send_success)
+        np.fill(0)
         #print("Transmit Error Count: ",can_bus.transmit_error_count)
         await asyncio.sleep(common.send_interval)
 
@@ -206,104 +242,125 @@ async def collectnodes(common: Common):
     # Since nodes will not always report a temp and humid value at each read,
     #    need to associate each temp or humid value with a node.
     while True:
-        #print("len(common.temp): ",len(common.temp))
-        #print("common.temp: ",common.temp)
-        #print("len(common.humid): ",len(common.humid))
-        #print("common.humid: ",common.humid)
-        #common.rxnode = []
-        #common.temp = []
-        #common.humid = []
-        with common.can_bus.listen(timeout=can_listen_timeout) as listener:
-            message_count = listener.in_waiting()
-            #print(message_count, "messages available")
+        # Take every frame the receive task has buffered since the last read
+        while True:
+            msg = common.rxdrain.get_nowait()
+            if msg is None:
+                break
             #print("Receive Error Count: ",common.can_bus.receive_error_count)
-            for _i in range(message_count):
-                msg = listener.receive()
-                #print("Message from ", hex(msg.id))
-                #if isinstance(msg, Message):
-                    #print("Message Data: ",struct.unpack('<HH',msg.data))
-                #if isinstance(msg, RemoteTransmissionRequest):
-                    #print("RTR length:", msg.length)
-                #print("msg.id",msg.id)
-                #print("Message Data: ",struct.unpack('<HH',msg.data))
-                rxnodeid = meastonodeid[msg.id]
-                #common.rxnode.append(rxnodeid)
-                #
-                msg_unpack = int(struct.unpack('<HH',msg.data)[0])+float(struct.unpack('<HH',msg.data)[1]/1000)
-                #print("Received message from node: ",rxnodeid," measurement number: ",msg.id," msg_unpack: ",msg_unpack)
-                # Message ID to value correspondence: (0,1,2) = (P,T,RH)
-                # Stuff all (node,T,RH) measurements into lists for pushing up to AIO...
-                if msg.id % 2 == 0: # Check to see if msg.id is even (Temperature measurement)
-                    common.temp.append([rxnodeid,msg_unpack])
-                else: # If msg.id is not even, it must be odd (Relative Humidity measurement)
-                    common.humid.append([rxnodeid,msg_unpack])
-        common.temp.append([3,sensor.temperature])
-        common.humid.append([3,sensor.relative_humidity])
+            #print("Message from ", hex(msg.id))
+            #if isinstance(msg, Message):
+                #print("Message Data: ",decode_legacy(msg.data))
+            #if isinstance(msg, RemoteTransmissionRequest):
+                #print("RTR length:", msg.length)
+            #print("msg.id",msg.id)
+            #print("Message Data: ",decode_legacy(msg.data))
+            # Keep each (node,T,RH,P) measurement as the node's current value (health and event-loop
+            #   frames go to their tables; other frames that are not measurements from a known node are
+            #   ignored).  Window summaries are merged in weighted by their sample count.  Sequence
+            #   numbers are counted for the loss rate and duplicate frames are dropped.
+            registry.decode(msg, common.stats.hold, common.nodehealth.update, common.seqtrack.track,
+                            common.stats.merge, common.nodeloops.update)
+        common.stats.hold(common.nodeid, TEMPERATURE, common.sampler.temperature)
+        common.stats.hold(common.nodeid, HUMIDITY, common.sampler.humidity)
+        # Every node's current values count once per read, so the averages are over time, not over frames
+        #   (remotes send more often while values change)
+        common.stats.tick()
         await asyncio.sleep(common.read_interval)
 
 
 async def publishtoaio(common: Common):
     print("In publishtoaio...")
     while True:
-        # Check to make sure that MQTT broker is still connected
-        if not io.is_connected:
-            # Connect the client to the MQTT broker.
-            print("Connecting to Adafruit IO...")
-            io.reconnect()
-        # Current date/time will be tagged by AIO
-        # Calculate average values per node to send to AIO
-        ndlist = [0,1,2,3]
-        tempave = []
-        humidave = []
-        tempave.append(ulab.numpy.mean([i[1] for i in common.temp if i[0] == 0 and i[1] >= 0.0]))
-        tempave.append(ulab.numpy.mean([i[1] for i in common.temp if i[0] == 1 and i[1] >= 0.0]))
-        tempave.append(ulab.numpy.mean([i[1] for i in common.temp if i[0] == 2 and i[1] >= 0.0]))
-        tempave.append(ulab.numpy.mean([i[1] for i in common.temp if i[0] == 3 and i[1] >= 0.0]))
-        humidave.append(ulab.numpy.mean([i[1] for i in common.humid if i[0] == 0 and i[1] >= 0.0]))
-        humidave.append(ulab.numpy.mean([i[1] for i in common.humid if i[0] == 1 and i[1] >= 0.0]))
-        humidave.append(ulab.numpy.mean([i[1] for i in common.humid if i[0] == 2 and i[1] >= 0.0]))
-        humidave.append(ulab.numpy.mean([i[1] for i in common.humid if i[0] == 3 and i[1] >= 0.0]))
-        if io.is_connected:
-            for node,t,rh in zip(ndlist,tempave,humidave):
-                if t != 0 and rh != 0:
-                    print("Publishing value {0} to feed: {1}".format(node,common.node_feed))
-                    #common.io.publish(common.node_feed, node)
-                    print("Publishing value {0} to feed: {1}".format(t,common.temp_feed))
-                    #common.io.publish(common.temp_feed, t)
-                    print("Publishing value {0} to feed: {1}\n".format(rh,common.humid_feed))
-                    #common.io.publish(common.humid_feed, rh)
-                    common.io.publish_multiple([(common.node_feed, node),(common.temp_feed, t), (common.humid_feed, rh)], timeout=1, is_group=True)
-                else:
-                    print("Not publishing value {0} to feed: {1}".format(node,common.node_feed))
-                    print("Not publishing value {0} to feed: {1}".format(t,common.temp_feed))
-                    print("Not publishing value {0} to feed: {1}\n".format(rh,common.humid_feed))
-            print("\n")
-            tempave = []
-            humidave = []
-            common.rxnode = []
-            common.temp = []
-            common.humid = []
-            io.disconnect()
-            gc.collect()
-            print("Free Memory After Push to AIO: ",gc.mem_free())
+        # Intervals are stamped with the board clock once NTP has set it, and with time.monotonic() before;
+        #   the publisher dates those once the clock is set (see phonecan/clock.py)
+        # Average values per node are kept as running statistics, so reading them is O(1)
+        #   per node.  Each interval's averages are queued in the outbox and sent from there,
+        #   so intervals that end while WiFi or the broker is down are sent once it is back
+        #   (the publisher task works through the backlog).
+        publisher = common.publisher
+        # Each node's rolling frame loss goes up with its averages, as feed node<n>-loss (%)
+        queued = publisher.outbox.put_stats(publisher.clock.stamp(), common.stats, registry.nodes, loss=common.seqtrack.loss_rate)
+        common.stats.reset()
+        sent = publisher.flush()
+        if sent:
+            print("Published {0} node averages to group {1} in {2:.3f} s".format(sent, publisher.group, publisher.last_latency))
+            for node, counts in common.rxdrain.stats.nodes.items():
+                print("Node {0} frames received: {1} dropped: {2}".format(node, counts[0], counts[1]))
+            for node, counts in sorted(common.seqtrack.nodes.items()):
+                print("Node {0} sequence received: {1} missing: {2} duplicate: {3} out of order: {4} loss: {5:.1%}".format(
+                    node, counts[RECEIVED], counts[MISSING], counts[DUPLICATES], counts[OUT_OF_ORDER],
+                    common.seqtrack.loss_rate(node)))
+            print("MCP2515 receive overflows: ", common.rxdrain.stats.hw_overflows)
+            for line in common.nodehealth.lines():
+                print(line)
+            for line in common.nodeloops.lines():
+                print(line)
+        elif queued:
+            print("MQTT Broker or Wifi Not Connected...Queued {0} node averages ({1} waiting, {2} dropped)...\n".format(queued, len(publisher.outbox), publisher.outbox.evicted))
         else:
-            print("MQTT Broker or Wifi Not Connected...Going Back to Sleep...\n")
+            print("No measurements to publish...\n")
+        gc.collect()
+        print("Free Memory After Push to AIO: ",gc.mem_free())
         await asyncio.sleep(common.publish_interval)
 
 
+async def loopstats(profiler):
+    # Event-loop lag every profile_lag_interval, and the task profile every profile_interval
+    while True:
+        await profiler.sleep(profile_lag_interval)
+        for line in profiler.poll():
+            print(line)
+
+
 async def main():
-    rxnode = []
-    temp = []
-    humid = []
-    #group_name = "cannetwork"
-    node_feed = "cannetwork.nodeid"
-    temp_feed = "cannetwork.nodetemp"
-    humid_feed = "cannetwork.nodehumid"
-    #io.subscribe(group_key=group_name)
-    _common = Common(connected, message, io, sensor, can_bus, nodeid, offset, rxnode, temp, humid, read_interval, send_interval, publish_interval, can_listen_timeout, node_feed, temp_feed, humid_feed)
-    sendmeas_task = asyncio.create_task(sendmeas(_common))
-    collectnodes_task = asyncio.create_task(collectnodes(_common))
-    publishtoaio_task = asyncio.create_task(publishtoaio(_common))
-    await asyncio.gather(sendmeas_task, collectnodes_task, publishtoaio_task)
+    stats = NodeAggregator(hold_for=hold_for)
+    nodehealth = HealthTable()
+    nodeloops = LoopTable()
+    seqtrack = SeqTracker()
+    # One reader of the MCP2515 error flags, so receive overflows are counted whichever task reads them first
+    eflags = ErrorFlags(can_bus)
+    rxdrain = RxDrain(AsyncReceiver(can_bus, matches=registry.matches(Match), poll_interval=rx_poll_interval), ring_size=rx_ring_size, node_of=registry.node_of, flags=eflags)
+    # Restarts the controller only when it is bus off, with backoff; the receive listener is re-opened after a restart
+    health = BusHealth(can_bus, Message if id_plan else None, nodeid, interval=health_interval,
+                       report_interval=health_report_interval, on_restart=[rxdrain.receiver.close], flags=eflags,
+                       nnodes=nnodes)
+    # WiFi joins in the background, with backoff, while the CAN tasks run; the publisher waits for it
+    link = WifiLink(wifi.radio, os.getenv("CIRCUITPY_WIFI_SSID"), os.getenv("CIRCUITPY_WIFI_PASSWORD"),
+                    timeout=wifi_timeout, max_timeout=wifi_max_timeout, backoff=wifi_backoff,
+                    max_backoff=wifi_max_backoff, start_delay=wifi_start_delay)
+    outbox = Outbox(outbox_capacity, path=outbox_path)
+    clock = WallClock(set_clock, retry_interval=ntp_retry_interval)
+    publisher = Publisher(io, aio_group, loop_interval=mqtt_loop_interval, loop_timeout=mqtt_socket_timeout,
+                          outbox=outbox, flush_interval=aio_flush_interval,
+                          mqtt=mqtt_client, username=os.getenv("ADAFRUIT_AIO_USERNAME"), qos=1, network=link,
+                          clock=clock, clock_wait=clock_wait)
+    # Once WiFi is up: set the clock, build the Adafruit IO client, then send the averages queued while it was joining
+    link.on_connect.append(clock.sync)
+    link.on_connect.append(lambda: start_mqtt(publisher))
+    link.on_connect.append(publisher.flush)
+    sampler = Sampler(sensor, interval=sample_interval)
+    sampler.read() # First sample before the tasks that use it start
+    # Packs the local sample in frame_format and numbers the frames (see phonecan/node.py)
+    sender = MeasurementSender(can_bus, Message, nodeid, frame_format, id_plan, (TEMPERATURE, HUMIDITY), summary_window,
+                               nnodes=nnodes)
+    _common = Common(sampler, sender, rxdrain, nodeid, stats, nodehealth, nodeloops, seqtrack, read_interval, send_interval, publish_interval, publisher)
+    # Every task is timed step by step, so a task that blocks the others shows up as a stall
+    profiler = LoopProfiler(stall=stall_limit, report_interval=profile_interval,
+                            message_class=Message if id_plan else None, can_bus=can_bus, nodeid=nodeid,
+                            nnodes=nnodes)
+    rxdrain_task = profiler.task("rxdrain", rxdrain.run())
+    sampler_task = profiler.task("sampler", sampler.run())
+    health_task = profiler.task("health", health.run())
+    sendmeas_task = profiler.task("sendmeas", sendmeas(_common))
+    collectnodes_task = profiler.task("collectnodes", collectnodes(_common))
+    publisher_task = profiler.task("publisher", publisher.run())
+    publishtoaio_task = profiler.task("publishtoaio", publishtoaio(_common))
+    # Created last, so the CAN tasks have run (the receive listener is open, the first frame sent) before the
+    #   first join blocks
+    wifi_task = profiler.task("wifi", link.run())
+    loopstats_task = asyncio.create_task(loopstats(profiler))
+    await asyncio.gather(rxdrain_task, sampler_task, health_task, sendmeas_task, collectnodes_task, publisher_task, publishtoaio_task,
+                         wifi_task, loopstats_task)
 
 asyncio.run(main())
\ No newline at end of file
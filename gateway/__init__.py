@@ -0,0 +1,4 @@
+#
+# Linux host gateway (CPython): collects PhoneCAN frames through python-can
+# into a local SQLite time-series store.  Not for CIRCUITPY.
+#
@@ -0,0 +1,142 @@
+#
+# Gateway collector: python-can -> SQLite
+#
+# Reads PhoneCAN frames from any python-can interface (socketcan on a Linux
+# host with a CAN adapter, virtual for tests), decodes them with the same
+# registry and codec as the nodes (NodeRegistry.decode()) and writes every
+# measurement to a gateway.store.Store.  A window summary frame is stored as
+# one row with the window's mean; health and event-loop profile frames carry
+# no measurements and are ignored.
+#
+# Frames arrive through a can.Notifier into an asyncio queue.  Decoded rows
+# are collected into batches of batch_size rows (or whatever arrived within
+# flush_interval seconds) and each batch is written in one transaction on a
+# single writer thread, so the event loop keeps receiving while SQLite
+# commits.  At most one batch is being written at a time; the next one
+# builds up meanwhile.
+#
+# Run on the host:
+#   python -m gateway.collector --interface socketcan --channel can0 --db phonecan.db
+#
+import time
+import asyncio
+import argparse
+import concurrent.futures
+
+import can
+
+from phonecan.registry import NodeRegistry
+from gateway.store import Store
+
+
+class _Match():
+    # Stand-in for canio.Match so NodeRegistry.matches() can build python-can filters
+    def __init__(self, id, mask=None, extended=False):
+        self.id = id
+        self.mask = mask
+        self.extended = extended
+
+
+def can_filters(registry):
+    # python-can filters (applied by the kernel for socketcan) for the registry's frames
+    return [{"can_id": m.id, "can_mask": m.mask, "extended": m.extended} for m in registry.matches(_Match)]
+
+
+class _Frame():
+    # canio-style view (id, data) of a python-can Message, as NodeRegistry.decode() reads frames
+    __slots__ = ("id", "data")
+
+    def __init__(self, msg):
+        self.id = msg.arbitration_id
+        self.data = msg.data
+
+
+def decode(registry, msg, rows):
+    # Append a (ts, node, quantity, value) row per measurement in msg; returns False for frames that are not measurements
+    timestamp = msg.timestamp
+
+    def add(node, quantity, value):
+        rows.append((timestamp, node, quantity, value))
+    return registry.decode(_Frame(msg), add) is not None
+
+
+class Collector():
+    def __init__(self, bus, store, registry, batch_size=1000, flush_interval=0.5):
+        self.bus = bus
+        self.store = store
+        self.registry = registry
+        self.batch_size = batch_size # Rows per transaction
+        self.flush_interval = flush_interval # Seconds a partial batch may wait
+        self.frames = 0
+        self.ignored = 0
+        self.stop_event = None
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        reader = can.AsyncBufferedReader()
+        notifier = can.Notifier(self.bus, [reader], loop=loop)
+        writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        pending = None # Batch being written
+        batch = []
+        last_flush = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    msg = await asyncio.wait_for(reader.get_message(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    msg = None
+                while msg is not None:
+                    self.frames += 1
+                    if not decode(self.registry, msg, batch):
+                        self.ignored += 1
+                    if len(batch) >= self.batch_size or reader.buffer.empty():
+                        break
+                    msg = reader.buffer.get_nowait()
+                now = time.monotonic()
+                if batch and (len(batch) >= self.batch_size or now - last_flush >= self.flush_interval):
+                    if pending is not None:
+                        await pending
+                    pending = loop.run_in_executor(writer, self.store.insert_many, batch)
+                    batch = []
+                    last_flush = now
+        finally:
+            notifier.stop()
+            if pending is not None:
+                await pending
+            if batch:
+                await loop.run_in_executor(writer, self.store.insert_many, batch)
+            writer.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect PhoneCAN measurements into SQLite")
+    parser.add_argument("--interface", default="socketcan", help="python-can interface (socketcan, virtual, ...)")
+    parser.add_argument("--channel", default="can0")
+    parser.add_argument("--db", default="phonecan.db")
+    parser.add_argument("--nodes", type=int, default=8, help="Node IDs 0..nodes-1 are accepted")
+    parser.add_argument("--no-legacy", action="store_true", help="Ignore legacy one-measurement frames")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    registry = NodeRegistry(range(args.nodes), legacy=not args.no_legacy)
+    store = Store(args.db)
+    bus = can.Bus(interface=args.interface, channel=args.channel, can_filters=can_filters(registry))
+    collector = Collector(bus, store, registry, batch_size=args.batch_size, flush_interval=args.flush_interval)
+    try:
+        asyncio.run(collector.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.shutdown()
+        store.close()
+        print("Frames: {0}  ignored: {1}  rows stored: {2}".format(collector.frames, collector.ignored, store.rows_written))
+
+
+if __name__ == "__main__":
+    main()
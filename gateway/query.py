@@ -0,0 +1,45 @@
+#
+# Query the gateway store from the command line
+#
+#   python -m gateway.query --db phonecan.db --node 1 --quantity temp --since 3600
+#   python -m gateway.query --db phonecan.db --node 1 --quantity humid --since 86400 --step 900
+#
+# Without --step every stored value in the range is printed; with --step the
+# values are downsampled to mean/min/max/count per step seconds.
+#
+import time
+import argparse
+
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from gateway.store import Store
+
+QUANTITIES = {"temp": TEMPERATURE, "humid": HUMIDITY, "pres": PRESSURE}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query PhoneCAN measurements stored by the gateway")
+    parser.add_argument("--db", default="phonecan.db")
+    parser.add_argument("--node", type=int, required=True)
+    parser.add_argument("--quantity", choices=sorted(QUANTITIES), default="temp")
+    parser.add_argument("--since", type=float, default=3600.0, help="Seconds back from now (ignored with --start)")
+    parser.add_argument("--start", type=float, help="Range start, seconds since the epoch")
+    parser.add_argument("--end", type=float, help="Range end, seconds since the epoch (default now)")
+    parser.add_argument("--step", type=float, help="Downsample to buckets of this many seconds")
+    args = parser.parse_args()
+
+    end = time.time() if args.end is None else args.end
+    start = end - args.since if args.start is None else args.start
+    store = Store(args.db)
+    quantity = QUANTITIES[args.quantity]
+    if args.step:
+        for bucket, mean, low, high, count in store.downsample(args.node, quantity, start, end, args.step):
+            print("{0}  mean {1:.2f}  min {2:.2f}  max {3:.2f}  n {4}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(bucket)), mean, low, high, count))
+    else:
+        for ts, value in store.range(args.node, quantity, start, end):
+            print("{0:.3f}  {1:.2f}".format(ts, value))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
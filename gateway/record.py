@@ -0,0 +1,47 @@
+#
+# Record bus traffic to a PhoneCAN log (phonecan/canlog.py)
+#
+# Records every frame seen on a python-can interface, not just the ones the
+# nodes decode, so a replay sees the real bus load.  Stop with Ctrl-C or
+# after --seconds.
+#
+#   python -m gateway.record --interface socketcan --channel can0 --out house.canlog
+#
+# Replay the log with: python -m sim.replay house.canlog --speed 10
+#
+import time
+import argparse
+
+import can
+
+from phonecan.canlog import LogWriter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record CAN frames to a PhoneCAN log")
+    parser.add_argument("--interface", default="socketcan", help="python-can interface (socketcan, virtual, ...)")
+    parser.add_argument("--channel", default="can0")
+    parser.add_argument("--out", default="phonecan.canlog")
+    parser.add_argument("--seconds", type=float, help="Stop after this many seconds")
+    args = parser.parse_args()
+
+    bus = can.Bus(interface=args.interface, channel=args.channel)
+    end = None if args.seconds is None else time.monotonic() + args.seconds
+    with open(args.out, "wb") as f:
+        writer = LogWriter(f)
+        try:
+            while end is None or time.monotonic() < end:
+                msg = bus.recv(timeout=0.5)
+                if msg is None or msg.is_error_frame or msg.is_remote_frame:
+                    continue
+                writer.write(msg.timestamp, msg.arbitration_id, msg.is_extended_id, msg.data)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            writer.flush()
+            bus.shutdown()
+    print("Recorded {0} frames to {1}".format(writer.count, args.out))
+
+
+if __name__ == "__main__":
+    main()
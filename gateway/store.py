@@ -0,0 +1,69 @@
+#
+# SQLite time-series store for the gateway
+#
+# One row per measurement: (ts, node, quantity, value), ts in seconds since
+# the epoch, quantity as in phonecan.aggregate (0 = temperature,
+# 1 = humidity, 2 = pressure).  The database runs in WAL mode so queries can
+# read while the collector writes, and rows are inserted in batches, one
+# transaction per batch, which is what lets it keep every frame at thousands
+# of frames per second.
+#
+# Queries:
+#   range(node, quantity, start, end)            -> [(ts, value), ...]
+#   downsample(node, quantity, start, end, step) -> [(bucket start, mean, min, max, count), ...]
+#
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL NOT NULL,
+    node INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_node_quantity_ts ON samples (node, quantity, ts);
+"""
+
+
+class Store():
+    def __init__(self, path, synchronous="NORMAL"):
+        # check_same_thread=False: the collector writes from its one writer thread, queries may come from another
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode; only a power cut can lose the last commits
+        self.db.execute("PRAGMA synchronous={}".format(synchronous))
+        self.db.executescript(SCHEMA)
+        self.rows_written = 0
+        self.batches_written = 0
+
+    def close(self):
+        self.db.close()
+
+    def insert_many(self, rows):
+        # rows: sequence of (ts, node, quantity, value), written in one transaction
+        with self.db:
+            self.db.executemany("INSERT INTO samples (ts, node, quantity, value) VALUES (?, ?, ?, ?)", rows)
+        self.rows_written += len(rows)
+        self.batches_written += 1
+
+    def range(self, node, quantity, start, end):
+        cursor = self.db.execute(
+            "SELECT ts, value FROM samples WHERE node = ? AND quantity = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (node, quantity, start, end))
+        return cursor.fetchall()
+
+    def downsample(self, node, quantity, start, end, step):
+        # Mean/min/max/count per step-second bucket, buckets aligned to multiples of step
+        cursor = self.db.execute(
+            "SELECT CAST(ts / ? AS INTEGER) * ? AS bucket, AVG(value), MIN(value), MAX(value), COUNT(*) "
+            "FROM samples WHERE node = ? AND quantity = ? AND ts >= ? AND ts < ? "
+            "GROUP BY bucket ORDER BY bucket",
+            (step, step, node, quantity, start, end))
+        return cursor.fetchall()
+
+    def nodes(self):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT node FROM samples ORDER BY node")]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
@@ -0,0 +1,6 @@
+#
+# PhoneCAN shared library
+#
+# Code shared by the home, send and remote node scripts.  Copy the phonecan
+# directory to the root of CIRCUITPY (next to code.py) on every node.
+#
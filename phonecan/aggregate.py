@@ -0,0 +1,122 @@
+#
+# Constant-memory running statistics for node measurements
+#
+# The send node used to append every received value to a list and average the
+# lists when publishing, so memory grew with the publish interval.  Instead,
+# each (node, quantity) pair keeps one RunningStat with the count, mean
+# (Welford-style incremental update), min, max and last value.  Memory is
+# O(nodes) no matter how long the interval is, and reading an average is O(1).
+#
+# merge() folds in a whole window summarized on a remote node (count, mean,
+# min, max; phonecan/summary.py) as if its samples had been added one by
+# one, so a mean over several windows is the mean of all their samples.
+#
+# Nodes with a send policy (phonecan/policy.py) send often while a value
+# changes and seldom while it is steady, so averaging the frames would weight
+# the averages towards periods of change.  The send node instead passes
+# received values to hold(), which keeps each node's latest value, and calls
+# tick() once per read; tick() adds every held value once, so each value
+# counts for as long as it was current, as when every node sent every
+# reading.  A value not renewed within hold_for seconds (a node gone quiet)
+# is no longer added.
+#
+import time
+
+# Quantity index within a node (matches msg.id % 2 for the legacy ID scheme;
+# pressure only arrives in compact frames)
+TEMPERATURE = 0
+HUMIDITY = 1
+PRESSURE = 2
+NQUANTITIES = 3
+
+
+class RunningStat():
+    # Running count/mean/min/max/last of a stream of values
+    __slots__ = ("count", "mean", "min", "max", "last")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, value):
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.last = value
+
+    def merge(self, count, mean, low, high):
+        # Add count values with the given mean, min and max
+        if count <= 0:
+            return
+        self.count += count
+        self.mean += (mean - self.mean) * count / self.count
+        if self.min is None or low < self.min:
+            self.min = low
+        if self.max is None or high > self.max:
+            self.max = high
+        self.last = mean
+
+
+class NodeAggregator():
+    # One RunningStat per (node, quantity).  Nodes are added the first time
+    # they report, so the table only holds nodes actually heard on the bus.
+    def __init__(self, nquantities=NQUANTITIES, hold_for=150.0):
+        self.nquantities = nquantities
+        self.hold_for = hold_for # Seconds a held value is added by tick() without being renewed
+        self.nodes = {}
+        self.held = {} # nodeid: [[value, time.monotonic() it arrived] per quantity]
+
+    def node(self, nodeid):
+        stats = self.nodes.get(nodeid)
+        if stats is None:
+            stats = [RunningStat() for _q in range(self.nquantities)]
+            self.nodes[nodeid] = stats
+        return stats
+
+    def add(self, nodeid, quantity, value):
+        self.node(nodeid)[quantity].add(value)
+
+    def merge(self, nodeid, quantity, count, mean, low, high):
+        self.node(nodeid)[quantity].merge(count, mean, low, high)
+
+    def hold(self, nodeid, quantity, value, now=None):
+        # Keep value as the node's current reading until the next one (same arguments as add())
+        if now is None:
+            now = time.monotonic()
+        held = self.held.get(nodeid)
+        if held is None:
+            self.node(nodeid)
+            held = [[None, None] for _q in range(self.nquantities)]
+            self.held[nodeid] = held
+        entry = held[quantity]
+        entry[0] = value
+        entry[1] = now
+
+    def tick(self, now=None):
+        # Add every held value that is still current once
+        if now is None:
+            now = time.monotonic()
+        for nodeid, held in self.held.items():
+            stats = self.nodes[nodeid]
+            for quantity in range(self.nquantities):
+                value, since = held[quantity]
+                if value is not None and now - since <= self.hold_for:
+                    stats[quantity].add(value)
+
+    def stat(self, nodeid, quantity):
+        return self.node(nodeid)[quantity]
+
+    def reset(self):
+        # Keep the RunningStat objects so a publish cycle does not reallocate
+        for stats in self.nodes.values():
+            for stat in stats:
+                stat.reset()
@@ -0,0 +1,47 @@
+#
+# Last-value cache of node measurements
+#
+# Every received frame updates the cache, so the home node can show a node the
+# moment its button is pressed instead of waiting for that node's next frame.
+# Each value carries the time it was received; values older than stale_after
+# seconds are reported as stale.
+#
+import time
+
+from phonecan.aggregate import NQUANTITIES
+
+
+class NodeCache():
+    def __init__(self, stale_after=10.0):
+        self.stale_after = stale_after # Seconds
+        # nodeid -> [value per quantity..., receive time per quantity...]
+        self.nodes = {}
+
+    def update(self, nodeid, quantity, value, now=None):
+        if now is None:
+            now = time.monotonic()
+        entry = self.nodes.get(nodeid)
+        if entry is None:
+            entry = [None]*(2*NQUANTITIES)
+            self.nodes[nodeid] = entry
+        entry[quantity] = value
+        entry[NQUANTITIES + quantity] = now
+
+    def value(self, nodeid, quantity):
+        entry = self.nodes.get(nodeid)
+        if entry is None:
+            return None
+        return entry[quantity]
+
+    def age(self, nodeid, quantity, now=None):
+        # Seconds since the value was received, None if it never was
+        entry = self.nodes.get(nodeid)
+        if entry is None or entry[NQUANTITIES + quantity] is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return now - entry[NQUANTITIES + quantity]
+
+    def is_stale(self, nodeid, quantity, now=None):
+        age = self.age(nodeid, quantity, now)
+        return age is None or age > self.stale_after
@@ -0,0 +1,79 @@
+#
+# Binary CAN bus log
+#
+# Fixed-size records so a log can be memory-mapped and indexed directly:
+#
+#   header, 16 bytes: magic b"PCANLOG1", uint32 record size, uint32 reserved
+#   record, 24 bytes:
+#     float64 timestamp (seconds; any origin, only differences matter on replay)
+#     uint32  CAN ID
+#     uint8   flags (bit 0 = extended ID)
+#     uint8   data length, 0-8
+#     2 bytes padding
+#     8 bytes data (zero padded)
+#
+# LogWriter appends records to an open binary file (a python-can recorder on
+# the host, or a node writing to an SD card).  LogReader reads a log through
+# mmap where available (CPython) and falls back to reading the whole file.
+#
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+from phonecan.codec import _Struct
+
+MAGIC = b"PCANLOG1"
+HEADER = _Struct('<8sII')
+HEADER_SIZE = HEADER.size
+RECORD = _Struct('<dIBBxx8s')
+RECORD_SIZE = RECORD.size
+FLAG_EXTENDED = 0x01
+
+
+class LogWriter():
+    def __init__(self, file):
+        self.file = file
+        self.buf = bytearray(RECORD_SIZE)
+        self.count = 0
+        header = bytearray(HEADER_SIZE)
+        HEADER.pack_into(header, 0, MAGIC, RECORD_SIZE, 0)
+        file.write(header)
+
+    def write(self, timestamp, can_id, extended, data):
+        RECORD.pack_into(self.buf, 0, timestamp, can_id, FLAG_EXTENDED if extended else 0, len(data), bytes(data))
+        self.file.write(self.buf)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+
+class LogReader():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if mmap is not None:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = self.file.read()
+        magic, record_size, _reserved = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            raise ValueError("not a PhoneCAN log: {}".format(path))
+        self.count = (len(self.data) - HEADER_SIZE) // RECORD_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        # (timestamp, can_id, extended, data)
+        timestamp, can_id, flags, length, data = RECORD.unpack_from(self.data, HEADER_SIZE + index*RECORD_SIZE)
+        return timestamp, can_id, bool(flags & FLAG_EXTENDED), data[:length]
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.record(index)
+
+    def close(self):
+        if mmap is not None:
+            self.data.close()
+        self.file.close()
@@ -0,0 +1,167 @@
+#
+# Non-blocking CAN receive path
+#
+# The node scripts used to open can_bus.listen() inside an asyncio task and
+# pull every waiting frame with listener.receive() in one go, which stalls the
+# other tasks (buttons, sendmeas, MQTT) while the frames come in over SPI.
+# AsyncReceiver keeps one listener open, only calls receive() when a frame is
+# already waiting (so it never blocks on the listener timeout), and yields to
+# the event loop after every frame.
+#
+# Usage:
+#   receiver = AsyncReceiver(can_bus)
+#   msg = await receiver.recv(timeout=5.0)   # None if nothing arrived
+#   async for msg in receiver:               # or iterate forever
+#       ...
+#
+# RxDrain (below) runs the receiver as its own task and buffers frames in a
+# ring, for nodes whose consumers only read every read_interval seconds.
+#
+import time
+import asyncio
+
+from phonecan.health import ErrorFlags
+
+
+class AsyncReceiver():
+    def __init__(self, can_bus, matches=None, poll_interval=0.01):
+        self.can_bus = can_bus
+        self.matches = matches
+        self.poll_interval = poll_interval # Seconds between polls while the bus is quiet
+        self.listener = None
+
+    def open(self):
+        if self.listener is None:
+            # receive() is only called when a frame is waiting, so the listener timeout is never used
+            self.listener = self.can_bus.listen(matches=self.matches, timeout=0)
+        return self.listener
+
+    def close(self):
+        # Call after can_bus.restart() so the next receive re-opens the listener
+        if self.listener is not None:
+            self.listener.deinit()
+            self.listener = None
+
+    def receive_nowait(self):
+        # Return one waiting frame, or None without blocking
+        listener = self.open()
+        if listener.in_waiting():
+            return listener.receive()
+        return None
+
+    async def recv(self, timeout=None):
+        # Wait for the next frame, yielding to other tasks while the bus is quiet and after each frame.
+        # Returns None if timeout (seconds) passes first; timeout=0 only returns a frame already waiting.
+        start = time.monotonic()
+        while True:
+            msg = self.receive_nowait()
+            if msg is not None:
+                await asyncio.sleep(0)
+                return msg
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.recv()
+
+
+class FrameRing():
+    # Fixed-size ring buffer of received frames.  Slots are allocated once; when the
+    # ring is full the new frame is refused so the consumer sees frames in order.
+    def __init__(self, size):
+        self.size = size
+        self.slots = [None]*size
+        self.head = 0 # Next slot to read
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def put(self, msg):
+        if self.count >= self.size:
+            return False
+        self.slots[(self.head + self.count) % self.size] = msg
+        self.count += 1
+        return True
+
+    def get(self):
+        if self.count == 0:
+            return None
+        msg = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % self.size
+        self.count -= 1
+        return msg
+
+
+class RxStats():
+    # Frame counters per node: nodes[nodeid] = [received, dropped].  Dropped counts frames
+    # refused by a full ring; hardware overflows cannot be tied to a node and are kept in
+    # hw_overflows.
+    def __init__(self):
+        self.nodes = {}
+        self.hw_overflows = 0
+
+    def node(self, nodeid):
+        counts = self.nodes.get(nodeid)
+        if counts is None:
+            counts = [0, 0]
+            self.nodes[nodeid] = counts
+        return counts
+
+    def loss_rate(self, nodeid):
+        received, dropped = self.node(nodeid)
+        if received == 0:
+            return 0.0
+        return dropped / received
+
+
+class RxDrain():
+    # Dedicated receive task that empties the MCP2515's two hardware buffers as fast as
+    # frames arrive and parks them in a software ring for the slower consumers.
+    # node_of(msg_id) maps a CAN ID to a node for the per-node statistics.  flags is the node's
+    # ErrorFlags, shared with its BusHealth so both see every receive overflow.
+    #
+    # Usage:
+    #   drain = RxDrain(AsyncReceiver(can_bus, poll_interval=0.002), ring_size=64, node_of=...)
+    #   asyncio.create_task(drain.run())
+    #   msg = drain.get_nowait()              # or: msg = await drain.recv(timeout)
+    def __init__(self, receiver, ring_size=64, node_of=None, flags=None):
+        self.receiver = receiver
+        self.ring = FrameRing(ring_size)
+        self.node_of = node_of
+        self.flags = flags if flags is not None else ErrorFlags(receiver.can_bus)
+        self.stats = RxStats()
+
+    async def run(self):
+        while True:
+            msg = self.receiver.receive_nowait()
+            if msg is None:
+                # Bus is quiet: check the overflow flags, then poll again shortly
+                self.flags.read()
+                self.stats.hw_overflows = self.flags.rx_overflows
+                await asyncio.sleep(self.receiver.poll_interval)
+                continue
+            counts = self.stats.node(self.node_of(msg.id) if self.node_of else None)
+            counts[0] += 1
+            if not self.ring.put(msg):
+                counts[1] += 1
+            await asyncio.sleep(0)
+
+    def get_nowait(self):
+        return self.ring.get()
+
+    async def recv(self, timeout=None):
+        # Same contract as AsyncReceiver.recv(), served from the ring
+        start = time.monotonic()
+        while True:
+            msg = self.ring.get()
+            if msg is not None:
+                return msg
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return None
+            await asyncio.sleep(self.receiver.poll_interval)
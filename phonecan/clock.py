@@ -0,0 +1,84 @@
+#
+# Wall-clock time for the send node's uploads
+#
+# The boards have no battery-backed clock: time.time() starts from
+# 2000-01-01 at every boot until something sets the RTC.  Averages stamped
+# with it carried no created_at, so Adafruit IO timed each interval when it
+# was finally sent, which after an outage is its flush time.
+#
+# A WallClock stamps each interval with time.time() once the clock is valid
+# (at or after MIN_VALID_TIME) and with time.monotonic() seconds before
+# that; monotonic stamps stay far below MIN_VALID_TIME, so the two cannot be
+# confused.  sync() calls set_time (on the send node, setting the RTC from
+# NTP) and is called on every WiFi join.  Once the clock is valid, wall()
+# turns a monotonic stamp into the wall-clock time it was taken, so
+# intervals queued before the first sync still go up with their own time.
+# Monotonic stamps only mean something within the boot that took them.
+#
+# Times are kept as integers: CircuitPython floats cannot hold a
+# time.time() value to the second.
+#
+import time
+
+# Timestamps before this (2020-09-13) mean the clock was never set
+MIN_VALID_TIME = 1600000000
+
+
+class WallClock():
+    def __init__(self, set_time=None, retry_interval=60.0):
+        self.set_time = set_time # Sets the RTC (e.g. from adafruit_ntp); may raise on network errors
+        self.retry_interval = retry_interval # Minimum seconds between set_time attempts
+        self.offset = None # time.time() - time.monotonic(), once the clock is valid
+        self.last_attempt = None
+        self.syncs = 0
+        self.failures = 0
+        self.check()
+
+    @property
+    def synced(self):
+        return self.offset is not None
+
+    def check(self):
+        # True if time.time() is valid, taking its offset from time.monotonic()
+        now = int(time.time())
+        if now < MIN_VALID_TIME:
+            return False
+        self.offset = now - int(time.monotonic())
+        return True
+
+    def sync(self, now=None):
+        # Set the clock if it is not valid yet, at most every retry_interval seconds; True if valid
+        if self.synced or self.check():
+            return True
+        if self.set_time is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if self.last_attempt is not None and now - self.last_attempt < self.retry_interval:
+            return False
+        self.last_attempt = now
+        try:
+            self.set_time()
+        except Exception as e:  # pylint: disable=broad-except
+            self.failures += 1
+            print("Clock sync failed: ", e)
+            return False
+        if not self.check():
+            self.failures += 1
+            return False
+        self.syncs += 1
+        return True
+
+    def stamp(self):
+        # time.time() once valid, time.monotonic() seconds before
+        if self.synced or self.check():
+            return int(time.time())
+        return int(time.monotonic())
+
+    def wall(self, stamp):
+        # Wall-clock time of a stamp() from this boot, or None while the clock is not valid
+        if stamp >= MIN_VALID_TIME:
+            return stamp
+        if self.offset is None:
+            return None
+        return stamp + self.offset
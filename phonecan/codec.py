@@ -0,0 +1,190 @@
+#
+# CAN payload codec shared by all nodes
+#
+# Compact format (version 1), one 8-byte frame per node per cycle:
+#   byte 0     version (high nibble) | flags (bit 0 = pressure present)
+#   byte 1     sequence number, 0-255, incremented every frame
+#   bytes 2-3  temperature, int16, 0.01 C
+#   bytes 4-5  relative humidity, uint16, 0.01 %
+#   bytes 6-7  pressure, uint16, 0.1 hPa (0 when not present)
+#
+# Legacy format, one 4-byte frame per measurement: '<hH' integer part
+# (floor, so negative values work) and thousandths of the fractional part.
+# Older nodes packed the integer part as unsigned 'H', which is identical for
+# every value they could send.  Legacy frames stay exactly 4 bytes, with no
+# sequence number, because older receivers unpack the whole payload as
+# '<HH' and fail on any other length.
+#
+# Summary format, one 8-byte frame per quantity per window (the quantity is
+# in the CAN ID, see phonecan/registry.py and phonecan/summary.py):
+#   byte 0     sequence number, as in the compact format
+#   byte 1     samples in the window, 0-255
+#   bytes 2-3  mean, int16
+#   bytes 4-5  minimum, int16
+#   bytes 6-7  maximum, int16
+# in SUMMARY_SCALES units per quantity: 0.01 C, 0.01 %rH, 0.1 hPa.
+#
+# Health format (version 1), one 8-byte frame per node (see phonecan/health.py):
+#   byte 0     version (high nibble)
+#   byte 1     bus state (0 error active, 1 warning, 2 error passive, 3 bus off)
+#   bytes 2-3  transmit and receive error counters
+#   byte 4     controller restarts
+#   byte 5     times the node went bus off
+#   bytes 6-7  transmit and receive error counter increase, rolling rate, 0.1 per second
+#
+# Event-loop format (version 1), one 8-byte frame per node (see phonecan/profile.py):
+#   byte 0     version (high nibble)
+#   byte 1     task with the longest step since the last frame (its index in the node's
+#              profile), 255 for none
+#   bytes 2-3  longest task step since the last frame, ms, uint16
+#   bytes 4-5  longest event-loop lag since the last frame, ms, uint16
+#   bytes 6-7  stalls since the node started, uint16
+#
+# Values outside a field's range are saturated to the nearest end instead of
+# raising.  The pack_*_into functions write into a preallocated bytearray so
+# the send loops do not allocate a new payload every cycle, and each decode
+# is a single unpack.
+#
+import struct
+
+COMPACT_VERSION = 1
+HEALTH_VERSION = 1
+LOOP_VERSION = 1
+FLAG_PRESSURE = 0x01
+
+try:
+    _Struct = struct.Struct
+except AttributeError:
+    class _Struct():
+        # CircuitPython's struct module has no Struct class; keep the format and size together instead
+        def __init__(self, fmt):
+            self.format = fmt
+            self.size = struct.calcsize(fmt)
+
+        def pack_into(self, buf, offset, *values):
+            struct.pack_into(self.format, buf, offset, *values)
+
+        def unpack_from(self, buf, offset=0):
+            return struct.unpack_from(self.format, buf, offset)
+
+COMPACT = _Struct('<BBhHH')
+LEGACY = _Struct('<hH')
+HEALTH_FRAME = _Struct('<BBBBBBBB')
+SUMMARY = _Struct('<BBhhh')
+LOOP_FRAME = _Struct('<BBHHH')
+COMPACT_SIZE = COMPACT.size
+LEGACY_SIZE = LEGACY.size
+HEALTH_SIZE = HEALTH_FRAME.size
+SUMMARY_SIZE = SUMMARY.size
+LOOP_SIZE = LOOP_FRAME.size
+
+SUMMARY_SCALES = (100, 100, 10) # Units per C, %rH and hPa (quantities in phonecan.aggregate order)
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+UINT16_MAX = 65535
+UINT8_MAX = 255
+
+
+def saturate(value, low, high):
+    if value < low:
+        return low
+    if value > high:
+        return high
+    return value
+
+
+def pack_compact_into(buf, seq, temperature, humidity, pressure=None):
+    flags = 0
+    praw = 0
+    if pressure is not None:
+        flags = FLAG_PRESSURE
+        praw = saturate(int(round(pressure*10)), 0, UINT16_MAX)
+    COMPACT.pack_into(buf, 0, (COMPACT_VERSION << 4) | flags, seq & 0xFF,
+                      saturate(int(round(temperature*100)), INT16_MIN, INT16_MAX),
+                      saturate(int(round(humidity*100)), 0, UINT16_MAX), praw)
+    return buf
+
+
+def encode_compact(seq, temperature, humidity, pressure=None):
+    return pack_compact_into(bytearray(COMPACT_SIZE), seq, temperature, humidity, pressure)
+
+
+def decode_compact(data):
+    # Returns (seq, temperature, humidity, pressure or None), or None for an unknown version
+    if len(data) < COMPACT_SIZE or data[0] >> 4 != COMPACT_VERSION:
+        return None
+    head, seq, traw, hraw, praw = COMPACT.unpack_from(data)
+    pressure = None
+    if head & FLAG_PRESSURE:
+        pressure = praw/10
+    return seq, traw/100, hraw/100, pressure
+
+
+def pack_legacy_into(buf, value):
+    ip, fp = divmod(value, 1)
+    ip = int(ip)
+    if ip < INT16_MIN:
+        ip, fp = INT16_MIN, 0.0
+    elif ip > INT16_MAX:
+        ip, fp = INT16_MAX, 0.999
+    LEGACY.pack_into(buf, 0, ip, int(1000*fp))
+    return buf
+
+
+def encode_legacy(value):
+    return pack_legacy_into(bytearray(LEGACY_SIZE), value)
+
+
+def decode_legacy(data):
+    ip, fp = LEGACY.unpack_from(data)
+    return ip + fp/1000
+
+
+def pack_health_into(buf, state, tec, rec, restarts, bus_offs, tec_rate, rec_rate):
+    HEALTH_FRAME.pack_into(buf, 0, HEALTH_VERSION << 4, saturate(state, 0, UINT8_MAX),
+                     saturate(tec, 0, UINT8_MAX), saturate(rec, 0, UINT8_MAX),
+                     saturate(restarts, 0, UINT8_MAX), saturate(bus_offs, 0, UINT8_MAX),
+                     saturate(int(round(tec_rate*10)), 0, UINT8_MAX),
+                     saturate(int(round(rec_rate*10)), 0, UINT8_MAX))
+    return buf
+
+
+def decode_health(data):
+    # Returns (state, tec, rec, restarts, bus_offs, tec_rate, rec_rate), or None for an unknown version
+    if len(data) < HEALTH_SIZE or data[0] >> 4 != HEALTH_VERSION:
+        return None
+    _head, state, tec, rec, restarts, bus_offs, tec_rate, rec_rate = HEALTH_FRAME.unpack_from(data)
+    return state, tec, rec, restarts, bus_offs, tec_rate/10, rec_rate/10
+
+
+def pack_summary_into(buf, seq, quantity, count, mean, low, high):
+    scale = SUMMARY_SCALES[quantity]
+    SUMMARY.pack_into(buf, 0, seq & 0xFF, saturate(count, 0, UINT8_MAX),
+                      saturate(int(round(mean*scale)), INT16_MIN, INT16_MAX),
+                      saturate(int(round(low*scale)), INT16_MIN, INT16_MAX),
+                      saturate(int(round(high*scale)), INT16_MIN, INT16_MAX))
+    return buf
+
+
+def decode_summary(data, quantity):
+    # Returns (seq, count, mean, min, max)
+    seq, count, mean, low, high = SUMMARY.unpack_from(data)
+    scale = SUMMARY_SCALES[quantity]
+    return seq, count, mean/scale, low/scale, high/scale
+
+
+def pack_loop_into(buf, task, max_step, max_lag, stalls):
+    # max_step and max_lag in ms
+    LOOP_FRAME.pack_into(buf, 0, LOOP_VERSION << 4, saturate(task, 0, UINT8_MAX),
+                         saturate(max_step, 0, UINT16_MAX), saturate(max_lag, 0, UINT16_MAX),
+                         saturate(stalls, 0, UINT16_MAX))
+    return buf
+
+
+def decode_loop(data):
+    # Returns (task, max_step, max_lag, stalls) with times in seconds, or None for an unknown version
+    if len(data) < LOOP_SIZE or data[0] >> 4 != LOOP_VERSION:
+        return None
+    _head, task, max_step, max_lag, stalls = LOOP_FRAME.unpack_from(data)
+    return task, max_step/1000, max_lag/1000, stalls
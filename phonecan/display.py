@@ -0,0 +1,86 @@
+#
+# Home node OLED value area
+#
+# splash[0:5] holds the background and the static "Sensor Loc:", "Temp (C):"
+# and "RH (%):" labels.  ValueDisplay appends the three value labels
+# (location, temperature and relative humidity) once, at splash[5:8], plus a
+# fourth for the node's frame loss (phonecan/sequence.py) when xpos/ypos have
+# four entries, and from then on only changes their .text, and only when the
+# formatted string is different.  With a display object the OLED is refreshed by hand (auto_refresh
+# off) at most once every min_interval seconds, unless a refresh is forced
+# (e.g. after a button press).
+#
+import time
+
+from phonecan.aggregate import TEMPERATURE, HUMIDITY
+
+LOSS_ROW = 3 # Optional fourth label: frame loss
+
+
+def format_value(value, stale):
+    # Two decimals, "*" appended when the value is stale, "--" before the first value arrives
+    if value is None:
+        return "--"
+    if stale:
+        return "{:.2f}*".format(value)
+    return "{:.2f}".format(value)
+
+
+def format_loss(rate):
+    # Percent with one decimal, "--" for the local node or before the first frame
+    if rate is None:
+        return "--"
+    return "{:.1f}".format(100*rate)
+
+
+class ValueDisplay():
+    def __init__(self, splash, label, font, xpos, ypos, display=None, min_interval=0.5):
+        self.labels = []
+        for i in range(len(xpos)):
+            area = label.Label(font, text="", color=0xFFFFFF, x=xpos[i], y=ypos[i])
+            splash.append(area)
+            self.labels.append(area)
+        self.display = display
+        self.min_interval = min_interval # Seconds between OLED refreshes
+        self.last_refresh = None
+        self.dirty = False
+        self.updates = 0 # Label text changes
+        self.refreshes = 0 # OLED refreshes
+        if display is not None:
+            display.auto_refresh = False
+
+    def set_text(self, index, text):
+        area = self.labels[index]
+        if area.text != text:
+            area.text = text
+            self.updates += 1
+            self.dirty = True
+
+    def show_node(self, cache, nodeid, title, now=None, force=False, loss=None):
+        # Show a node's latest values from cache (a phonecan.cache.NodeCache), and its frame loss
+        #   (a fraction, None if unknown) on the loss label if there is one
+        if now is None:
+            now = time.monotonic()
+        self.set_text(0, title)
+        for quantity in (TEMPERATURE, HUMIDITY):
+            value = cache.value(nodeid, quantity)
+            self.set_text(1 + quantity, format_value(value, cache.is_stale(nodeid, quantity, now)))
+        if len(self.labels) > LOSS_ROW:
+            self.set_text(LOSS_ROW, format_loss(loss))
+        self.refresh(now, force)
+
+    def refresh(self, now=None, force=False):
+        # Push pending text changes to the OLED, at most once every min_interval seconds.
+        # Call regularly so changes held back by the rate limit are shown.
+        if not self.dirty:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if not force and self.last_refresh is not None and now - self.last_refresh < self.min_interval:
+            return False
+        if self.display is not None:
+            self.display.refresh()
+        self.last_refresh = now
+        self.dirty = False
+        self.refreshes += 1
+        return True
@@ -0,0 +1,235 @@
+#
+# CAN bus health monitor
+#
+# The node scripts used to call can_bus.restart() whenever can_bus.state was
+# not 0.  The MCP2515 reports error warning as soon as either error counter
+# reaches 96, which happens on a marginal long cable without anything being
+# wrong that a restart fixes, so the nodes kept resetting their controller
+# (dropping the frames in its buffers) and the error counters were never
+# looked at.
+#
+# BusHealth samples the bus state and both error counters every interval
+# seconds and keeps rolling rates of error counter increase (per second,
+# averaged over about window seconds).  It only restarts the controller when
+# it is bus off, and then waits backoff seconds before it may restart again,
+# doubling the wait (up to max_backoff) every restart until the bus has been
+# error active for window seconds.  A controller that keeps going bus off is
+# restarted less and less often instead of continuously, and the other
+# functions (including TxScheduler's telemetry hold, phonecan/tx.py) carry on
+# meanwhile.  Functions in on_restart (e.g. AsyncReceiver.close) are called
+# after each restart.
+#
+# Given the Message class and the nodeid, it also sends a health frame
+# (phonecan/codec.py) on the node's HEALTH class ID every report_interval
+# seconds, from its own transmit slot so the frame is not held back with the
+# telemetry.  Receivers pass HealthTable.update to NodeRegistry.decode() to
+# keep the latest health of every node.
+#
+# The state is read through an ErrorFlags (flags), as can_bus.state clears
+# the receive overflow flags; pass the node's phonecan.canrx.RxDrain the same
+# one.
+#
+# Usage, blocking loops:   health.poll() every pass
+#        asyncio:          asyncio.create_task(health.run())
+#
+import time
+import asyncio
+
+from phonecan.codec import pack_health_into
+from phonecan.registry import MAX_NODES
+from phonecan.tx import Transmitter, health_slots
+
+# can_bus.state values (canio.BusState)
+ERROR_ACTIVE = 0
+ERROR_WARNING = 1
+ERROR_PASSIVE = 2
+BUS_OFF = 3
+
+STATE_NAMES = ("active", "warning", "passive", "bus off")
+
+
+def state_name(state):
+    return STATE_NAMES[state] if 0 <= state < len(STATE_NAMES) else str(state)
+
+
+# MCP2515 error flag register and its bits
+_EFLG = 0x2D
+_EWARN = 0x01
+_RXEP = 0x08
+_TXEP = 0x10
+_TXBO = 0x20
+_RX0OVR = 0x40
+_RX1OVR = 0x80
+
+
+class ErrorFlags():
+    # The MCP2515 error flag register (EFLG), read in one place.  The driver's can_bus.state
+    # reads the same register and clears its receive overflow bits, so counting overflows
+    # (phonecan.canrx.RxDrain) and reading the state (BusHealth) separately hid overflows
+    # from whichever read came second.  Pass one ErrorFlags to both on a node.
+    #
+    # read() reads the register once, adds the overflow bits to rx_overflows and clears them,
+    # and returns the bus state as can_bus.state would.  The flags are sticky, so several
+    # overflows between reads count once; treat rx_overflows as a lower bound.  Without the
+    # driver's register helpers it falls back to can_bus.state and counts no overflows.
+    def __init__(self, can_bus):
+        self.can_bus = can_bus
+        self.rx_overflows = 0
+        self.state = ERROR_ACTIVE
+
+    def read(self):
+        can_bus = self.can_bus
+        read_register = getattr(can_bus, "_read_register", None)
+        if read_register is None:
+            self.state = can_bus.state
+            return self.state
+        flags = read_register(_EFLG)
+        overflow = flags & (_RX0OVR | _RX1OVR)
+        if overflow:
+            can_bus._mod_register(_EFLG, overflow, 0)
+            self.rx_overflows += (1 if overflow & _RX0OVR else 0) + (1 if overflow & _RX1OVR else 0)
+        if flags & _TXBO:
+            self.state = BUS_OFF
+        elif flags & (_TXEP | _RXEP):
+            self.state = ERROR_PASSIVE
+        elif flags & _EWARN:
+            self.state = ERROR_WARNING
+        else:
+            self.state = ERROR_ACTIVE
+        return self.state
+
+
+class BusHealth():
+    def __init__(self, can_bus, message_class=None, nodeid=None, interval=1.0, report_interval=30.0,
+                 window=60.0, backoff=1.0, max_backoff=300.0, on_restart=(), debug=False, flags=None,
+                 nnodes=MAX_NODES):
+        self.can_bus = can_bus
+        self.flags = flags if flags is not None else ErrorFlags(can_bus)
+        self.debug = debug # Print every bus state change (restarts are always printed)
+        self.interval = interval # Seconds between samples
+        self.report_interval = report_interval # Seconds between health frames
+        self.window = window # Seconds, rolling rate averaging and healthy time before the backoff resets
+        self.backoff = backoff # Seconds
+        self.max_backoff = max_backoff
+        self.on_restart = list(on_restart)
+        self.tx = None
+        if message_class is not None:
+            self.tx = Transmitter(can_bus, message_class, health_slots(nodeid), nnodes=nnodes)
+        self.state = ERROR_ACTIVE
+        self.tec = 0
+        self.rec = 0
+        self.tec_rate = 0.0 # Rolling transmit error counter increase, per second
+        self.rec_rate = 0.0
+        self.restarts = 0
+        self.bus_offs = 0 # Times the controller was found bus off
+        self.delay = backoff
+        self.next_restart = None # No restart before this time.monotonic()
+        self.active_since = None
+        self.last_sample = None
+        self.last_report = None
+
+    def sample(self, now=None):
+        # Read the bus state and error counters, and restart the controller if it is bus off and the backoff allows
+        if now is None:
+            now = time.monotonic()
+        can_bus = self.can_bus
+        state = self.flags.read()
+        tec = can_bus.transmit_error_count
+        rec = can_bus.receive_error_count
+        if self.last_sample is not None and now > self.last_sample:
+            dt = now - self.last_sample
+            weight = min(1.0, dt/self.window)
+            self.tec_rate += weight*(max(0, tec - self.tec)/dt - self.tec_rate)
+            self.rec_rate += weight*(max(0, rec - self.rec)/dt - self.rec_rate)
+        self.last_sample = now
+        if state == BUS_OFF and self.state != BUS_OFF:
+            self.bus_offs += 1
+        if self.debug and state != self.state:
+            print("BUS STATE: ", state_name(state), "TEC: ", tec, "REC: ", rec)
+        self.state = state
+        self.tec = tec
+        self.rec = rec
+        if state == ERROR_ACTIVE:
+            if self.active_since is None:
+                self.active_since = now
+            elif now - self.active_since >= self.window:
+                self.delay = self.backoff
+        else:
+            self.active_since = None
+        if state == BUS_OFF:
+            self.recover(now)
+        return state
+
+    def recover(self, now=None):
+        # Restart the controller unless the last restart was less than the backoff ago; True if restarted
+        if now is None:
+            now = time.monotonic()
+        if self.next_restart is not None and now < self.next_restart:
+            return False
+        self.can_bus.restart()
+        self.restarts += 1
+        print("BUS OFF: restarted CAN controller, next restart in {0:.0f} s at the earliest".format(self.delay))
+        self.next_restart = now + self.delay
+        self.delay = min(2*self.delay, self.max_backoff)
+        for callback in self.on_restart:
+            callback()
+        return True
+
+    def report(self, now=None):
+        # Send the health frame if report_interval has passed; True if sent
+        if self.tx is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if self.last_report is not None and now - self.last_report < self.report_interval:
+            return False
+        pack_health_into(self.tx.buffer(0), self.state, self.tec, self.rec, self.restarts, self.bus_offs,
+                         self.tec_rate, self.rec_rate)
+        if self.state == BUS_OFF or not self.tx.send(0):
+            return False # Try again next poll
+        self.last_report = now
+        return True
+
+    def poll(self, now=None):
+        # Sample if interval has passed since the last sample, then report if due
+        if now is None:
+            now = time.monotonic()
+        if self.last_sample is None or now - self.last_sample >= self.interval:
+            self.sample(now)
+        self.report(now)
+
+    async def run(self):
+        while True:
+            self.poll()
+            await asyncio.sleep(self.interval)
+
+
+class HealthTable():
+    # Latest health frame from every node, for NodeRegistry.decode(msg, add, health=table.update)
+    def __init__(self):
+        self.nodes = {} # nodeid: (time.monotonic() received, decode_health() tuple)
+
+    def update(self, nodeid, values, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.nodes[nodeid] = (now, values)
+
+    def get(self, nodeid):
+        entry = self.nodes.get(nodeid)
+        return None if entry is None else entry[1]
+
+    def unhealthy(self):
+        # Nodes whose latest frame shows a state other than error active, or restarts
+        return [nodeid for nodeid, (_t, values) in sorted(self.nodes.items()) if values[0] != ERROR_ACTIVE or values[3]]
+
+    def lines(self, now=None):
+        # One printable line per node
+        if now is None:
+            now = time.monotonic()
+        found = []
+        for nodeid, (received, values) in sorted(self.nodes.items()):
+            state, tec, rec, restarts, bus_offs, tec_rate, rec_rate = values
+            found.append("Node {0} bus {1} TEC {2} REC {3} (+{4:.1f}/+{5:.1f} per s) restarts {6} bus off {7}, {8:.0f} s ago".format(
+                nodeid, state_name(state), tec, rec, tec_rate, rec_rate,
+                restarts, bus_offs, now - received))
+        return found
@@ -0,0 +1,109 @@
+#
+# WiFi bring-up in the background
+#
+# The send node used to join WiFi and open the Adafruit IO session at import,
+# before any asyncio task existed: a slow access point held up CAN collection
+# and the node's own frames for as long as the join took, and a failed join
+# hard reset the board after 30 s, losing everything collected.  The node now
+# starts its CAN tasks first and runs WifiLink.run() as one more task.  It
+# waits start_delay seconds, so the CAN tasks receive the first frames of the
+# boot, then tries to join every backoff seconds, doubling the wait after
+# each failure (up to max_backoff).  Once joined it checks the radio every
+# check_interval seconds and joins again, from backoff, if it dropped.
+# Functions in on_connect are called after every join.  One that raises
+# (e.g. the Adafruit IO client failing to build) is printed and the task
+# carries on; while joined, all of them are called again every
+# check_interval seconds until none raises.
+#
+# wifi.radio.connect() blocks until it joins or the timeout passes, and
+# nothing else on the node runs meanwhile: frames that arrive during a join
+# wait in the MCP2515's receive buffers (two), and the rest are lost.  So the
+# first attempt may block for timeout seconds only, and the timeout doubles
+# after each failed attempt up to max_timeout, for access points slower to
+# answer; after a join it starts from timeout again.
+#
+# phonecan.publish.Publisher takes the WifiLink as network and makes no
+# Adafruit IO connect attempts while it is not connected; averages due
+# meanwhile go to its outbox as they do during any outage.
+#
+# The radio is passed in (wifi.radio on the boards) so this module does not
+# import wifi, and runs on the host with a fake one (sim/fakeboard.py).
+#
+# Usage:  link = WifiLink(wifi.radio, os.getenv("CIRCUITPY_WIFI_SSID"), os.getenv("CIRCUITPY_WIFI_PASSWORD"))
+#         asyncio.create_task(link.run())
+#
+import time
+import asyncio
+
+
+class WifiLink():
+    def __init__(self, radio, ssid, password, timeout=3.0, max_timeout=10.0, backoff=5.0, max_backoff=300.0,
+                 check_interval=5.0, start_delay=5.0, on_connect=()):
+        self.radio = radio
+        self.ssid = ssid
+        self.password = password
+        self.timeout = timeout # Seconds the first join attempt may block
+        self.max_timeout = max_timeout
+        self.backoff = backoff # Seconds after the first failed attempt
+        self.max_backoff = max_backoff
+        self.check_interval = check_interval # Seconds between radio checks while joined
+        self.start_delay = start_delay # Seconds from run() to the first join attempt
+        self.on_connect = list(on_connect)
+        self.delay = backoff
+        self.join_timeout = timeout # Seconds the next attempt may block
+        self.attempts = 0
+        self.failures = 0
+        self.joins = 0
+        self.joined_at = None # time.monotonic() of the first join
+        self.callback_failures = 0
+        self.callbacks_due = False # An on_connect function raised; call them again at the next check
+
+    @property
+    def connected(self):
+        return self.radio.connected
+
+    def connect(self):
+        # One join attempt; True if joined
+        self.attempts += 1
+        try:
+            print("Connecting to %s" % self.ssid)
+            self.radio.connect(self.ssid, self.password, timeout=self.join_timeout)
+        # Wi-Fi connectivity fails with error messages, not specific errors, so this except is broad.
+        except Exception as e:  # pylint: disable=broad-except
+            self.failures += 1
+            self.join_timeout = min(2*self.join_timeout, self.max_timeout)
+            print("Failed to connect to WiFi. Error:", e, "\nTrying again in {0:.0f} seconds.".format(self.delay))
+            return False
+        print("Connected to %s!" % self.ssid)
+        self.joins += 1
+        if self.joined_at is None:
+            self.joined_at = time.monotonic()
+        self.delay = self.backoff
+        self.join_timeout = self.timeout
+        self.call_on_connect()
+        return True
+
+    def call_on_connect(self):
+        # Call every on_connect function; True if none raised
+        self.callbacks_due = False
+        for callback in self.on_connect:
+            try:
+                callback()
+            except Exception as e:  # pylint: disable=broad-except
+                self.callback_failures += 1
+                self.callbacks_due = True
+                print("WiFi on_connect call failed:", e, "\nTrying again in {0:.0f} seconds.".format(self.check_interval))
+        return not self.callbacks_due
+
+    async def run(self):
+        await asyncio.sleep(self.start_delay)
+        while True:
+            if self.connected:
+                if self.callbacks_due:
+                    self.call_on_connect()
+                await asyncio.sleep(self.check_interval)
+            elif self.connect():
+                await asyncio.sleep(self.check_interval)
+            else:
+                await asyncio.sleep(self.delay)
+                self.delay = min(2*self.delay, self.max_backoff)
@@ -0,0 +1,89 @@
+#
+# CAN setup and measurement sending shared by the node scripts
+#
+# Every node script set up the MCP2515 the same way and had its own copy of
+# the loop that packs the node's measurements in the configured frame format
+# (compact, legacy or window summaries), queues them on a TxScheduler and
+# advances the sequence number once they have gone out.  open_can() and
+# MeasurementSender hold that code once.
+#
+# Only the modules a node's settings need are imported: SummaryWindow (and
+# the summary code) only for frame_format = "summary".  The driver classes
+# are passed in as elsewhere in phonecan, so nothing here imports them.
+#
+# Usage:  can_bus = open_can(CAN, board.SPI(), DigitalInOut(board.CAN_CS))
+#         sender = MeasurementSender(can_bus, Message, nodeid, frame_format, id_plan, quantities)
+#         every sample:   if sender.queue((temperature, humidity, pressure)):
+#                             sender.pump()     # again later while it returns False
+#
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.codec import pack_compact_into, pack_legacy_into
+from phonecan.registry import MAX_NODES
+from phonecan.tx import Transmitter, TxScheduler, node_slots
+
+
+def open_can(can_class, spi, cs, loopback=False, silent=False):
+    # The MCP2515 (can_class, adafruit_mcp2515.MCP2515) on spi with chip select cs, a DigitalInOut.
+    #   Use loopback and silent True to test without another device.
+    cs.switch_to_output()
+    return can_class(spi, cs, loopback=loopback, silent=silent)
+
+
+class MeasurementSender():
+    __slots__ = ("tx", "frame_format", "policy", "summary", "seq", "last_count")
+
+    def __init__(self, can_bus, message_class, nodeid, frame_format="compact", plan=False,
+                 quantities=(TEMPERATURE, HUMIDITY, PRESSURE), summary_window=60.0, policy=None,
+                 nnodes=MAX_NODES):
+        # Payload buffers and Messages are allocated once; each sample packs in place and sends by slot.
+        #   The scheduler sends the highest priority class first and holds telemetry back while
+        #   transmit errors are high.
+        self.tx = TxScheduler(Transmitter(can_bus, message_class, node_slots(nodeid, frame_format, plan, quantities),
+                                          nnodes=nnodes))
+        self.frame_format = frame_format
+        self.policy = policy # phonecan.policy.ReportPolicy, or None to send every sample (not used for summaries)
+        self.summary = None
+        if frame_format == "summary":
+            from phonecan.summary import SummaryWindow
+            self.summary = SummaryWindow(quantities, summary_window)
+        self.seq = 0 # Frame sequence number, advanced when a sample's frames have gone out
+        self.last_count = None # Sample count of the latest sample in the summary
+
+    def queue(self, values, now=None, count=None):
+        # Pack values (T, RH, P; None for one the node does not measure) into the frames that are due and
+        #   queue them; returns the number of slots waiting to be sent.  Given count (e.g. Sampler.count), a
+        #   sample already added to the summary is not added again.
+        summary = self.summary
+        tx = self.tx
+        if summary is not None:
+            # The window's frames go out when it is due, then the sample goes in
+            if summary.due():
+                summary.pack(tx, self.seq)
+                tx.submit_all()
+            if count is None or count != self.last_count:
+                self.last_count = count
+                summary.add(values, now)
+        elif self.policy is None or self.policy.due(values):
+            temperature, humidity, pressure = values
+            if self.frame_format == "compact":
+                # All measurements in one frame
+                pack_compact_into(tx.buffer(0), self.seq, temperature, humidity, pressure)
+            else:
+                # Four bytes each, as older receivers expect, so no sequence number
+                pack_legacy_into(tx.buffer(TEMPERATURE), temperature)
+                pack_legacy_into(tx.buffer(HUMIDITY), humidity)
+            tx.submit_all()
+            if self.policy is not None:
+                self.policy.mark_sent(values)
+        return tx.queued()
+
+    def queued(self):
+        return self.tx.queued()
+
+    def pump(self):
+        # Send what is queued; True once all of it has gone out.  A frame held back and sent later keeps its
+        #   number, so it is not counted as lost.
+        sent = self.tx.pump()
+        if sent:
+            self.seq = (self.seq + 1) % 256
+        return sent
@@ -0,0 +1,170 @@
+#
+# Store-and-forward buffer for Adafruit IO uploads
+#
+# Each publish interval the send node turns its running averages into one
+# record per node and queues them here; the publisher then sends queued
+# records oldest first whenever the broker is reachable.  While WiFi or the
+# broker is down, records wait in the queue instead of being lost, and the
+# queue has a fixed capacity so memory does not grow during an outage: when
+# it is full the oldest record is evicted (and counted) to make room.
+#
+# Records are 14 bytes in a preallocated bytearray:
+#   uint32 timestamp (seconds, phonecan.clock.WallClock.stamp() when the interval ended)
+#   uint8  nodeid
+#   uint8  flags, bit q set when field q is present
+#   int16  temperature, 0.01 C
+#   uint16 humidity, 0.01 %
+#   uint16 pressure, 0.1 hPa
+#   uint16 rolling frame loss (phonecan/sequence.py), 0.01 %
+#
+# With path set, the queue is also kept in a file of the same layout (plus a
+# 4-byte head/count header) so it survives a reset.  CIRCUITPY is read-only
+# to code.py unless boot.py remounts it writable, so use a path on a
+# writable filesystem (e.g. an SD card) or leave path=None to queue in RAM
+# (PSRAM on the ESP32-S3).  The records found in the file at start are
+# counted in restored: stamps taken before the clock was set
+# (time.monotonic() seconds) cannot be dated after the reset that ended
+# their boot.
+#
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE, NQUANTITIES
+from phonecan.codec import _Struct, saturate, INT16_MIN, INT16_MAX, UINT16_MAX
+
+LOSS = NQUANTITIES # Field after the quantities in a record's values: frame loss, %
+NFIELDS = NQUANTITIES + 1
+
+RECORD = _Struct('<IBBhHHH')
+RECORD_SIZE = RECORD.size
+HEADER = _Struct('<HH')
+HEADER_SIZE = HEADER.size
+
+
+def pack_record_into(buf, offset, timestamp, nodeid, values):
+    # values: one value or None per quantity (TEMPERATURE, HUMIDITY, PRESSURE), optionally followed by LOSS
+    loss = values[LOSS] if len(values) > LOSS else None
+    flags = 0
+    for q in range(NQUANTITIES):
+        if values[q] is not None:
+            flags |= 1 << q
+    if loss is not None:
+        flags |= 1 << LOSS
+    t, h, p = values[TEMPERATURE], values[HUMIDITY], values[PRESSURE]
+    RECORD.pack_into(buf, offset, int(timestamp) & 0xFFFFFFFF, nodeid & 0xFF, flags,
+                     0 if t is None else saturate(int(round(t*100)), INT16_MIN, INT16_MAX),
+                     0 if h is None else saturate(int(round(h*100)), 0, UINT16_MAX),
+                     0 if p is None else saturate(int(round(p*10)), 0, UINT16_MAX),
+                     0 if loss is None else saturate(int(round(loss*100)), 0, UINT16_MAX))
+
+
+def unpack_record(buf, offset=0):
+    # Returns (timestamp, nodeid, [temperature, humidity, pressure, loss]) with None for absent values
+    timestamp, nodeid, flags, traw, hraw, praw, lraw = RECORD.unpack_from(buf, offset)
+    values = [traw/100, hraw/100, praw/10, lraw/100]
+    for q in range(NFIELDS):
+        if not flags & (1 << q):
+            values[q] = None
+    return timestamp, nodeid, values
+
+
+class Outbox():
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity # Records
+        self.buf = bytearray(capacity*RECORD_SIZE)
+        self.head = 0 # Slot of the oldest record
+        self.count = 0
+        self.evicted = 0 # Records dropped because the queue was full
+        self.restored = 0 # Oldest records still queued that were read from the file, from an earlier boot
+        self.path = path
+        self.file = None
+        if path is not None:
+            self._open(path)
+
+    def __len__(self):
+        return self.count
+
+    def _open(self, path):
+        try:
+            self.file = open(path, "r+b")
+            header = self.file.read(HEADER_SIZE)
+            data = self.file.read(len(self.buf))
+            if len(header) == HEADER_SIZE and len(data) == len(self.buf):
+                head, count = HEADER.unpack_from(header)
+                if head < self.capacity and count <= self.capacity:
+                    self.buf[:] = data
+                    self.head, self.count = head, count
+                    self.restored = count
+                    return
+            self.file.close()
+        except OSError:
+            pass
+        # Missing, or written with another capacity: start empty
+        self.file = open(path, "w+b")
+        self.file.write(bytearray(HEADER_SIZE + len(self.buf)))
+        self._save_header()
+
+    def _save_header(self):
+        header = bytearray(HEADER_SIZE)
+        HEADER.pack_into(header, 0, self.head, self.count)
+        self.file.seek(0)
+        self.file.write(header)
+        self.file.flush()
+
+    def _save_slot(self, slot):
+        offset = slot*RECORD_SIZE
+        self.file.seek(HEADER_SIZE + offset)
+        self.file.write(self.buf[offset:offset + RECORD_SIZE])
+
+    def put(self, timestamp, nodeid, values):
+        # Queue one record; returns False if the oldest record had to be evicted
+        kept = True
+        if self.count == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+            self.evicted += 1
+            self.restored = max(0, self.restored - 1)
+            kept = False
+        slot = (self.head + self.count) % self.capacity
+        pack_record_into(self.buf, slot*RECORD_SIZE, timestamp, nodeid, values)
+        self.count += 1
+        if self.file is not None:
+            self._save_slot(slot)
+            self._save_header()
+        return kept
+
+    def put_stats(self, timestamp, stats, nodes, loss=None):
+        # Queue one record per node with the means of an aggregate.NodeAggregator; returns records queued.
+        #   loss, if given, is a function of the nodeid returning its frame loss as a fraction (or None),
+        #   e.g. SeqTracker.loss_rate.
+        queued = 0
+        values = [None]*NFIELDS
+        for node in nodes:
+            node_stats = stats.nodes.get(node) # Nodes not heard from have no entry
+            if node_stats is None:
+                continue
+            present = False
+            for q in range(NQUANTITIES):
+                if node_stats[q].count > 0:
+                    values[q] = node_stats[q].mean
+                    present = True
+                else:
+                    values[q] = None
+            if present:
+                rate = None if loss is None else loss(node)
+                values[LOSS] = None if rate is None else 100*rate
+                self.put(timestamp, node, values)
+                queued += 1
+        return queued
+
+    def peek(self, index=0):
+        # index-th oldest record, as unpack_record()
+        if index >= self.count:
+            return None
+        return unpack_record(self.buf, ((self.head + index) % self.capacity)*RECORD_SIZE)
+
+    def drop(self, n):
+        # Remove the n oldest records (after they were sent)
+        n = min(n, self.count)
+        self.head = (self.head + n) % self.capacity
+        self.count -= n
+        self.restored = max(0, self.restored - n)
+        if self.file is not None:
+            self._save_header()
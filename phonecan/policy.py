@@ -0,0 +1,65 @@
+#
+# Report-on-change policy for remote nodes
+#
+# A remote node reads its sensor every sendint seconds but only transmits when
+# a value has moved by more than its deadband since the last frame sent, or
+# when heartbeat seconds have passed without a frame.  Receivers can still
+# tell a quiet node from a dead one: a node is only stale once nothing has
+# arrived for longer than the heartbeat, so stale_after on the receivers must
+# be set above the remotes' heartbeat.
+#
+# deadbands is a list with one entry per quantity (same order as the values
+# passed to due()); None means changes of that quantity never trigger a frame.
+# A deadband of 0 sends on any change.  heartbeat=0 sends every time
+# (the original behaviour).
+#
+import time
+
+from phonecan.aggregate import NQUANTITIES
+
+# Defaults: 0.1 C, 0.5 %rH, 0.2 hPa, and at least one frame a minute
+DEADBANDS = [0.1, 0.5, 0.2]
+HEARTBEAT = 60.0 # Seconds
+
+
+class ReportPolicy():
+    def __init__(self, deadbands=DEADBANDS, heartbeat=HEARTBEAT):
+        self.deadbands = list(deadbands)
+        self.heartbeat = heartbeat # Seconds
+        self.last = [None]*NQUANTITIES # Values in the last frame sent
+        self.last_time = None
+        self.sent = 0
+        self.skipped = 0
+
+    def due(self, values, now=None):
+        # True if the values should be sent now
+        if now is None:
+            now = time.monotonic()
+        if self.last_time is None or now - self.last_time >= self.heartbeat:
+            return True
+        for q, value in enumerate(values):
+            deadband = self.deadbands[q]
+            if value is None or deadband is None:
+                continue
+            last = self.last[q]
+            if last is None or abs(value - last) > deadband:
+                return True
+        return False
+
+    def mark_sent(self, values, now=None):
+        if now is None:
+            now = time.monotonic()
+        for q, value in enumerate(values):
+            self.last[q] = value
+        self.last_time = now
+        self.sent += 1
+
+    def check(self, values, now=None):
+        # due() and, if due, mark_sent(); for loops that always send when told to
+        if now is None:
+            now = time.monotonic()
+        if self.due(values, now):
+            self.mark_sent(values, now)
+            return True
+        self.skipped += 1
+        return False
@@ -0,0 +1,230 @@
+#
+# Event-loop profiler and stall detector
+#
+# asyncio on the boards is cooperative: a task that blocks (time.sleep(), a
+# CAN listen loop, io.connect()) holds up every other task until it returns,
+# and nothing showed when that happened.  LoopProfiler.task(name, coro)
+# creates the task with a wrapper that times every step of the coroutine
+# (each run between two awaits that actually yield to the event loop) and
+# keeps per task: steps, time running, the longest step, and stalls (steps
+# of stall seconds or more).  Event-loop lag is how late a task wakes from
+# LoopProfiler.sleep() (or phonecan.sleep.LightSleep's) after its deadline.
+#
+# Times are taken with supervisor.ticks_ms() on the boards, a small integer
+# that keeps ms resolution however long the node runs (time.monotonic()
+# floats do not) and allocates nothing, so the wrapper costs two tick reads
+# and a few integer operations per step and can stay on.  Steps shorter than
+# a tick count as 0 or 1 ms, which is right on average.
+#
+# poll() returns printable lines every report_interval seconds (and [] in
+# between), starting a new reporting window; given the Message class and the
+# nodeid it also sends an event-loop frame (phonecan/codec.py) on the node's
+# HEALTH class ID.  Receivers pass LoopTable.update to NodeRegistry.decode()
+# to keep the latest from every node.
+#
+# Usage:  profiler = LoopProfiler(stall=0.2)
+#         task = profiler.task("sendmeas", sendmeas(context))   # instead of asyncio.create_task()
+#         every lag_interval:   await profiler.sleep(lag_interval)
+#                               for line in profiler.poll():
+#                                   print(line)
+#
+import time
+import asyncio
+
+from phonecan.codec import pack_loop_into
+from phonecan.registry import MAX_NODES
+from phonecan.tx import Transmitter, loop_slots
+
+TICKS_PERIOD = 1 << 29 # supervisor.ticks_ms() wraps at this
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+try:
+    from supervisor import ticks_ms
+except ImportError:
+    def ticks_ms():
+        return int(time.monotonic()*1000) & TICKS_MAX
+
+NO_TASK = 255 # Task index in the frame when no task has stepped
+
+
+def ticks_diff(end, start):
+    return ((end - start + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+
+# Per-task counters, reset at every report except STALLS_TOTAL
+STEPS = 0
+BUSY = 1 # ms
+MAX_STEP = 2 # ms
+STALLS = 3
+STALLS_TOTAL = 4
+
+
+class _Profiled():
+    # Awaitable that runs coro one step at a time and times the steps
+    __slots__ = ("profiler", "index", "coro")
+
+    def __init__(self, profiler, index, coro):
+        self.profiler = profiler
+        self.index = index
+        self.coro = coro
+
+    def __await__(self):
+        coro = self.coro
+        step = self.profiler.step
+        index = self.index
+        value = None
+        error = None
+        while True:
+            start = ticks_ms()
+            try:
+                if error is None:
+                    yielded = coro.send(value)
+                else:
+                    yielded = coro.throw(error)
+            except StopIteration as stop:
+                step(index, ticks_diff(ticks_ms(), start))
+                return stop.value
+            step(index, ticks_diff(ticks_ms(), start))
+            value = None
+            error = None
+            try:
+                value = yield yielded
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:  # pylint: disable=broad-except
+                error = e # e.g. CancelledError: pass it on to the task
+
+    __iter__ = __await__ # MicroPython awaits through __iter__
+
+
+class LoopProfiler():
+    def __init__(self, stall=0.1, report_interval=300.0, message_class=None, can_bus=None, nodeid=None,
+                 debug=False, nnodes=MAX_NODES):
+        self.stall = int(stall*1000) # ms
+        self.report_interval = report_interval # Seconds
+        self.debug = debug # Print every stall as it happens
+        self.tx = None
+        if message_class is not None:
+            self.tx = Transmitter(can_bus, message_class, loop_slots(nodeid), nnodes=nnodes)
+        self.names = []
+        self.stats = []
+        self.lag_max = 0 # ms
+        self.lag_sum = 0
+        self.lag_count = 0
+        self.stalls = 0 # Since start
+        self.window_start = ticks_ms()
+        self.last_report = None
+
+    async def _run(self, index, coro):
+        return await _Profiled(self, index, coro)
+
+    def wrap(self, name, coro):
+        # Coroutine that runs coro with its steps timed under name
+        self.names.append(name)
+        self.stats.append([0, 0, 0, 0, 0])
+        return self._run(len(self.names) - 1, coro)
+
+    def task(self, name, coro):
+        return asyncio.create_task(self.wrap(name, coro))
+
+    def step(self, index, ms):
+        stats = self.stats[index]
+        stats[STEPS] += 1
+        stats[BUSY] += ms
+        if ms > stats[MAX_STEP]:
+            stats[MAX_STEP] = ms
+        if ms >= self.stall:
+            stats[STALLS] += 1
+            stats[STALLS_TOTAL] += 1
+            self.stalls += 1
+            if self.debug:
+                print("STALL: task", self.names[index], "ran", ms, "ms without yielding")
+
+    def note_lag(self, ms):
+        # A task woke ms later than its deadline
+        ms = max(0, int(ms))
+        self.lag_sum += ms
+        self.lag_count += 1
+        if ms > self.lag_max:
+            self.lag_max = ms
+
+    async def sleep(self, seconds):
+        # asyncio.sleep() that records how late it wakes
+        deadline = ticks_ms() + int(seconds*1000)
+        await asyncio.sleep(seconds)
+        self.note_lag(ticks_diff(ticks_ms(), deadline))
+
+    def worst(self):
+        # Index of the task with the longest step in this window, NO_TASK if none stepped
+        worst = NO_TASK
+        longest = -1
+        for index, stats in enumerate(self.stats):
+            if stats[STEPS] and stats[MAX_STEP] > longest:
+                worst = index
+                longest = stats[MAX_STEP]
+        return worst
+
+    def lines(self):
+        # One printable line per task and one for the event loop, for the current window
+        elapsed = max(1, ticks_diff(ticks_ms(), self.window_start))
+        found = []
+        for name, stats in zip(self.names, self.stats):
+            found.append("Task {0}: {1} steps, {2:.1%} busy, longest {3} ms, stalls {4} ({5} total)".format(
+                name, stats[STEPS], stats[BUSY]/elapsed, stats[MAX_STEP], stats[STALLS], stats[STALLS_TOTAL]))
+        mean = self.lag_sum/self.lag_count if self.lag_count else 0.0
+        found.append("Event loop lag: longest {0} ms, mean {1:.1f} ms over {2} wakes; stalls {3} since start".format(
+            self.lag_max, mean, self.lag_count, self.stalls))
+        return found
+
+    def reset(self):
+        # Start a new window; the stall totals are kept
+        for stats in self.stats:
+            stats[STEPS] = stats[BUSY] = stats[MAX_STEP] = stats[STALLS] = 0
+        self.lag_max = self.lag_sum = self.lag_count = 0
+        self.window_start = ticks_ms()
+
+    def poll(self, now=None):
+        # Every report_interval seconds: send the frame (if set up) and return the window's lines, then reset
+        if now is None:
+            now = time.monotonic()
+        if self.last_report is None:
+            self.last_report = now
+        if now - self.last_report < self.report_interval:
+            return []
+        self.last_report = now
+        found = self.lines()
+        if self.tx is not None:
+            worst = self.worst()
+            longest = self.stats[worst][MAX_STEP] if worst != NO_TASK else 0
+            pack_loop_into(self.tx.buffer(0), worst, longest, self.lag_max, self.stalls)
+            self.tx.send(0)
+        self.reset()
+        return found
+
+
+class LoopTable():
+    # Latest event-loop frame from every node, for NodeRegistry.decode(msg, add, loop=table.update)
+    def __init__(self):
+        self.nodes = {} # nodeid: (time.monotonic() received, decode_loop() tuple)
+
+    def update(self, nodeid, values, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.nodes[nodeid] = (now, values)
+
+    def get(self, nodeid):
+        entry = self.nodes.get(nodeid)
+        return None if entry is None else entry[1]
+
+    def lines(self, now=None):
+        # One printable line per node
+        if now is None:
+            now = time.monotonic()
+        found = []
+        for nodeid, (received, values) in sorted(self.nodes.items()):
+            task, max_step, max_lag, stalls = values
+            found.append("Node {0} loop: longest step {1:.0f} ms (task {2}), lag {3:.0f} ms, stalls {4}, {5:.0f} s ago".format(
+                nodeid, 1000*max_step, "-" if task == NO_TASK else task, 1000*max_lag, stalls, now - received))
+        return found
@@ -0,0 +1,221 @@
+#
+# Adafruit IO publisher with a persistent MQTT session
+#
+# The send node used to reconnect to Adafruit IO at the start of every
+# publish interval, send one publish_multiple per node (which sleeps between
+# feeds) and disconnect again, paying a TLS + MQTT handshake every interval.
+# A Publisher keeps one session open instead: its run() task calls io.loop()
+# every loop_interval seconds so the MQTT keepalive pings go out and incoming
+# messages are handled, and reconnects if the session drops.  Each interval
+# all nodes' averages go out as a single group publish:
+#
+#   topic   <username>/groups/<group>
+#   payload {"feeds": {"node0-temp": 21.5, "node0-humid": 45.1, ...}}
+#
+# Adafruit IO creates the node<n>-temp/-humid/-pres feeds (and node<n>-loss,
+# the percentage of frames lost, for outbox records that carry it) in the
+# group the first time they are published.
+#
+# With an outbox (phonecan.outbox.Outbox), the send node queues each
+# interval's averages and flush() sends them oldest first, one interval per
+# group publish with its created_at time, at most one publish every
+# flush_interval seconds so a backlog after an outage does not trip the
+# Adafruit IO rate limit.  Records leave the queue only after their publish
+# went out.  Pass the MiniMQTT client as mqtt with qos=1 to have each publish
+# acknowledged by the broker before its records are dropped.
+#
+# Given clock (phonecan.clock.WallClock, which stamped the records), an
+# interval queued before the board's clock was set is dated from its
+# monotonic stamp once the clock is valid.  While it is not, flush() retries
+# the clock and holds such intervals back for up to clock_wait seconds, then
+# sends them without created_at (Adafruit IO then times them on arrival).
+# Intervals restored from the file of an earlier boot always go without.
+#
+# Given network (phonecan.network.WifiLink, or anything with a connected
+# attribute), no connect is attempted while it is not connected, so a node
+# whose WiFi is still joining queues its averages in the outbox instead of
+# waiting on socket errors.  io may be None until the node has built its
+# client (e.g. once WiFi is up); attach() hands it over.
+#
+import time
+import json
+import asyncio
+
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.clock import MIN_VALID_TIME
+from phonecan.outbox import LOSS
+
+QUANTITY_KEYS = {TEMPERATURE: "temp", HUMIDITY: "humid", PRESSURE: "pres", LOSS: "loss"}
+
+
+def feed_key(nodeid, quantity):
+    return "node{0}-{1}".format(nodeid, QUANTITY_KEYS[quantity])
+
+
+def iso_time(timestamp):
+    t = time.localtime(timestamp)
+    return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(t[0], t[1], t[2], t[3], t[4], t[5])
+
+
+class Publisher():
+    def __init__(self, io, group, loop_interval=5.0, loop_timeout=0.1, digits=2,
+                 outbox=None, flush_interval=10.0, mqtt=None, username=None, qos=0, network=None,
+                 clock=None, clock_wait=600.0):
+        self.io = io
+        self.network = network # No connect attempts while network.connected is False
+        self.group = group
+        self.outbox = outbox
+        self.flush_interval = flush_interval # Minimum seconds between outbox publishes
+        self.mqtt = mqtt # MiniMQTT client, for publishing with qos
+        self.topic = "{0}/groups/{1}".format(username, group)
+        self.qos = qos
+        self.last_flush = None
+        self.clock = clock # Dates outbox records stamped before the clock was set
+        self.clock_wait = clock_wait # Seconds flush() holds undated records back waiting for the clock
+        self.clock_wait_start = None
+        self.loop_interval = loop_interval # Seconds between io.loop() calls; keep well under the MQTT keepalive
+        self.loop_timeout = loop_timeout # Seconds io.loop() may wait for incoming data
+        self.digits = digits # Decimal places published
+        self.connects = 0
+        self.publishes = 0
+        self.bytes_published = 0
+        self.last_latency = None # Seconds taken by the last publish() call
+        self.failures = 0
+
+    def payload(self, stats, nodes, quantities=(TEMPERATURE, HUMIDITY, PRESSURE)):
+        # JSON group payload with the mean of every (node, quantity) that has values, or None
+        feeds = {}
+        for node in nodes:
+            node_stats = stats.nodes.get(node) # Nodes not heard from have no entry
+            if node_stats is None:
+                continue
+            for q in quantities:
+                stat = node_stats[q]
+                if stat.count > 0:
+                    feeds[feed_key(node, q)] = round(stat.mean, self.digits)
+        if not feeds:
+            return None
+        return json.dumps({"feeds": feeds})
+
+    def attach(self, io, mqtt=None):
+        # Publish through io (and mqtt, the MiniMQTT client) from now on
+        self.io = io
+        self.mqtt = mqtt
+
+    def connect(self):
+        # (Re)open the session; True if connected
+        if self.io is None:
+            return False
+        if self.io.is_connected:
+            return True
+        if self.network is not None and not self.network.connected:
+            return False
+        try:
+            print("Connecting to Adafruit IO...")
+            if self.connects == 0:
+                self.io.connect()
+            else:
+                self.io.reconnect()
+            self.connects += 1
+        except Exception as e:  # pylint: disable=broad-except
+            print("Adafruit IO connect failed: ", e)
+        return self.io.is_connected
+
+    def outbox_payload(self):
+        # JSON group payload for the oldest queued interval (records with the oldest timestamp),
+        #   and the number of records it covers
+        outbox = self.outbox
+        first = outbox.peek(0)
+        if first is None:
+            return None, 0
+        feeds = {}
+        n = 0
+        while n < len(outbox):
+            timestamp, node, values = outbox.peek(n)
+            if timestamp != first[0]:
+                break
+            for q, value in enumerate(values):
+                if value is not None:
+                    feeds[feed_key(node, q)] = round(value, self.digits)
+            n += 1
+        message = {"feeds": feeds}
+        created = self.created_at(first[0])
+        if created is not None:
+            message["created_at"] = iso_time(created)
+        return json.dumps(message), n
+
+    def created_at(self, timestamp):
+        # Wall-clock time of the oldest queued record's timestamp, or None if it cannot be dated
+        if timestamp >= MIN_VALID_TIME:
+            return timestamp
+        if self.clock is None or self.outbox.restored:
+            return None
+        return self.clock.wall(timestamp)
+
+    def undated(self, now):
+        # True while the oldest queued record waits for the clock to be set
+        if self.clock is None or self.outbox.restored or self.outbox.peek(0)[0] >= MIN_VALID_TIME:
+            return False
+        if self.clock.sync(now):
+            self.clock_wait_start = None
+            return False
+        if self.clock_wait_start is None:
+            self.clock_wait_start = now
+        return now - self.clock_wait_start < self.clock_wait
+
+    def send(self, data):
+        # Publish one group payload; True if it went out
+        start = time.monotonic()
+        try:
+            if self.mqtt is not None:
+                self.mqtt.publish(self.topic, data, qos=self.qos)
+            else:
+                self.io.publish(self.group, data, is_group=True)
+        except Exception as e:  # pylint: disable=broad-except
+            print("Adafruit IO publish failed: ", e)
+            self.failures += 1
+            try:
+                self.io.disconnect() # Start a fresh session on the next connect
+            except Exception:  # pylint: disable=broad-except
+                pass
+            return False
+        self.publishes += 1
+        self.bytes_published += len(data)
+        self.last_latency = time.monotonic() - start
+        return True
+
+    def publish(self, stats, nodes):
+        # One group publish with every node's averages; returns the payload length, 0 if nothing was sent
+        data = self.payload(stats, nodes)
+        if data is None or not self.connect() or not self.send(data):
+            return 0
+        return len(data)
+
+    def flush(self, now=None):
+        # Publish the oldest queued interval if the rate limit allows; returns records sent
+        if self.outbox is None or len(self.outbox) == 0:
+            return 0
+        if now is None:
+            now = time.monotonic()
+        if self.last_flush is not None and now - self.last_flush < self.flush_interval:
+            return 0
+        if not self.connect() or self.undated(now):
+            return 0
+        self.last_flush = now
+        data, n = self.outbox_payload()
+        if not self.send(data):
+            return 0
+        self.outbox.drop(n)
+        return n
+
+    async def run(self):
+        # Keep the session alive between publishes
+        while True:
+            if self.connect():
+                try:
+                    self.io.loop(timeout=self.loop_timeout)
+                except Exception as e:  # pylint: disable=broad-except
+                    print("Adafruit IO loop failed: ", e)
+                # Work through any backlog left by an outage
+                self.flush()
+            await asyncio.sleep(self.loop_interval)
@@ -0,0 +1,232 @@
+#
+# CAN ID plan and node registry
+#
+# Structured IDs (29-bit extended), lower ID = higher priority:
+#   bit 28      1 for every ID in this plan (the older IDs below are all under 0x200)
+#   bits 24-27  priority class: ALARM, CONTROL, HEALTH, TELEMETRY, BULK
+#   bits 16-23  kind within the class; for TELEMETRY 0 = compact frame (all of a
+#               node's measurements, see phonecan.codec), 1 + quantity = one
+#               measurement in the legacy payload, KIND_SUMMARY + quantity =
+#               a window summary of one measurement (phonecan/summary.py);
+#               for HEALTH 0 = bus health frame (phonecan/health.py), 1 = event-loop
+#               profile frame (phonecan/profile.py)
+#   bits 8-15   rotation, (nodeid - frames sent) mod nnodes (the nodes on the
+#               bus), set as each frame is sent (rotated_id()).  Nodes 0 to
+#               nnodes - 1 that have sent as many frames then have different
+#               rotations, and the one at 0 moves on to the next node with
+#               every frame, so equal frames take turns winning arbitration
+#               instead of the lowest node always winning; receivers ignore
+#               these bits.  (Taken mod 256 with fewer nodes, the rotations would
+#               wrap past every node for most counts, leaving node 0 the lowest.)
+#   bits 0-7    nodeid
+# Older IDs, still sent by nodes with id_plan off and accepted by receivers:
+#   Legacy frames (one measurement per frame, '<hH' payload):
+#     ID = 2*nodeid     = temperature
+#     ID = 2*nodeid + 1 = relative humidity
+#   Compact frames: ID = COMPACT_BASE + nodeid
+# These sit below every class of the plan, so they win arbitration over alarms
+# until every node is on the plan.
+#
+# Node IDs go from 0 to MAX_NODES - 1 (the 8 bits of the plan), and only up to
+# MAX_LEGACY_NODES - 1 while legacy frames are accepted: legacy IDs of higher
+# nodes would be the compact IDs of others.  NodeRegistry raises ValueError
+# for node IDs outside these ranges.
+#
+# NodeRegistry builds the ID -> (nodeid, kind) map used to route received
+# frames in O(1) for any number of nodes, and the listen(matches=[...])
+# acceptance filters that let the MCP2515 drop every other frame in hardware.
+# The older IDs and the plan each need one mask, so the filters fit the
+# MCP2515's two.  decode() is the receive logic shared by the nodes and the
+# host tools: it hands every measurement in a frame to a
+# callback such as NodeAggregator.add or NodeCache.update, health frames
+# to an optional second callback such as HealthTable.update, frame
+# sequence numbers to an optional third such as SeqTracker.track, and
+# window summaries to an optional fourth such as NodeAggregator.merge
+# (without it a summary's mean is passed to the first), and event-loop
+# profile frames to an optional fifth such as LoopTable.update.
+#
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.codec import decode_compact, decode_legacy, decode_health, decode_summary, decode_loop
+
+COMPACT_BASE = 0x100
+MAX_NODES = 0x100 # Node IDs in the 8 node bits of the plan
+MAX_LEGACY_NODES = COMPACT_BASE//2 # Higher nodes' legacy IDs would reach COMPACT_BASE
+EXTENDED_ID_MASK = 0x1FFFFFFF
+
+# Frame kinds: a legacy frame carries one quantity, a compact frame all of them
+COMPACT = 0xFF
+HEALTH_FRAME = 0xFE # Bus health frame, no measurements
+LOOP_FRAME = 0xFD # Event-loop profile frame, no measurements
+SUMMARY_FRAME = 0x80 # | quantity: window summary of one quantity
+
+PLAN_BIT = 0x10000000
+CLASS_SHIFT = 24
+KIND_SHIFT = 16
+ROTATION_SHIFT = 8
+CLASS_MASK = 0x0F << CLASS_SHIFT
+CLASS_TOP_BIT = 0x08 << CLASS_SHIFT # Clear for every class in use
+ROTATION_MASK = 0xFF << ROTATION_SHIFT
+NODE_MASK = 0xFF
+
+# Priority classes, highest first
+ALARM = 0
+CONTROL = 1
+HEALTH = 2
+TELEMETRY = 3
+BULK = 4
+NCLASSES = 5
+
+KIND_COMPACT = 0 # TELEMETRY kind of a compact frame; 1 + quantity for one-measurement frames
+KIND_SUMMARY = 0x10 # TELEMETRY kind + quantity of a summary frame
+KIND_HEALTH = 0 # HEALTH kind of a bus health frame
+KIND_LOOP = 1 # HEALTH kind of an event-loop profile frame
+
+
+def legacy_id(nodeid, quantity):
+    return 2*nodeid + quantity
+
+
+def compact_id(nodeid):
+    return COMPACT_BASE + nodeid
+
+
+def plan_id(priority, kind, nodeid):
+    return PLAN_BIT | (priority << CLASS_SHIFT) | (kind << KIND_SHIFT) | nodeid
+
+
+def rotated_id(can_id, count, nnodes=MAX_NODES):
+    # can_id with the rotation bits for the count-th frame sent by one of nnodes nodes; older IDs are
+    #   returned as they are
+    if not can_id & PLAN_BIT:
+        return can_id
+    rotation = ((can_id & NODE_MASK) - count) % nnodes
+    return (can_id & ~ROTATION_MASK) | (rotation << ROTATION_SHIFT)
+
+
+def priority_of(can_id):
+    # Priority class of an ID; the older IDs all carry telemetry
+    if can_id & PLAN_BIT:
+        return (can_id & CLASS_MASK) >> CLASS_SHIFT
+    return TELEMETRY
+
+
+def block_mask(count):
+    # Mask matching an aligned block of at least count IDs
+    size = 1
+    while size < count:
+        size <<= 1
+    return EXTENDED_ID_MASK & ~(size - 1)
+
+
+def check_node(nodeid, legacy=False):
+    # Raise ValueError if nodeid is out of range for the IDs (legacy: with the legacy IDs as well)
+    limit = MAX_LEGACY_NODES if legacy else MAX_NODES
+    if not 0 <= nodeid < limit:
+        raise ValueError("node {0} out of range: node IDs go from 0 to {1}{2}".format(
+            nodeid, limit - 1, " with legacy frames" if legacy else ""))
+
+
+class NodeRegistry():
+    def __init__(self, nodes, legacy=True, compact=True, plan=True):
+        self.nodes = list(nodes)
+        for nodeid in self.nodes:
+            check_node(nodeid, legacy)
+        self.legacy = legacy # Accept legacy frames (leave on while any node still sends them)
+        self.compact = compact # Accept compact frames on the older IDs
+        self.plan = plan # Accept frames on the structured IDs
+        self.idmap = {}
+        for nodeid in self.nodes:
+            if legacy:
+                self.idmap[legacy_id(nodeid, TEMPERATURE)] = (nodeid, TEMPERATURE)
+                self.idmap[legacy_id(nodeid, HUMIDITY)] = (nodeid, HUMIDITY)
+            if compact:
+                self.idmap[compact_id(nodeid)] = (nodeid, COMPACT)
+            if plan:
+                self.idmap[plan_id(TELEMETRY, KIND_COMPACT, nodeid)] = (nodeid, COMPACT)
+                for quantity in (TEMPERATURE, HUMIDITY):
+                    self.idmap[plan_id(TELEMETRY, 1 + quantity, nodeid)] = (nodeid, quantity)
+                for quantity in (TEMPERATURE, HUMIDITY, PRESSURE):
+                    self.idmap[plan_id(TELEMETRY, KIND_SUMMARY + quantity, nodeid)] = (nodeid, SUMMARY_FRAME | quantity)
+                self.idmap[plan_id(HEALTH, KIND_HEALTH, nodeid)] = (nodeid, HEALTH_FRAME)
+                self.idmap[plan_id(HEALTH, KIND_LOOP, nodeid)] = (nodeid, LOOP_FRAME)
+
+    def lookup(self, msg_id):
+        # (nodeid, kind) for a registered ID, None for anything else
+        if msg_id & PLAN_BIT:
+            msg_id &= ~ROTATION_MASK
+        return self.idmap.get(msg_id)
+
+    def node_of(self, msg_id):
+        entry = self.lookup(msg_id)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def decode(self, msg, add, health=None, seq=None, summary=None, loop=None):
+        # Calls add(nodeid, quantity, value) for each measurement in msg, or
+        #   health(nodeid, values) with decode_health()'s tuple for a health frame; returns the
+        #   nodeid, or None if msg is not a measurement frame from a known node.
+        #   With seq, calls seq(nodeid, kind, number) for frames with a sequence number first,
+        #   and drops the frame (returning None) if that returns False (a duplicate).
+        #   A summary frame goes to summary(nodeid, quantity, count, mean, min, max), or
+        #   add(nodeid, quantity, mean) without it.  An event-loop profile frame goes to
+        #   loop(nodeid, values) with decode_loop()'s tuple.
+        entry = self.lookup(msg.id)
+        if entry is None:
+            return None
+        nodeid, kind = entry
+        if kind == HEALTH_FRAME:
+            decoded = decode_health(msg.data)
+            if decoded is not None and health is not None:
+                health(nodeid, decoded)
+            return None
+        if kind == LOOP_FRAME:
+            decoded = decode_loop(msg.data)
+            if decoded is not None and loop is not None:
+                loop(nodeid, decoded)
+            return None
+        if kind == COMPACT:
+            # Compact frame: all of the node's measurements at once
+            decoded = decode_compact(msg.data)
+            if decoded is None: # Unknown payload version
+                return None
+            number, temperature, humidity, pressure = decoded
+            if seq is not None and not seq(nodeid, kind, number):
+                return None
+            add(nodeid, TEMPERATURE, temperature)
+            add(nodeid, HUMIDITY, humidity)
+            if pressure is not None:
+                add(nodeid, PRESSURE, pressure)
+        elif kind & SUMMARY_FRAME:
+            quantity = kind & ~SUMMARY_FRAME
+            number, count, mean, low, high = decode_summary(msg.data, quantity)
+            if seq is not None and not seq(nodeid, kind, number):
+                return None
+            if not count: # No samples in the window
+                return None
+            if summary is not None:
+                summary(nodeid, quantity, count, mean, low, high)
+            else:
+                add(nodeid, quantity, mean)
+        else:
+            # Legacy frame: kind is the quantity index (T or RH); it carries no sequence number
+            add(nodeid, kind, decode_legacy(msg.data))
+        return nodeid
+
+    def matches(self, Match):
+        # Acceptance filters for can_bus.listen(matches=...).  Pass the canio Match class.
+        count = max(self.nodes) + 1
+        found = []
+        # Both older formats use the same mask, so they take one of the MCP2515's two masks
+        #   (with a filter each) and leave the other for the plan
+        mask = block_mask(2*count)
+        if self.legacy:
+            found.append(Match(legacy_id(0, TEMPERATURE), mask=mask, extended=True))
+        if self.compact:
+            found.append(Match(COMPACT_BASE, mask=mask, extended=True))
+        if self.plan:
+            # Classes 0-7 and every kind from the registered nodes; the rotation bits are not compared.
+            #   Checking the top class bit keeps out J1939-style traffic (priority 6 and 7 IDs also set bit 28).
+            mask = PLAN_BIT | CLASS_TOP_BIT | (NODE_MASK & block_mask(count))
+            found.append(Match(PLAN_BIT, mask=mask, extended=True))
+        return found
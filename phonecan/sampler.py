@@ -0,0 +1,58 @@
+#
+# Shared local sensor sampling
+#
+# Every read of an SHT4x .temperature or .relative_humidity property is a
+# separate blocking I2C measurement (about 10 ms at high precision), and the
+# node scripts read both properties in more than one task.  One Sampler task
+# per node reads the sensor at a fixed interval instead, using the driver's
+# .measurements property (temperature and humidity from one measurement) when
+# it has one, and keeps the latest sample with the time it was taken.  Tasks
+# that need the local values read the sample rather than the sensor.
+#
+# count increases with every sample, so a consumer that should use each
+# sample once (e.g. a running average) can tell a new sample from one it has
+# already seen.
+#
+import time
+import asyncio
+
+
+class Sampler():
+    __slots__ = ("sensor", "interval", "combined", "with_pressure", "temperature", "humidity", "pressure", "time",
+                 "count")
+
+    def __init__(self, sensor, interval=1.0, pressure=False):
+        self.sensor = sensor
+        self.interval = interval # Seconds
+        # Checked on the class: hasattr() on the sensor would take a measurement
+        self.combined = hasattr(type(sensor), "measurements")
+        self.with_pressure = pressure # Also read .pressure (e.g. MS8607)
+        self.temperature = None
+        self.humidity = None
+        self.pressure = None
+        self.time = None # time.monotonic() of the latest sample
+        self.count = 0
+
+    def read(self):
+        # Take one sample now (blocking I2C)
+        if self.combined:
+            self.temperature, self.humidity = self.sensor.measurements
+        else:
+            self.temperature = self.sensor.temperature
+            self.humidity = self.sensor.relative_humidity
+        if self.with_pressure:
+            self.pressure = self.sensor.pressure
+        self.time = time.monotonic()
+        self.count += 1
+
+    def age(self, now=None):
+        if self.time is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return now - self.time
+
+    async def run(self):
+        while True:
+            self.read()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,119 @@
+#
+# Sequence number tracking for end-to-end frame loss
+#
+# Compact and summary frames carry an 8-bit sequence number that their node
+# increments each time a cycle's frames go out (see phonecan/codec.py; legacy
+# frames have none, so their loss is not counted).  SeqTracker follows each
+# node's stream of numbers (one stream per frame kind, so a node's summary
+# frames are followed per quantity) and counts per node:
+#
+#   received      frames with a number not seen before
+#   missing       numbers skipped, less those that turned up late
+#   duplicates    frames with a number already received (not passed on)
+#   out_of_order  frames that arrived after a later number
+#   resyncs       times a stream jumped back further than the window, e.g.
+#                 because the node restarted and counts from 0 again
+#
+# A bitmap of the last WINDOW numbers of each stream tells a late frame from
+# a duplicate.  A gap of 128 or more frames, or a node restarting while its
+# count was above 128, cannot be told from the numbers alone and counts as
+# missing frames.
+#
+# loss_rate() is the fraction of frames missing over roughly the last
+# window frames of a node: two counters that are halved whenever their sum
+# reaches window, so it costs two integers per node and no history.
+#
+# Pass SeqTracker.track as NodeRegistry.decode(msg, add, seq=tracker.track);
+# it returns False for duplicates, which decode() then drops.
+#
+WINDOW = 32 # Numbers remembered per stream for late/duplicate frames
+WINDOW_MASK = (1 << WINDOW) - 1
+
+# Per-node counters
+RECEIVED = 0
+MISSING = 1
+DUPLICATES = 2
+OUT_OF_ORDER = 3
+RESYNCS = 4
+NCOUNTS = 5
+_WIN_RECEIVED = 5
+_WIN_MISSING = 6
+
+
+class SeqTracker():
+    def __init__(self, window=256):
+        self.window = window # Frames the rolling loss rate covers, roughly
+        self.streams = {} # (nodeid << 8) | kind: [next expected number, bitmap of recent numbers]
+        self.nodes = {} # nodeid: counters (RECEIVED ... RESYNCS) and the two rolling loss counters
+
+    def counts(self, nodeid):
+        counts = self.nodes.get(nodeid)
+        if counts is None:
+            counts = [0]*(NCOUNTS + 2)
+            self.nodes[nodeid] = counts
+        return counts
+
+    def _roll(self, counts, received, missing):
+        counts[_WIN_RECEIVED] += received
+        counts[_WIN_MISSING] = max(0, counts[_WIN_MISSING] + missing)
+        if counts[_WIN_RECEIVED] + counts[_WIN_MISSING] >= self.window:
+            counts[_WIN_RECEIVED] >>= 1
+            counts[_WIN_MISSING] >>= 1
+
+    def track(self, nodeid, kind, seq):
+        # Count one received frame; False if it is a duplicate
+        key = (nodeid << 8) | kind
+        counts = self.counts(nodeid)
+        stream = self.streams.get(key)
+        if stream is None:
+            self.streams[key] = [(seq + 1) & 0xFF, 1]
+            counts[RECEIVED] += 1
+            self._roll(counts, 1, 0)
+            return True
+        expected, seen = stream
+        ahead = (seq - expected) & 0xFF
+        if ahead < 128:
+            # The next number, or a later one after a gap of ahead frames
+            stream[0] = (seq + 1) & 0xFF
+            stream[1] = ((seen << (ahead + 1)) | 1) & WINDOW_MASK
+            counts[RECEIVED] += 1
+            counts[MISSING] += ahead
+            self._roll(counts, 1, ahead)
+            return True
+        behind = (expected - 1 - seq) & 0xFF # 0 for the newest number received
+        if behind < WINDOW:
+            bit = 1 << behind
+            if seen & bit:
+                counts[DUPLICATES] += 1
+                return False
+            # Counted missing when the gap was seen; it arrived late instead
+            stream[1] = seen | bit
+            counts[RECEIVED] += 1
+            counts[OUT_OF_ORDER] += 1
+            counts[MISSING] -= 1
+            self._roll(counts, 1, -1)
+            return True
+        # Too far back to be a late frame: start the stream again from here
+        stream[0] = (seq + 1) & 0xFF
+        stream[1] = 1
+        counts[RECEIVED] += 1
+        counts[RESYNCS] += 1
+        self._roll(counts, 1, 0)
+        return True
+
+    def loss_rate(self, nodeid):
+        # Fraction of the node's recent frames that went missing, None before its first frame
+        counts = self.nodes.get(nodeid)
+        if counts is None:
+            return None
+        total = counts[_WIN_RECEIVED] + counts[_WIN_MISSING]
+        if not total:
+            return 0.0
+        return counts[_WIN_MISSING]/total
+
+    def reset(self, nodeid=None):
+        # Forget the counts (of one node, or all); streams keep their place
+        for node, counts in self.nodes.items():
+            if nodeid is None or node == nodeid:
+                for i in range(len(counts)):
+                    counts[i] = 0
@@ -0,0 +1,99 @@
+#
+# Light sleep between asyncio task deadlines
+#
+# The remote nodes used to run one blocking loop with time.sleep(sendint),
+# which keeps the CPU awake the whole time.  Their tasks (sample, transmit,
+# bus health) now wait through LightSleep.sleep() or LightSleep.wait(), which
+# note when each task next has work to do.  LightSleep.run() is one more task:
+# once every task is waiting it takes the earliest deadline and, given the
+# CircuitPython alarm module, enters alarm.light_sleep_until_alarms() with a
+# TimeAlarm for it.  Nothing else can run on the node meanwhile, which is the
+# point: the next thing to do is at that deadline.  Without alarm it waits
+# with asyncio.sleep() instead, as the tasks would on their own.
+#
+# A task waiting on an asyncio.Event (wait()) has no deadline; it is woken by
+# another task, which can only happen after that task's deadline.
+#
+# Given a phonecan.profile.LoopProfiler, every task's lateness after its
+# deadline goes to it as event-loop lag.
+#
+# The alarm module is passed in (import alarm on the boards) so this module
+# does not import it, and runs on the host with a fake one (sim/fakeboard.py).
+#
+# Usage:  sleeper = LightSleep(alarm, ntasks=3)
+#         in each task:   await sleeper.sleep("sample", seconds)
+#         asyncio.create_task(sleeper.run())
+#
+import time
+import asyncio
+
+
+class LightSleep():
+    def __init__(self, alarm=None, ntasks=1, min_sleep=0.01, profiler=None):
+        self.alarm = alarm # CircuitPython alarm module, None to wait awake
+        self.ntasks = ntasks # Tasks that wait through this object; sleep only while all of them are waiting
+        self.min_sleep = min_sleep # Seconds.  Shorter waits are not worth entering light sleep for.
+        self.profiler = profiler
+        self.deadlines = {} # Task name: time.monotonic() it wakes, None while waiting on an event
+        self.started = None
+        self.slept = 0.0 # Seconds in light sleep
+        self.sleeps = 0
+
+    async def sleep(self, name, seconds):
+        # asyncio.sleep(seconds) for the task called name
+        deadline = time.monotonic() + seconds
+        self.deadlines[name] = deadline
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.deadlines.pop(name, None)
+        if self.profiler is not None:
+            self.profiler.note_lag(1000*(time.monotonic() - deadline))
+
+    async def wait(self, name, event):
+        # event.wait() and clear() for the task called name
+        self.deadlines[name] = None
+        try:
+            await event.wait()
+            event.clear()
+        finally:
+            self.deadlines.pop(name, None)
+
+    def next_deadline(self):
+        # Earliest deadline once every task is waiting, None while some task has work to do
+        if len(self.deadlines) < self.ntasks:
+            return None
+        deadline = None
+        for when in self.deadlines.values():
+            if when is not None and (deadline is None or when < deadline):
+                deadline = when
+        return deadline
+
+    def awake_fraction(self, now=None):
+        # Share of the time since run() started that the node was not in light sleep
+        if self.started is None:
+            return 1.0
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.started
+        return 1.0 - self.slept/elapsed if elapsed > 0 else 1.0
+
+    async def run(self):
+        alarm = self.alarm
+        self.started = time.monotonic()
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None:
+                await asyncio.sleep(0) # A task is running, or about to
+                continue
+            now = time.monotonic()
+            remaining = deadline - now
+            if remaining < self.min_sleep:
+                await asyncio.sleep(0)
+            elif alarm is None:
+                await asyncio.sleep(remaining)
+            else:
+                alarm.light_sleep_until_alarms(alarm.time.TimeAlarm(monotonic_time=deadline))
+                self.slept += time.monotonic() - now
+                self.sleeps += 1
+                await asyncio.sleep(0) # Let the woken tasks run
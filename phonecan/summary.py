@@ -0,0 +1,75 @@
+#
+# Windowed summaries on remote nodes (edge pre-aggregation)
+#
+# Instead of sending every reading (or every reading that moved past a
+# deadband, phonecan/policy.py), a remote can keep sampling at its full rate
+# and send one summary frame per quantity every window seconds: the count,
+# mean, min and max of the samples in the window (summary format,
+# phonecan/codec.py, on the TELEMETRY class IDs KIND_SUMMARY + quantity,
+# phonecan/registry.py).  Receivers pass NodeAggregator.merge as
+# NodeRegistry.decode(msg, add, summary=aggregator.merge), which weights each
+# window's mean by its count, so the mean over a publish interval is the mean
+# of every sample taken, as if they had all been sent.  The min and max are
+# exact too; only the last value is a window mean rather than a reading.
+#
+# A frame holds at most MAX_COUNT samples, so a window is also due once it
+# has that many, however much of window is left.
+#
+# Usage:  summary = SummaryWindow(quantities, window)
+#         tx = TxScheduler(Transmitter(can_bus, Message, summary_slots(nodeid, quantities)))
+#         every sample:   if summary.due():
+#                             summary.pack(tx, seq)
+#                             tx.submit_all()
+#                         summary.add(values)
+# (checking before adding the sample, so a window at one sample per second
+# holds window samples).
+#
+import time
+
+from phonecan.aggregate import RunningStat
+from phonecan.codec import pack_summary_into, UINT8_MAX
+
+MAX_COUNT = UINT8_MAX # Samples one summary frame can hold
+WINDOW = 60.0 # Seconds
+
+
+class SummaryWindow():
+    def __init__(self, quantities, window=WINDOW):
+        self.quantities = tuple(quantities) # Quantity of each transmit slot, in order
+        self.window = window # Seconds
+        self.stats = [RunningStat() for _q in self.quantities]
+        self.started = None # time.monotonic() of the window's first sample
+        self.windows = 0
+
+    def add(self, values, now=None):
+        # Add one sample; values are indexed by quantity (T, RH, P), None for a failed reading
+        if now is None:
+            now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        for stat, q in zip(self.stats, self.quantities):
+            value = values[q]
+            if value is not None:
+                stat.add(value)
+
+    def count(self):
+        return max(stat.count for stat in self.stats)
+
+    def due(self, now=None):
+        # True once window seconds have passed since the first sample, or a frame is full (before adding the next)
+        if self.started is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - self.started >= self.window or self.count() >= MAX_COUNT
+
+    def pack(self, tx, seq):
+        # Pack every quantity's summary into its slot of tx and start the next window
+        for slot, (stat, q) in enumerate(zip(self.stats, self.quantities)):
+            if stat.count:
+                pack_summary_into(tx.buffer(slot), seq, q, stat.count, stat.mean, stat.min, stat.max)
+            else:
+                pack_summary_into(tx.buffer(slot), seq, q, 0, 0.0, 0.0, 0.0)
+            stat.reset()
+        self.started = None
+        self.windows += 1
@@ -0,0 +1,196 @@
+#
+# Preallocated transmit path
+#
+# The send loops used to build a new list, new payload bytes and a new
+# Message every cycle.  A Transmitter allocates one payload buffer and one
+# Message per slot (one slot per frame the node sends) when it is created.
+# Each cycle the loop packs values into the slot buffers in place (the
+# phonecan.codec pack_*_into functions) and sends by slot index, so the
+# steady-state loop keeps no new objects on the heap.  The driver's Message
+# copies the data it is given, so the slot buffer is the Message's own data
+# bytearray and packing into it updates the frame.
+#
+# The Message class is passed in (adafruit_mcp2515.canio.Message on the
+# boards) so this module does not import the driver.
+#
+# Frames on the structured IDs (phonecan/registry.py) get their rotation bits
+# set as they are sent, taken over the nnodes nodes on the bus.  TxScheduler keeps one queue of slots per priority
+# class and always sends the highest class first.  When the MCP2515's
+# transmit error counter rises at or above tec_limit (its error warning
+# level) it holds TELEMETRY and BULK frames back for backoff seconds, then
+# sends what is queued.  Further transmit errors above the limit start a new
+# hold, twice as long (up to max_backoff) if the counter is no lower than at
+# the previous one, so alarm, control and health frames still get through a
+# noisy bus.  The counter only comes down as frames get through, so a high
+# counter that is not rising does not hold anything back.  A held slot is
+# sent once, with its latest payload.
+#
+import time
+
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.codec import COMPACT_SIZE, LEGACY_SIZE, HEALTH_SIZE, SUMMARY_SIZE, LOOP_SIZE
+from phonecan.registry import (compact_id, legacy_id, plan_id, rotated_id, priority_of, check_node,
+                               MAX_NODES, TELEMETRY, HEALTH, KIND_COMPACT, KIND_SUMMARY, KIND_HEALTH, KIND_LOOP,
+                               NCLASSES)
+
+
+def compact_slots(nodeid, plan=False):
+    # One compact frame with all of the node's measurements
+    if plan:
+        return [(plan_id(TELEMETRY, KIND_COMPACT, nodeid), COMPACT_SIZE)]
+    return [(compact_id(nodeid), COMPACT_SIZE)]
+
+
+def legacy_slots(nodeid, quantities=(TEMPERATURE, HUMIDITY), plan=False):
+    # One legacy frame per quantity; slot index == position in quantities
+    if plan:
+        return [(plan_id(TELEMETRY, 1 + q, nodeid), LEGACY_SIZE) for q in quantities]
+    return [(legacy_id(nodeid, q), LEGACY_SIZE) for q in quantities]
+
+
+def summary_slots(nodeid, quantities=(TEMPERATURE, HUMIDITY, PRESSURE)):
+    # One window summary frame per quantity (phonecan/summary.py); only on the structured IDs
+    return [(plan_id(TELEMETRY, KIND_SUMMARY + q, nodeid), SUMMARY_SIZE) for q in quantities]
+
+
+def health_slots(nodeid):
+    # The bus health frame (phonecan/health.py); only on the structured IDs
+    return [(plan_id(HEALTH, KIND_HEALTH, nodeid), HEALTH_SIZE)]
+
+
+def loop_slots(nodeid):
+    # The event-loop profile frame (phonecan/profile.py); only on the structured IDs
+    return [(plan_id(HEALTH, KIND_LOOP, nodeid), LOOP_SIZE)]
+
+
+def node_slots(nodeid, frame_format="compact", plan=False, quantities=(TEMPERATURE, HUMIDITY, PRESSURE)):
+    # The node's measurement slots; ValueError if nodeid does not fit the IDs
+    check_node(nodeid, legacy=frame_format == "legacy" and not plan)
+    if frame_format == "compact":
+        return compact_slots(nodeid, plan)
+    if frame_format == "summary":
+        return summary_slots(nodeid, quantities)
+    return legacy_slots(nodeid, plan=plan)
+
+
+class Transmitter():
+    def __init__(self, can_bus, message_class, slots, extended=True, nnodes=MAX_NODES):
+        self.can_bus = can_bus
+        self.nnodes = nnodes # Nodes on the bus, for the rotation bits
+        self.ids = []
+        self.buffers = []
+        self.messages = []
+        for can_id, size in slots:
+            msg = message_class(id=can_id, data=bytearray(size), extended=extended)
+            self.ids.append(can_id)
+            self.buffers.append(msg.data)
+            self.messages.append(msg)
+        self.nslots = len(self.messages)
+        self.sent = 0
+        self.failed = 0
+
+    def buffer(self, slot):
+        return self.buffers[slot]
+
+    def send(self, slot):
+        msg = self.messages[slot]
+        msg.id = rotated_id(self.ids[slot], self.sent, self.nnodes)
+        try:
+            ok = self.can_bus.send(msg)
+        except RuntimeError:
+            # adafruit_mcp2515 raises this when all its transmit buffers are waiting (e.g. bus off)
+            ok = False
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        return ok
+
+    def send_all(self):
+        # Send every slot in order; True if all were sent
+        ok = True
+        for slot in range(self.nslots):
+            if not self.send(slot):
+                ok = False
+        return ok
+
+
+class TxScheduler():
+    def __init__(self, transmitter, tec_limit=96, backoff=1.0, max_backoff=60.0):
+        self.tx = transmitter
+        self.queues = [[] for _i in range(NCLASSES)]
+        self.nqueued = 0 # Slots in all the queues, kept so queued() allocates nothing
+        self.priority = [priority_of(can_id) for can_id in transmitter.ids]
+        self.tec_limit = tec_limit
+        self.backoff = backoff # Seconds
+        self.max_backoff = max_backoff
+        self.delay = backoff
+        self.held_until = None
+        self.held_tec = None # Counter after the last hold, following it down as frames get through
+        self.hold_tec = None # Counter when the last hold started
+        self.holds = 0
+
+    def buffer(self, slot):
+        return self.tx.buffer(slot)
+
+    def submit(self, slot):
+        # Queue a slot for sending; a slot already queued is sent once, with its latest payload
+        queue = self.queues[self.priority[slot]]
+        if slot not in queue:
+            queue.append(slot)
+            self.nqueued += 1
+
+    def submit_all(self):
+        for slot in range(self.tx.nslots):
+            self.submit(slot)
+
+    def queued(self):
+        # Number of slots waiting to be sent
+        return self.nqueued
+
+    def holding(self, now=None):
+        # True while TELEMETRY and BULK frames are held back
+        tec = self.tx.can_bus.transmit_error_count
+        if tec < self.tec_limit:
+            self.held_until = None
+            self.held_tec = None
+            self.hold_tec = None
+            self.delay = self.backoff
+            return False
+        if now is None:
+            now = time.monotonic()
+        if self.held_until is not None:
+            if now < self.held_until:
+                return True
+            # Hold over: send, and hold again only on new transmit errors
+            self.held_until = None
+            self.held_tec = tec
+            return False
+        if self.held_tec is not None and tec <= self.held_tec:
+            self.held_tec = tec
+            return False
+        # New transmit errors above the limit: hold, twice as long as last time if the counter is no lower
+        if self.hold_tec is not None:
+            if tec >= self.hold_tec:
+                self.delay = min(2*self.delay, self.max_backoff)
+            else:
+                self.delay = self.backoff
+        self.hold_tec = tec
+        self.held_until = now + self.delay
+        self.holds += 1
+        return True
+
+    def pump(self, now=None):
+        # Send queued frames, highest class first; True if nothing is left queued
+        for priority in range(NCLASSES):
+            queue = self.queues[priority]
+            if not queue:
+                continue
+            if priority >= TELEMETRY and self.holding(now):
+                return False
+            while queue:
+                if not self.tx.send(queue[0]):
+                    return False # Transmit buffers full or bus error; try again next pump
+                queue.pop(0)
+                self.nqueued -= 1
+        return True
@@ -0,0 +1,7 @@
+#
+# PhoneCAN host-side simulation
+#
+# Stand-ins for the CircuitPython hardware modules so the phonecan library and
+# the node logic can be exercised and benchmarked with desktop Python.  None of
+# this is copied to the boards.
+#
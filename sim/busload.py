@@ -0,0 +1,264 @@
+#
+# CAN bus load and latency model for scaling the network (host CPython)
+#
+# For a network of n nodes, a bitrate, a frame format ("compact": one frame
+# per node per report; "legacy": one frame per measurement), the IDs (the
+# original ones, or the structured plan of phonecan/registry.py with
+# --id-plan), a send policy and a cable length.  The IDs and payload lengths
+# are the nodes' own, from phonecan.tx.node_slots():
+#
+#   evaluate()  bus utilization from the expected frame rate, and the
+#               worst-case response time of every ID (time from queuing a
+#               frame until it is on the wire at every receiver) from the
+#               classical CAN schedulability analysis: a frame waits for one
+#               lower-priority frame already on the wire plus every
+#               higher-priority frame queued meanwhile.  Worst cases assume
+#               every node can send every interval, whatever the policy.
+#   simulate()  discrete-event run on sim.fakecan's bus (arbitration by ID,
+#               real frame lengths) with nodes sending at random phases,
+#               measuring latency per ID and the frames lost at two
+#               receivers with the MCP2515's two receive buffers:
+#                 collectnodes: reads the buffers every read_interval, as
+#                               collectnodes() did before phonecan.canrx
+#                 drain:        reads them every poll_interval, as the
+#                               RxDrain task does
+#   recommend() for each node count, the lowest standard bitrate the cable
+#               supports with utilization under max_load and every worst
+#               case under the send interval
+#
+# Frame lengths include worst-case bit stuffing by default.  Bitrate limits
+# for cable lengths follow the usual CiA 301 guide values.
+#
+#   python -m sim.busload --nodes 4 8 16 32 64 --cable 30
+#   python -m sim.busload --nodes 16 --bitrate 125000 --format legacy --policy every --simulate 120
+#   python -m sim.busload --nodes 16 --id-plan --ids
+#
+import math
+import random
+import argparse
+
+from phonecan.tx import node_slots
+from sim.fakecan import FakeBus, FakeMCP2515, Message
+from sim.vclock import VirtualClock
+
+BITRATES = [20000, 50000, 125000, 250000, 500000, 1000000] # Standard bitrates, bit/s
+MAX_CABLE = {1000000: 40, 500000: 100, 250000: 250, 125000: 500, 50000: 1000, 20000: 2500} # Metres
+
+# Fraction of sensor readings sent under each policy.  "deadband" is phonecan.policy.ReportPolicy
+#   with the scripts' deadbands and 60 s heartbeat on a household trace, read every second
+#   (about 63 frames an hour, see bench/bench_report_policy.py).
+POLICIES = {"every": 1.0, "deadband": 63/3600}
+
+FORMATS = ("compact", "legacy")
+
+
+def frame_bits(length, extended=True, stuffing="worst"):
+    # Bits on the wire for one data frame, including the 3-bit interframe space
+    if extended:
+        bits, stuffed = 67 + 8*length, 54 + 8*length
+    else:
+        bits, stuffed = 47 + 8*length, 34 + 8*length
+    if stuffing == "worst":
+        bits += (stuffed - 1)//4
+    elif stuffing == "typical":
+        bits += (stuffed - 1)//8
+    return bits
+
+
+def frame_timer(bitrate, stuffing="worst"):
+    # frame_time function for sim.fakecan.FakeBus: seconds on the wire for a Message
+    def frame_time(msg):
+        return frame_bits(len(msg.data), msg.extended, stuffing)/bitrate
+    return frame_time
+
+
+def max_bitrate(cable):
+    # Highest standard bitrate for a cable length in metres, None if the cable is too long
+    usable = [bitrate for bitrate in BITRATES if MAX_CABLE[bitrate] >= cable]
+    return max(usable) if usable else None
+
+
+def node_frames(nodeid, frame_format, plan=False):
+    # [(CAN ID, payload length)] for one report from a node, as the node scripts send it
+    #   (rotation bits of structured IDs left at 0)
+    return node_slots(nodeid, frame_format, plan)
+
+
+def response_times(frames, bitrate, stuffing="worst"):
+    # {CAN ID: worst-case response time in seconds, or None if it can miss its period}
+    # frames: [(CAN ID, payload length, period s)]
+    tau = 1.0/bitrate
+    cost = {can_id: frame_bits(length, True, stuffing)*tau for can_id, length, _period in frames}
+    result = {}
+    for can_id, _length, period in frames:
+        blocking = max([cost[other] for other, _l, _p in frames if other > can_id] or [0.0])
+        higher = [(cost[other], other_period) for other, _l, other_period in frames if other < can_id]
+        w = blocking
+        while True:
+            new = blocking + sum(math.ceil((w + tau)/p)*c for c, p in higher)
+            if new + cost[can_id] > period:
+                result[can_id] = None
+                break
+            if new == w:
+                result[can_id] = w + cost[can_id]
+                break
+            w = new
+    return result
+
+
+def evaluate(nodes, bitrate, frame_format="compact", policy="deadband", interval=1.0, cable=10.0,
+             stuffing="worst", plan=False):
+    frames = []
+    for nodeid in range(nodes):
+        for can_id, length in node_frames(nodeid, frame_format, plan):
+            frames.append((can_id, length, interval))
+    fraction = POLICIES[policy]
+    bits_per_s = sum(frame_bits(length, True, stuffing) for _id, length, _p in frames)*fraction/interval
+    response = response_times(frames, bitrate, stuffing)
+    finite = [r for r in response.values() if r is not None]
+    limit = max_bitrate(cable)
+    return {
+        "nodes": nodes,
+        "bitrate": bitrate,
+        "format": frame_format,
+        "plan": plan,
+        "policy": policy,
+        "interval": interval,
+        "frames_per_s": len(frames)*fraction/interval,
+        "utilization": bits_per_s/bitrate,
+        "peak_utilization": bits_per_s/fraction/bitrate, # Every node sending every interval
+        "response": response,
+        "worst_response": None if len(finite) < len(response) else max(finite),
+        "cable_ok": limit is not None and bitrate <= limit,
+    }
+
+
+class _Probe():
+    # Bus controller that records each frame's latency from release to the end of its transmission
+    def __init__(self, clock):
+        self.clock = clock
+        self.latency = {}
+
+    def deliver(self, msg):
+        self.latency.setdefault(msg.id, []).append(self.clock.now - msg.released)
+
+
+def simulate(nodes, bitrate, frame_format="compact", policy="deadband", interval=1.0, seconds=60.0,
+             jitter=0.01, read_interval=0.5, poll_interval=0.002, stuffing="worst", seed=1, plan=False):
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    bus = FakeBus(frame_timer(bitrate, stuffing), clock=clock)
+    probe = _Probe(clock)
+    bus.attach(probe)
+    receivers = {"collectnodes": (FakeMCP2515(bus), read_interval), "drain": (FakeMCP2515(bus), poll_interval)}
+    fraction = POLICIES[policy]
+
+    def reader(controller, period):
+        def read():
+            controller.read_rx_buffers()
+            controller.queue.clear()
+            clock.call_later(period, read)
+        return read
+
+    def sender(nodeid, frames):
+        def send():
+            if rng.random() < fraction:
+                for can_id, length in frames:
+                    msg = Message(can_id, bytes(length), True)
+                    msg.released = clock.now
+                    bus.transmit(msg)
+            clock.call_later(interval + rng.uniform(-jitter, jitter), send)
+        return send
+
+    for controller, period in receivers.values():
+        clock.call_later(rng.uniform(0, period), reader(controller, period))
+    for nodeid in range(nodes):
+        clock.call_later(rng.uniform(0, interval), sender(nodeid, node_frames(nodeid, frame_format, plan)))
+    clock.run(seconds)
+
+    delivered = sum(len(latencies) for latencies in probe.latency.values())
+    return {
+        "frames": delivered,
+        "utilization": bus.busy_time/seconds,
+        "max_latency": {can_id: max(latencies) for can_id, latencies in probe.latency.items()},
+        "mean_latency": {can_id: sum(latencies)/len(latencies) for can_id, latencies in probe.latency.items()},
+        "drop_rate": {name: controller.rx_overflows/delivered if delivered else 0.0
+                      for name, (controller, _period) in receivers.items()},
+    }
+
+
+def recommend(node_counts, frame_format="compact", policy="deadband", interval=1.0, cable=10.0,
+              max_load=0.3, stuffing="worst", plan=False):
+    # [evaluate() result, or None if nothing fits] per node count
+    rows = []
+    for nodes in node_counts:
+        choice = None
+        for bitrate in BITRATES:
+            r = evaluate(nodes, bitrate, frame_format, policy, interval, cable, stuffing, plan)
+            if r["cable_ok"] and r["peak_utilization"] <= max_load and r["worst_response"] is not None:
+                choice = r
+                break
+        rows.append(choice)
+    return rows
+
+
+def print_ids(r, sim=None):
+    print("{:>8} {:>14} {:>14} {:>14}".format("CAN ID", "worst ms", "sim max ms", "sim mean ms"))
+    for can_id in sorted(r["response"]):
+        worst = r["response"][can_id]
+        line = "{:>8} {:>14}".format(hex(can_id), "miss" if worst is None else "{:.3f}".format(1000*worst))
+        if sim is not None and can_id in sim["max_latency"]:
+            line += " {:>14.3f} {:>14.3f}".format(1000*sim["max_latency"][can_id], 1000*sim["mean_latency"][can_id])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PhoneCAN bus load and latency model")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--bitrate", type=int, help="bit/s; without it a bitrate is recommended per node count")
+    parser.add_argument("--format", choices=FORMATS, default="compact")
+    parser.add_argument("--id-plan", action="store_true", help="Structured IDs (phonecan/registry.py)")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="deadband")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between sensor reads on each node")
+    parser.add_argument("--cable", type=float, default=10.0, help="Bus length, metres")
+    parser.add_argument("--max-load", type=float, default=0.3, help="Peak utilization allowed when recommending")
+    parser.add_argument("--simulate", type=float, metavar="SECONDS", help="Also run the discrete-event simulation")
+    parser.add_argument("--read-interval", type=float, default=0.5, help="collectnodes() receiver read interval, s")
+    parser.add_argument("--ids", action="store_true", help="Print worst-case response per CAN ID")
+    args = parser.parse_args()
+
+    if args.bitrate is None:
+        rows = recommend(args.nodes, args.format, args.policy, args.interval, args.cable, args.max_load,
+                         plan=args.id_plan)
+    else:
+        rows = [evaluate(n, args.bitrate, args.format, args.policy, args.interval, args.cable, plan=args.id_plan)
+                for n in args.nodes]
+    print("{0} frames on {1} IDs, {2} policy, {3:g} s interval, {4:g} m cable".format(
+        args.format, "structured" if args.id_plan else "original", args.policy, args.interval, args.cable))
+    header = "{:>6} {:>9} {:>10} {:>8} {:>8} {:>10}".format("nodes", "bitrate", "frames/s", "load", "peak",
+                                                            "worst ms")
+    if args.simulate:
+        header += " {:>9} {:>13} {:>9}".format("sim load", "collect drop", "drain drop")
+    print(header)
+    for nodes, r in zip(args.nodes, rows):
+        if r is None:
+            print("{:>6} {:>9}".format(nodes, "none fits"))
+            continue
+        worst = "miss" if r["worst_response"] is None else "{:.2f}".format(1000*r["worst_response"])
+        line = "{:>6} {:>9} {:>10.2f} {:>8.2%} {:>8.2%} {:>10}".format(
+            nodes, r["bitrate"], r["frames_per_s"], r["utilization"], r["peak_utilization"], worst)
+        if not r["cable_ok"]:
+            line += "  (too fast for the cable)"
+        sim = None
+        if args.simulate:
+            sim = simulate(nodes, r["bitrate"], args.format, args.policy, args.interval, args.simulate,
+                           read_interval=args.read_interval, plan=args.id_plan)
+            line += " {:>9.2%} {:>13.2%} {:>9.2%}".format(sim["utilization"], sim["drop_rate"]["collectnodes"],
+                                                         sim["drop_rate"]["drain"])
+        print(line)
+        if args.ids:
+            print_ids(r, sim)
+
+
+if __name__ == "__main__":
+    main()
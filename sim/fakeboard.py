@@ -0,0 +1,353 @@
+#
+# Fake CircuitPython board modules for running the node scripts on the host
+#
+# modules(node) builds the modules one script instance imports: board,
+# busio, digitalio, displayio, neopixel, adafruit_mcp2515 (and .canio), the
+# SHT4x/MS8607 drivers, async_button, the SH1107 display, terminalio,
+# adafruit_display_text, wifi, socketpool, microcontroller,
+# adafruit_minimqtt, adafruit_io, alarm, plus asyncio, gc and os stand-ins that run
+# asyncio.run() on the node's virtual event loop, report heap from tracemalloc
+# and read os.getenv() from the node's settings.  Each script instance gets
+# its own set (see sim/harness.py), so its CAN controller, sensor, display,
+# buttons and settings are its own.
+#
+# alarm.light_sleep_until_alarms() sleeps the node's thread on the virtual
+# clock until its TimeAlarm (nothing else on the node runs meanwhile, as on
+# the board) and adds the time to node.light_sleep.
+#
+# The MQTT client and WiFi radio talk to a FakeNetwork shared by all nodes:
+# every call costs network round trips of virtual time, published messages
+# are recorded, and set_down() makes connects and publishes fail.  A WiFi
+# join takes join_time virtual seconds, and the first join_failures joins
+# (and any while the network is down) fail after the join's timeout.
+#
+import os
+import gc
+import types
+import asyncio
+import tracemalloc
+
+from sim import fakedisplay
+from sim.fakecan import Match, Message
+from sim.fakesensor import FakeMS8607, FakeSHT4x
+from sim.vclock import VirtualEventLoop
+
+HEAP_SIZE = 2*1024*1024 # Bytes reported as the heap by gc.mem_free()
+
+
+class RemoteTransmissionRequest():
+    def __init__(self, id, length, extended=False):
+        self.id = id
+        self.length = length
+        self.extended = extended
+
+
+class Pin():
+    def __init__(self, name):
+        self.name = name
+
+
+class DigitalInOut():
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = False
+
+    def switch_to_output(self, value=False):
+        self.value = value
+
+
+class NeoPixel():
+    def __init__(self, pin, n, brightness=1.0):
+        self.pin = pin
+        self.brightness = brightness
+        self.pixels = [0]*n
+        self.fills = 0
+
+    def fill(self, color):
+        self.fills += 1
+        self.pixels = [color]*len(self.pixels)
+
+
+class Display(fakedisplay.Display):
+    # SH1107 that records (virtual time, location label text) at each refresh
+    def __init__(self, clock, *args, **kwargs):
+        super().__init__()
+        self.clock = clock
+        self.history = []
+
+    def refresh(self):
+        super().refresh()
+        title = None
+        group = self.root_group
+        if group is not None and len(group) > 5:
+            title = group[5].text
+        self.history.append((self.clock.now, title))
+
+
+class Button():
+    SINGLE = 1
+    DOUBLE = 2
+    TRIPLE = 3
+    LONG = 4
+    ANY_CLICK = (1, 2, 3, 4)
+
+    def __init__(self, pin, **kwargs):
+        self.pin = pin
+
+
+class MultiButton():
+    # wait() returns the presses queued with press() (through the node), polling like the button scanner does
+    poll_interval = 0.02 # Seconds
+
+    def __init__(self, presses, **buttons):
+        self.presses = presses
+        self.buttons = buttons
+
+    async def wait(self, **clicks):
+        while not self.presses:
+            await asyncio.sleep(self.poll_interval)
+        return self.presses.pop(0)
+
+
+class FakeNetwork():
+    def __init__(self, clock, rtt=0.05, connect_rtts=4, join_time=0.0, join_failures=0):
+        self.clock = clock
+        self.rtt = rtt # Seconds per round trip to the broker
+        self.connect_rtts = connect_rtts # TCP + TLS + MQTT CONNECT round trips
+        self.join_time = join_time # Seconds a WiFi join takes (association, DHCP), on top of two round trips
+        self.join_failures = join_failures # WiFi joins that fail before one succeeds
+        self.joins = 0 # Join attempts
+        self.down = False
+        self.connects = 0
+        self.published = [] # (virtual time, topic, payload length)
+
+    def set_down(self, down):
+        self.down = down
+
+    def round_trip(self, n=1):
+        self.clock.sleep(self.rtt*n)
+        if self.down:
+            raise OSError("network unreachable")
+
+
+class Radio():
+    def __init__(self, network):
+        self.network = network
+        self.connected = False
+
+    def connect(self, ssid, password, timeout=None):
+        network = self.network
+        network.joins += 1
+        if network.down or network.joins <= network.join_failures:
+            network.clock.sleep(network.join_time if timeout is None else timeout)
+            raise ConnectionError("No network with that ssid")
+        if timeout is not None and network.join_time > timeout:
+            network.clock.sleep(timeout)
+            raise ConnectionError("Timed out")
+        network.clock.sleep(network.join_time)
+        network.round_trip(2)
+        self.connected = True
+
+
+class MQTT():
+    def __init__(self, network, broker=None, username=None, password=None, socket_pool=None,
+                 ssl_context=None, socket_timeout=1, keep_alive=60, **kwargs):
+        self.network = network
+        self.username = username
+        self.keep_alive = keep_alive
+        self.is_connected = False
+        self.last_io = None
+
+    def connect(self):
+        self.network.round_trip(self.network.connect_rtts)
+        self.network.connects += 1
+        self.is_connected = True
+        self.last_io = self.network.clock.now
+
+    def disconnect(self):
+        self.is_connected = False
+
+    def reconnect(self):
+        self.disconnect()
+        self.connect()
+
+    def loop(self, timeout=1.0):
+        if not self.is_connected:
+            return
+        if self.network.clock.now - self.last_io >= self.keep_alive:
+            self.ping()
+
+    def ping(self):
+        try:
+            self.network.round_trip()
+        except OSError:
+            self.is_connected = False
+            raise
+        self.last_io = self.network.clock.now
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        if not self.is_connected:
+            raise OSError("not connected")
+        if qos:
+            self.ping()
+        elif self.network.down:
+            self.is_connected = False
+            raise OSError("network unreachable")
+        self.network.published.append((self.network.clock.now, topic, len(str(msg))))
+        self.last_io = self.network.clock.now
+
+
+class IO_MQTT():
+    def __init__(self, client):
+        self._client = client
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_subscribe = None
+        self.on_publish = None
+
+    @property
+    def is_connected(self):
+        return self._client.is_connected
+
+    def connect(self):
+        self._client.connect()
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    def reconnect(self):
+        self._client.reconnect()
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    def disconnect(self):
+        self._client.disconnect()
+        if self.on_disconnect is not None:
+            self.on_disconnect(self)
+
+    def subscribe(self, feed_key=None, group_key=None, shared_user=None):
+        self._client.ping()
+
+    def loop(self, timeout=1.0):
+        self._client.loop(timeout)
+
+    def publish(self, feed_key, data, metadata=None, shared_user=None, is_group=False):
+        kind = "groups" if is_group else "feeds"
+        self._client.publish("{0}/{1}/{2}".format(self._client.username, kind, feed_key), data)
+
+    def publish_multiple(self, feeds_and_data, timeout=3, is_group=False):
+        for feed_key, data in feeds_and_data:
+            self.publish(feed_key, data, is_group=is_group)
+            self._client.network.clock.sleep(timeout)
+
+
+class TimeAlarm():
+    def __init__(self, monotonic_time=None, epoch_time=None):
+        self.monotonic_time = monotonic_time
+        self.epoch_time = epoch_time
+
+
+class Reset(BaseException):
+    # microcontroller.reset(): ends the script instance
+    pass
+
+
+def _module(module_name, base=None, **attrs):
+    # A module with attrs, on top of a copy of base's (a real module) when given
+    module = types.ModuleType(module_name)
+    if base is not None:
+        module.__dict__.update(vars(base))
+        module.__name__ = module_name
+    module.__dict__.update(attrs)
+    return module
+
+
+def _mem_free():
+    if tracemalloc.is_tracing():
+        return HEAP_SIZE - tracemalloc.get_traced_memory()[0]
+    return HEAP_SIZE
+
+
+def modules(node):
+    # {module name: module} for one script instance (a sim.harness.Node)
+    clock = node.harness.clock
+    network = node.harness.network
+
+    def run(main):
+        loop = VirtualEventLoop(clock, node.harness.loop_cost)
+        node.loop = loop
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(main)
+        finally:
+            # Tasks left pending when the run ends are not an error
+            loop.set_exception_handler(lambda loop, context: None)
+
+    def getenv(key, default=None):
+        return node.env.get(key, default)
+
+    def sensor(cls):
+        def make(i2c, *args, **kwargs):
+            node.sensor = cls(wait=clock.sleep, offset=0.1*node.nodeid)
+            return node.sensor
+        return make
+
+    def can(spi, cs, *args, **kwargs):
+        return node.can_bus
+
+    def display(bus, *args, **kwargs):
+        node.display = Display(clock)
+        return node.display
+
+    def reset():
+        raise Reset()
+
+    def light_sleep_until_alarms(*alarms):
+        wake = min(a.monotonic_time for a in alarms)
+        start = clock.now
+        if wake > start:
+            clock.sleep(wake - start)
+        node.light_sleep += clock.now - start
+        node.light_sleeps += 1
+        return alarms[0]
+
+    pins = ("NEOPIXEL", "CAN_CS", "D5", "D6", "D9", "SCK", "MOSI", "MISO", "SCL", "SDA")
+    board = _module("board", SPI=lambda: "spi", I2C=lambda: "i2c", **{pin: Pin(pin) for pin in pins})
+    canio = _module("adafruit_mcp2515.canio", Message=Message, Match=Match,
+                    RemoteTransmissionRequest=RemoteTransmissionRequest)
+    minimqtt = _module("adafruit_minimqtt.adafruit_minimqtt",
+                       MQTT=lambda **kwargs: MQTT(network, **kwargs))
+    adafruit_io = _module("adafruit_io.adafruit_io", IO_MQTT=IO_MQTT)
+    radio = Radio(network)
+    alarm_time = _module("alarm.time", TimeAlarm=TimeAlarm)
+    return {
+        "board": board,
+        "busio": _module("busio", SPI=lambda *args: "spi", I2C=lambda *args: "i2c"),
+        "digitalio": _module("digitalio", DigitalInOut=DigitalInOut, Direction=object, Pull=object),
+        "neopixel": _module("neopixel", NeoPixel=NeoPixel),
+        "adafruit_mcp2515": _module("adafruit_mcp2515", MCP2515=can, canio=canio),
+        "adafruit_mcp2515.canio": canio,
+        "adafruit_sht4x": _module("adafruit_sht4x", SHT4x=sensor(FakeSHT4x)),
+        "adafruit_ms8607": _module("adafruit_ms8607", MS8607=sensor(FakeMS8607)),
+        "async_button": _module("async_button", Button=Button,
+                                MultiButton=lambda **buttons: MultiButton(node.presses, **buttons)),
+        "displayio": _module("displayio", Group=fakedisplay.Group, Bitmap=lambda *args: None,
+                             Palette=lambda n: [0]*n, TileGrid=lambda *args, **kwargs: None,
+                             release_displays=lambda: None, I2CDisplay=lambda *args, **kwargs: None),
+        "i2cdisplaybus": _module("i2cdisplaybus", I2CDisplayBus=lambda *args, **kwargs: None),
+        "adafruit_displayio_sh1107": _module("adafruit_displayio_sh1107", SH1107=display),
+        "terminalio": _module("terminalio", FONT=fakedisplay.terminalio.FONT),
+        "adafruit_display_text": _module("adafruit_display_text", label=fakedisplay.label),
+        "wifi": _module("wifi", radio=radio),
+        "socketpool": _module("socketpool", SocketPool=lambda radio: None),
+        "microcontroller": _module("microcontroller", reset=reset),
+        "alarm": _module("alarm", time=alarm_time, light_sleep_until_alarms=light_sleep_until_alarms),
+        "alarm.time": alarm_time,
+        "adafruit_minimqtt": _module("adafruit_minimqtt", adafruit_minimqtt=minimqtt),
+        "adafruit_minimqtt.adafruit_minimqtt": minimqtt,
+        "adafruit_io": _module("adafruit_io", adafruit_io=adafruit_io),
+        "adafruit_io.adafruit_io": adafruit_io,
+        "asyncio": _module("asyncio", asyncio, run=run),
+        "gc": _module("gc", gc, mem_free=_mem_free),
+        "os": _module("os", os, getenv=getenv),
+    }
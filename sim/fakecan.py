@@ -0,0 +1,368 @@
+#
+# Fake canio / MCP2515 for host-side runs
+#
+# Mirrors the parts of adafruit_mcp2515 used by the node scripts: Message,
+# Match, MCP2515.listen()/send()/restart()/state and the error counters, and
+# Listener.in_waiting()/receive()/deinit() as a context manager.
+#
+# Frames are delivered through a FakeBus shared by every controller.  Like the
+# real chip, each controller has a small number of hardware receive buffers
+# (two on the MCP2515); frames arriving while they are full are dropped and
+# counted as overflows.  The listener matches act as the hardware acceptance
+# filters.  As in the driver, every in_waiting()/receive() call moves at most
+# two frames from the hardware buffers into the driver's software queue, and
+# spi_delay models the time the CPU is blocked per frame transferred over SPI.
+#
+# Fault injection (clock mode): with error_rate set on the FakeBus, each frame
+# is corrupted with that probability (error_rate can also be a function of the
+# Message and the sending controller, e.g. for one node with a bad connector).  As on a real bus the sender's transmit
+# error counter goes up by 8 and every other controller's receive error
+# counter by 1, and the sender tries the frame again; every good frame takes
+# 1 off the counters.  A controller's state follows its counters (error
+# warning from 96, error passive from 128, bus off above 255 transmit
+# errors).  A bus-off controller drops its pending frames and cannot send
+# until restart() (or bus_off_recovery seconds, if set, like the MCP2515's
+# automatic recovery on a quiet bus); restart() also clears its receive
+# buffers.
+#
+# Each controller also has the MCP2515's three transmit buffers: a frame
+# holds one until it is on the wire without errors, and send() raises
+# RuntimeError, as the driver does, while all of them are taken (and while
+# bus off).
+#
+import time
+import random
+
+# MCP2515 error flag register and its bits
+EFLG = 0x2D
+EWARN = 0x01
+RXEP = 0x08
+TXEP = 0x10
+TXBO = 0x20
+RX0OVR = 0x40
+RX1OVR = 0x80
+
+# canio.BusState values
+ERROR_ACTIVE = 0
+ERROR_WARNING = 1
+ERROR_PASSIVE = 2
+BUS_OFF = 3
+
+
+def busy_wait(seconds):
+    # SPI transfers keep the CPU busy, so spin rather than sleep
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class Message():
+    # As adafruit_mcp2515.canio.Message, setting data stores a copy
+    def __init__(self, id, data, extended=False):
+        self.id = id
+        self.data = data
+        self.extended = extended
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, new_data):
+        self._data = bytearray(new_data)
+
+
+class Match():
+    def __init__(self, id, mask=None, extended=False):
+        self.id = id
+        self.mask = mask
+        self.extended = extended
+
+    def accepts(self, msg):
+        if self.extended != msg.extended:
+            return False
+        mask = self.mask
+        if mask is None:
+            mask = 0x1FFFFFFF if self.extended else 0x7FF
+        return (msg.id & mask) == (self.id & mask)
+
+
+class FakeBus():
+    # With frame_time=None frames are delivered as soon as they are sent.  Otherwise
+    # run() must be running as an asyncio task, or a sim.vclock.VirtualClock given as
+    # clock: one pending frame goes on the wire every frame_time seconds, lowest ID
+    # first (CAN arbitration).  With a clock, frame_time can also be a function of the
+    # Message (see sim.busload.frame_timer).
+    def __init__(self, frame_time=None, clock=None):
+        self.controllers = []
+        self.frame_time = frame_time
+        self.clock = clock
+        self.pending = []
+        self.frames_sent = 0
+        self.busy_time = 0.0 # Seconds the wire was in use (clock only)
+        self.error_rate = 0.0 # Probability a frame is corrupted, or a function of (msg, sender) (clock only)
+        self.errors = 0
+        self.rng = random.Random(1)
+        self._wire_busy = False
+
+    def attach(self, controller):
+        self.controllers.append(controller)
+
+    def transmit(self, msg, sender=None):
+        if self.frame_time is None:
+            self.deliver(msg, sender)
+        else:
+            self.pending.append((msg, sender))
+            if self.clock is not None and not self._wire_busy:
+                # Arbitrate once every node sending at this instant has queued its frame
+                self._wire_busy = True
+                self.clock.call_later(0, self._arbitrate)
+
+    def _arbitrate(self):
+        if not self.pending:
+            self._wire_busy = False
+            return
+        winner = min(range(len(self.pending)), key=lambda i: self.pending[i][0].id)
+        msg, sender = self.pending.pop(winner)
+        duration = self.frame_time(msg) if callable(self.frame_time) else self.frame_time
+        self.busy_time += duration
+        rate = self.error_rate(msg, sender) if callable(self.error_rate) else self.error_rate
+        corrupt = rate and self.rng.random() < rate
+
+        def end_of_frame():
+            if corrupt:
+                self.error(msg, sender)
+            else:
+                self.deliver(msg, sender)
+            self._arbitrate()
+        self.clock.call_later(duration, end_of_frame)
+
+    def error(self, msg, sender):
+        # A corrupted frame: error counters go up and the sender retransmits unless it went bus off
+        self.errors += 1
+        for controller in self.controllers:
+            if controller is sender:
+                if hasattr(controller, "tx_error"):
+                    controller.tx_error()
+            elif hasattr(controller, "rx_error"):
+                controller.rx_error()
+        if sender is None or getattr(sender, "_state", 0) != BUS_OFF:
+            self.pending.append((msg, sender))
+
+    def drop(self, sender):
+        # Remove a controller's frames still waiting for the wire
+        self.pending[:] = [(msg, s) for msg, s in self.pending if s is not sender]
+
+    def deliver(self, msg, sender):
+        self.frames_sent += 1
+        if hasattr(sender, "tx_ok"):
+            sender.tx_ok()
+        for controller in self.controllers:
+            if controller is not sender:
+                controller.deliver(msg)
+
+    async def run(self):
+        import asyncio
+        while True:
+            if self.pending:
+                winner = min(range(len(self.pending)), key=lambda i: self.pending[i][0].id)
+                msg, sender = self.pending.pop(winner)
+                await asyncio.sleep(self.frame_time)
+                self.deliver(msg, sender)
+            else:
+                await asyncio.sleep(self.frame_time)
+
+
+class FakeListener():
+    def __init__(self, controller, matches, timeout):
+        self.controller = controller
+        self.matches = matches
+        self.timeout = timeout
+        self.frames_handled = 0
+
+    def accepts(self, msg):
+        if not self.matches:
+            return True
+        for match in self.matches:
+            if match.accepts(msg):
+                return True
+        return False
+
+    def in_waiting(self):
+        self.controller.read_rx_buffers()
+        return len(self.controller.queue)
+
+    def receive(self):
+        queue = self.controller.queue
+        self.controller.read_rx_buffers()
+        if not queue:
+            if self.timeout:
+                time.sleep(self.timeout)
+            self.controller.read_rx_buffers()
+            if not queue:
+                return None
+        self.frames_handled += 1
+        return queue.pop(0)
+
+    def deinit(self):
+        if self in self.controller.listeners:
+            self.controller.listeners.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.deinit()
+
+
+class FakeMCP2515():
+    def __init__(self, bus=None, rx_buffers=2, spi_delay=0.0, bus_off_recovery=None, tx_buffers=3):
+        self.bus = bus
+        self.tx_buffers = tx_buffers # Hardware transmit buffers, None for unlimited
+        self.tx_busy = 0 # Transmit buffers holding a frame not yet sent
+        self.bus_off_recovery = bus_off_recovery # Seconds, None to stay bus off until restart()
+        self.rx_buffers = rx_buffers # Hardware receive buffers, None for unlimited
+        self.spi_delay = spi_delay # Seconds the CPU is blocked per frame read
+        self.rx_hw = []
+        self.queue = []
+        self.listeners = []
+        self._state = 0
+        self.transmit_error_count = 0
+        self.receive_error_count = 0
+        self.rx_overflows = 0
+        self.eflg = 0
+        self.restarts = 0
+        self.frames_sent = 0
+        self.send_failures = 0
+        self.restart_losses = 0 # Received frames cleared by restart()
+        self.bus_offs = 0
+        self.last_sent = None
+        if bus is not None:
+            bus.attach(self)
+
+    def accepts(self, msg):
+        # Acceptance filters come from the open listeners; with no filters every frame is accepted
+        for listener in self.listeners:
+            if listener.accepts(msg):
+                return True
+        return not self.listeners
+
+    def _update_state(self):
+        tec = self.transmit_error_count
+        worst = max(tec, self.receive_error_count)
+        if self._state == BUS_OFF:
+            return
+        if tec > 255:
+            self._state = BUS_OFF
+            self.bus_offs += 1
+            self.tx_busy = 0
+            if self.bus is not None:
+                self.bus.drop(self)
+                if self.bus_off_recovery is not None and self.bus.clock is not None:
+                    self.bus.clock.call_later(self.bus_off_recovery, self._recovered)
+        elif worst >= 128:
+            self._state = ERROR_PASSIVE
+        elif worst >= 96:
+            self._state = ERROR_WARNING
+        else:
+            self._state = ERROR_ACTIVE
+
+    def _recovered(self):
+        if self._state == BUS_OFF:
+            self._reset_counters()
+
+    def _reset_counters(self):
+        self._state = ERROR_ACTIVE
+        self.transmit_error_count = 0
+        self.receive_error_count = 0
+
+    def tx_error(self):
+        self.transmit_error_count += 8
+        self._update_state()
+
+    def tx_ok(self):
+        if self.tx_busy:
+            self.tx_busy -= 1
+        if self.transmit_error_count:
+            self.transmit_error_count -= 1
+            self._update_state()
+
+    def rx_error(self):
+        if self._state != BUS_OFF:
+            self.receive_error_count = min(self.receive_error_count + 1, 255)
+            self._update_state()
+
+    def deliver(self, msg):
+        if self._state == BUS_OFF:
+            return
+        if self.receive_error_count:
+            self.receive_error_count -= 1
+            self._update_state()
+        if not self.accepts(msg):
+            return
+        if self.rx_buffers is not None and len(self.rx_hw) >= self.rx_buffers:
+            # With rollover the second buffer is the one that overflows
+            self.rx_overflows += 1
+            self.eflg |= RX1OVR
+            return
+        self.rx_hw.append(msg)
+
+    def read_rx_buffers(self):
+        for _i in range(2):
+            if not self.rx_hw:
+                break
+            if self.spi_delay:
+                busy_wait(self.spi_delay)
+            self.queue.append(self.rx_hw.pop(0))
+
+    @property
+    def state(self):
+        # As in the driver, reading the state reads EFLG and clears its receive overflow bits
+        self.eflg &= ~(RX0OVR | RX1OVR)
+        return self._state
+
+    # Register access used by phonecan.health.ErrorFlags
+    def _read_register(self, register):
+        if register == EFLG:
+            flags = self.eflg
+            if self._state == BUS_OFF:
+                flags |= TXBO
+            elif self._state == ERROR_PASSIVE:
+                flags |= TXEP if self.transmit_error_count >= 128 else RXEP
+            elif self._state == ERROR_WARNING:
+                flags |= EWARN
+            return flags
+        return 0
+
+    def _mod_register(self, register, mask, value):
+        if register == EFLG:
+            self.eflg = (self.eflg & ~mask) | (value & mask)
+
+    def listen(self, matches=None, *, timeout=10):
+        listener = FakeListener(self, matches, timeout)
+        self.listeners.append(listener)
+        return listener
+
+    def send(self, msg):
+        if self._state == BUS_OFF or (self.tx_buffers is not None and self.tx_busy >= self.tx_buffers):
+            self.send_failures += 1
+            raise RuntimeError("No transmit buffer available to send")
+        self.frames_sent += 1
+        self.last_sent = msg
+        if self.bus is not None:
+            # The driver loads id and data into a transmit buffer, so later changes to msg do not reach the bus
+            msg = Message(msg.id, msg.data, msg.extended)
+            self.tx_busy += 1
+            self.bus.transmit(msg, self)
+        return True
+
+    def restart(self):
+        # Reinitializes the controller: counters cleared, pending and received frames lost
+        self.restarts += 1
+        self.restart_losses += len(self.rx_hw) + len(self.queue)
+        self._reset_counters()
+        self.rx_hw.clear()
+        self.queue.clear()
+        self.tx_busy = 0
+        if self.bus is not None:
+            self.bus.drop(self)
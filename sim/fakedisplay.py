@@ -0,0 +1,82 @@
+#
+# Fake displayio Group and adafruit_display_text label for host-side runs
+#
+# Group behaves like displayio.Group for append/insert/pop/len/indexing and
+# counts structural changes.  Label keeps text and position; assigning .text
+# is counted so benchmarks can tell in-place updates from new Labels.
+#
+
+
+class Group():
+    def __init__(self):
+        self.items = []
+        self.changes = 0 # Structural changes (append/insert/pop)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def append(self, item):
+        self.changes += 1
+        self.items.append(item)
+
+    def insert(self, index, item):
+        self.changes += 1
+        self.items.insert(index, item)
+
+    def pop(self, index=-1):
+        self.changes += 1
+        return self.items.pop(index)
+
+
+class Label():
+    created = 0 # Labels constructed, across all instances
+
+    def __init__(self, font, text="", color=0xFFFFFF, x=0, y=0):
+        Label.created += 1
+        self.font = font
+        self._text = text
+        self.color = color
+        self.x = x
+        self.y = y
+        self.text_changes = 0
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self.text_changes += 1
+        self._text = value
+
+
+class FakeFont():
+    pass
+
+
+class label():
+    # Stands in for the adafruit_display_text.label module
+    Label = Label
+
+
+class terminalio():
+    # Stands in for the terminalio module
+    FONT = FakeFont()
+
+
+class Display():
+    # Counts refreshes; with auto_refresh on, call changed() after each drawing pass
+    def __init__(self):
+        self.auto_refresh = True
+        self.refreshes = 0
+        self.root_group = None
+
+    def refresh(self):
+        self.refreshes += 1
+
+    def changed(self):
+        if self.auto_refresh:
+            self.refreshes += 1
@@ -0,0 +1,286 @@
+#
+# Local stand-in MQTT broker and Adafruit IO client for host-side runs
+#
+# FakeBroker is a minimal MQTT 3.1.1 broker on localhost (CONNECT, PUBLISH
+# QoS 0 and 1, SUBSCRIBE, PINGREQ, DISCONNECT) in a background thread.  It
+# counts connections, publishes and bytes in each direction and records when
+# each publish arrived.  set_down(True) drops every connection and refuses
+# new ones until set_down(False), standing in for a WiFi or broker outage.
+#
+# FakeIO mirrors the parts of adafruit_io.adafruit_io.IO_MQTT used by the send
+# node (connect, reconnect, disconnect, is_connected, loop, publish,
+# publish_multiple) and speaks real MQTT to the broker over a socket.  The
+# TLS handshake io.adafruit.com needs is not performed; instead each connect
+# waits connect_rtts round trips and adds tls_bytes to the client's byte
+# count.  Like the library, publish_multiple() sleeps timeout seconds after
+# every feed.  All waits are multiplied by time_scale so runs are quick.
+# FakeIO.mqtt_client stands in for the MiniMQTT client underneath, for
+# publishes with qos.  As with MiniMQTT, failures raise (OSError here).
+#
+import time
+import socket
+import struct
+import threading
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return bytes(out)
+
+
+def encode_string(s):
+    data = s.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(ptype, body=b""):
+    return bytes([ptype]) + encode_length(len(body)) + body
+
+
+def read_packet(sock):
+    # Returns (type byte, body, bytes read) or None if the connection closed
+    head = sock.recv(1)
+    if not head:
+        return None
+    nread = 1
+    length = 0
+    shift = 0
+    while True:
+        b = sock.recv(1)
+        if not b:
+            return None
+        nread += 1
+        length |= (b[0] & 0x7F) << shift
+        shift += 7
+        if not b[0] & 0x80:
+            break
+    body = b""
+    while len(body) < length:
+        chunk = sock.recv(length - len(body))
+        if not chunk:
+            return None
+        body += chunk
+    return head[0], body, nread + length
+
+
+class FakeBroker():
+    def __init__(self):
+        self.connects = 0
+        self.publishes = []  # (time received, topic, payload)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.down = False
+        self._conns = []
+        self._lock = threading.Lock()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(8)
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _addr = self._server.accept()
+            except OSError:
+                return
+            if self.down:
+                conn.close()
+                continue
+            with self._lock:
+                self._conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _send(self, conn, data):
+        conn.sendall(data)
+        with self._lock:
+            self.bytes_out += len(data)
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    pkt = read_packet(conn)
+                except OSError:
+                    return
+                if pkt is None:
+                    return
+                ptype, body, nread = pkt
+                with self._lock:
+                    self.bytes_in += nread
+                kind = ptype & 0xF0
+                if kind == CONNECT:
+                    with self._lock:
+                        self.connects += 1
+                    self._send(conn, packet(CONNACK, b"\x00\x00"))
+                elif kind == PUBLISH:
+                    tlen = struct.unpack("!H", body[:2])[0]
+                    topic = body[2:2 + tlen].decode()
+                    payload = body[2 + tlen:]
+                    if (ptype >> 1) & 0x03:
+                        pid = payload[:2]
+                        payload = payload[2:]
+                        self._send(conn, packet(PUBACK, pid))
+                    with self._lock:
+                        self.publishes.append((time.perf_counter(), topic, payload))
+                elif kind == SUBSCRIBE:
+                    self._send(conn, packet(SUBACK, body[:2] + b"\x00"))
+                elif kind == PINGREQ:
+                    self._send(conn, packet(PINGRESP))
+                elif kind == DISCONNECT:
+                    return
+
+    def set_down(self, down):
+        self.down = down
+        if down:
+            with self._lock:
+                conns, self._conns = self._conns, []
+            for conn in conns:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._server.close()
+
+
+class _FakeMQTTClient():
+    # The MiniMQTT publish() used by phonecan.publish.Publisher for qos > 0
+    def __init__(self, io):
+        self._io = io
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self._io.publish_topic(topic, msg, qos)
+
+
+class FakeIO():
+    def __init__(self, port, username="user", key="key", keep_alive=60,
+                 rtt=0.05, connect_rtts=4, tls_bytes=5000, time_scale=1.0):
+        self._port = port
+        self._user = username
+        self._key = key
+        self.keep_alive = keep_alive # Seconds
+        self.rtt = rtt # Seconds per round trip to the broker
+        self.connect_rtts = connect_rtts # TCP + TLS + MQTT CONNECT round trips
+        self.tls_bytes = tls_bytes # TLS handshake bytes per connection (certificates dominate)
+        self.time_scale = time_scale
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.connects = 0
+        self.pings = 0
+        self.waited = 0.0 # Modelled seconds spent waiting (before time_scale)
+        self._sock = None
+        self._last_io = 0.0
+        self._pid = 0
+        self.mqtt_client = _FakeMQTTClient(self)
+
+    @property
+    def is_connected(self):
+        return self._sock is not None
+
+    def _wait(self, seconds):
+        self.waited += seconds
+        time.sleep(seconds*self.time_scale)
+
+    def _lost(self):
+        self._sock.close()
+        self._sock = None
+        raise OSError("connection to broker lost")
+
+    def _send(self, data):
+        if self._sock is None:
+            raise OSError("not connected")
+        try:
+            self._sock.sendall(data)
+        except OSError:
+            self._lost()
+        self.bytes_sent += len(data)
+        self._last_io = time.monotonic()
+
+    def _receive(self):
+        try:
+            pkt = read_packet(self._sock)
+        except OSError:
+            pkt = None
+        if pkt is None:
+            self._lost()
+        ptype, body, nread = pkt
+        self.bytes_received += nread
+        return ptype, body
+
+    def connect(self):
+        self._sock = socket.create_connection(("127.0.0.1", self._port))
+        self._sock.settimeout(1.0)
+        self._wait(self.rtt*self.connect_rtts)
+        self.bytes_sent += self.tls_bytes//2
+        self.bytes_received += self.tls_bytes - self.tls_bytes//2
+        body = (encode_string("MQTT") + bytes([4, 0xC2]) + struct.pack("!H", self.keep_alive)
+                + encode_string("circuitpython") + encode_string(self._user) + encode_string(self._key))
+        self._send(packet(CONNECT, body))
+        ptype, _body = self._receive()
+        assert ptype == CONNACK
+        self.connects += 1
+
+    def reconnect(self):
+        if self._sock is not None:
+            self.disconnect()
+        self.connect()
+
+    def disconnect(self):
+        if self._sock is None:
+            return
+        self._send(packet(DISCONNECT))
+        self._sock.close()
+        self._sock = None
+
+    def loop(self, timeout=1.0):
+        # Send a keepalive ping when the session has been idle for keep_alive seconds
+        if self._sock is None:
+            return
+        if time.monotonic() - self._last_io >= self.keep_alive*self.time_scale:
+            self._send(packet(PINGREQ))
+            self._receive()
+            self.pings += 1
+
+    def publish_topic(self, topic, data, qos=0):
+        if qos == 0:
+            self._send(packet(PUBLISH, encode_string(topic) + str(data).encode()))
+            return
+        self._pid = self._pid % 0xFFFF + 1
+        pid = struct.pack("!H", self._pid)
+        self._send(packet(PUBLISH | 0x02, encode_string(topic) + pid + str(data).encode()))
+        ptype, body = self._receive()
+        if ptype & 0xF0 != PUBACK or body != pid:
+            raise OSError("no PUBACK")
+
+    def publish(self, feed_key, data, metadata=None, shared_user=None, is_group=False):
+        if is_group:
+            topic = "{0}/groups/{1}".format(self._user, feed_key)
+        else:
+            topic = "{0}/feeds/{1}".format(self._user, feed_key)
+        self.publish_topic(topic, data)
+
+    def publish_multiple(self, feeds_and_data, timeout=3, is_group=False):
+        for feed_key, data in feeds_and_data:
+            self.publish(feed_key, data, is_group=is_group)
+            self._wait(timeout)
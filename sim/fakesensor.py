@@ -0,0 +1,57 @@
+#
+# Fake SHT4x and MS8607 sensors for host-side runs
+#
+# Like adafruit_sht4x.SHT4x, .temperature and .relative_humidity each take a
+# full measurement and .measurements returns both from one.  Each measurement
+# blocks for measure_time (about 8.3 ms at high precision) and is counted, so
+# benchmarks can report sensor transactions and the time the CPU was blocked.
+# The CPU spins while blocked unless a wait function is given (the simulation
+# harness passes its virtual clock's sleep).
+#
+# FakeMS8607 adds .pressure; like adafruit_ms8607.MS8607 each property is
+# its own measurement.
+#
+import math
+import time
+
+from sim.fakecan import busy_wait
+
+
+class FakeSHT4x():
+    def __init__(self, measure_time=0.0083, wait=None, offset=0.0):
+        self.measure_time = measure_time # Seconds
+        self.wait = busy_wait if wait is None else wait
+        self.offset = offset # Added to the temperature, so several sensors differ
+        self.transactions = 0
+        self.busy = 0.0 # Seconds spent blocked in measurements
+        self._start = time.monotonic()
+
+    def _measure(self):
+        t0 = time.monotonic()
+        self.wait(self.measure_time)
+        self.transactions += 1
+        self.busy += time.monotonic() - t0
+        return time.monotonic() - self._start
+
+    @property
+    def measurements(self):
+        phase = self._measure()
+        return 21.0 + self.offset + 0.5*math.sin(phase/60), 45.0 + 2.0*math.sin(phase/90)
+
+    @property
+    def temperature(self):
+        return self.measurements[0]
+
+    @property
+    def relative_humidity(self):
+        return self.measurements[1]
+
+
+class FakeMS8607(FakeSHT4x):
+    def __init__(self, measure_time=0.0166, wait=None, offset=0.0):
+        super().__init__(measure_time, wait, offset)
+
+    @property
+    def pressure(self):
+        phase = self._measure()
+        return 1013.0 + 3.0*math.sin(phase/300)
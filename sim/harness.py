@@ -0,0 +1,163 @@
+#
+# Run the node scripts on the host (host CPython)
+#
+# Loads any number of instances of code_homenode.py, code_sendnode.py and
+# code_remote1/2.py into one process, each with its own fake board modules
+# (sim/fakeboard.py): a fake MCP2515 on one shared CAN bus that arbitrates by
+# ID and takes each frame's time on the wire at bitrate, a fake sensor, display and buttons, and
+# settings read with os.getenv().  The scripts are run unchanged, top level
+# included, on a virtual clock (sim/vclock.py): blocking sleeps stall only
+# the node that makes them, asyncio loops wait in virtual time, and every
+# event-loop pass costs loop_cost seconds of CPU.  A run of minutes of
+# virtual time takes seconds.
+#
+#   harness = Harness()
+#   home = harness.add("code_homenode.py", 0)
+#   for node in (1, 2, 4, 5):
+#       harness.add("code_remote2.py", node)
+#   harness.at(10.0, lambda: home.press("b", Button.SINGLE))
+#   harness.run(60.0)
+#   print(harness.bus.frames_sent, home.can_bus.rx_overflows, home.display.history)
+#
+# Each instance's print() output is kept in node.log (echoed with
+# verbose=True); node.namespace holds the script's globals.
+#
+#   python -m sim.harness --remotes 6 --seconds 120
+#
+import os
+import builtins
+import argparse
+import collections
+
+from sim.busload import frame_timer
+from sim.fakeboard import Button, FakeNetwork, modules
+from sim.fakecan import FakeBus, FakeMCP2515
+from sim.vclock import VirtualClock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BITRATE = 250000 # bit/s, the adafruit_mcp2515 default
+
+
+class Node():
+    def __init__(self, harness, script, nodeid, env=None):
+        self.harness = harness
+        self.script = script
+        self.nodeid = nodeid
+        self.name = "{0}[{1}]".format(os.path.splitext(os.path.basename(script))[0], nodeid)
+        self.env = {"PHONECAN_NODEID": nodeid, "CIRCUITPY_WIFI_SSID": "sim", "CIRCUITPY_WIFI_PASSWORD": "sim",
+                    "ADAFRUIT_AIO_USERNAME": "sim", "ADAFRUIT_AIO_KEY": "sim"}
+        if env:
+            self.env.update(env)
+        self.can_bus = FakeMCP2515(harness.bus, rx_buffers=harness.rx_buffers, spi_delay=harness.spi_delay)
+        self.sensor = None
+        self.display = None
+        self.loop = None
+        self.presses = []
+        self.log = collections.deque(maxlen=200)
+        self.lines = 0 # Lines printed
+        self.namespace = None
+        self.participant = None
+        self.light_sleep = 0.0 # Virtual seconds in alarm.light_sleep_until_alarms()
+        self.light_sleeps = 0
+        self.modules = modules(self)
+
+    def press(self, button, click=Button.SINGLE):
+        self.presses.append((button, click))
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0:
+            if name in self.modules:
+                if fromlist or "." not in name:
+                    return self.modules[name]
+                return self.modules[name.split(".")[0]]
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def _print(self, *args, sep=" ", end="\n", file=None, flush=False):
+        line = sep.join(str(arg) for arg in args)
+        self.lines += line.count("\n") + 1
+        self.log.append((self.harness.clock.now, line))
+        if self.harness.verbose:
+            print("{0:10.3f} {1}: {2}".format(self.harness.clock.now, self.name, line))
+
+    def run(self):
+        path = os.path.join(ROOT, self.script)
+        with open(path) as f:
+            code = compile(f.read(), path, "exec")
+        node_builtins = dict(vars(builtins), __import__=self._import, print=self._print)
+        self.namespace = {"__name__": "__main__", "__file__": path, "__builtins__": node_builtins}
+        exec(code, self.namespace)
+
+    @property
+    def error(self):
+        return None if self.participant is None else self.participant.error
+
+
+class Harness():
+    def __init__(self, bitrate=BITRATE, loop_cost=0.0005, rx_buffers=2, spi_delay=0.0,
+                 rtt=0.05, verbose=False):
+        self.clock = VirtualClock()
+        self.bus = FakeBus(frame_timer(bitrate, "typical"), clock=self.clock)
+        self.network = FakeNetwork(self.clock, rtt=rtt)
+        self.loop_cost = loop_cost # Seconds of CPU per event-loop pass
+        self.rx_buffers = rx_buffers
+        self.spi_delay = spi_delay
+        self.verbose = verbose
+        self.nodes = []
+
+    def add(self, script, nodeid, env=None):
+        node = Node(self, script, nodeid, env)
+        self.nodes.append(node)
+        return node
+
+    def at(self, when, callback):
+        # Call callback() at virtual time when (seconds)
+        self.clock.call_at(when, callback)
+
+    def run(self, seconds):
+        with self.clock.patch():
+            for node in self.nodes:
+                node.participant = self.clock.spawn(node.name, node.run)
+            self.clock.run(seconds)
+        for node in self.nodes:
+            if node.error is not None:
+                raise RuntimeError("{0} failed: {1!r}".format(node.name, node.error)) from node.error
+
+    def bus_load(self):
+        # Fraction of the time the wire was busy
+        return self.bus.busy_time/self.clock.now if self.clock.now else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the PhoneCAN node scripts on a simulated bus")
+    parser.add_argument("--remotes", type=int, default=2, help="Remote node instances (node IDs 1, 2, 4, 5, ...)")
+    parser.add_argument("--seconds", type=float, default=60.0, help="Virtual seconds to run")
+    parser.add_argument("--no-home", action="store_true")
+    parser.add_argument("--no-send", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="Echo every node's output")
+    args = parser.parse_args()
+
+    harness = Harness(verbose=args.verbose)
+    if not args.no_home:
+        harness.add("code_homenode.py", 0)
+    if not args.no_send:
+        harness.add("code_sendnode.py", 3)
+    nodeids = [n for n in range(1, args.remotes + 3) if n != 3][:args.remotes]
+    for i, nodeid in enumerate(nodeids):
+        harness.add("code_remote1.py" if i % 2 == 0 else "code_remote2.py", nodeid)
+    harness.run(args.seconds)
+    print("{0:.0f} virtual s: {1} frames, bus load {2:.1%}, {3} clock switches".format(
+        harness.clock.now, harness.bus.frames_sent, harness.bus_load(), harness.clock.switches))
+    for node in harness.nodes:
+        if node.can_bus.listeners:
+            received = "received {0}, receive overflows {1}".format(
+                sum(listener.frames_handled for listener in node.can_bus.listeners), node.can_bus.rx_overflows)
+        else:
+            received = "not listening"
+        asleep = ""
+        if node.light_sleeps:
+            asleep = ", light sleep {0:.1%}".format(node.light_sleep/harness.clock.now)
+        print("{0:>20}: sent {1}, {2}{3}".format(node.name, node.can_bus.frames_sent, received, asleep))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#
+# Replay a PhoneCAN bus log into the node receive logic (host CPython)
+#
+# Feeds the frames of a log (phonecan/canlog.py, recorded with
+# gateway/record.py or made with --synthesize) through a sim.fakecan bus
+# into the receive path the nodes run: an RxDrain on a fake MCP2515 with its
+# acceptance filters, then
+#   send: collectnodes(), draining the ring every read_interval into a
+#         NodeAggregator through NodeRegistry.decode()
+#   home: button_func(), taking each frame with rxdrain.recv() into a
+#         NodeCache and the ValueDisplay of the selected node
+# at the log's own pace (--speed 1), N times faster (--speed N) or as fast
+# as possible (--speed max).  Reports frames per second processed, per-frame
+# handling latency percentiles (from the frame going on the bus to the
+# consumer handling it) and frames lost in the receive path.
+#
+#   python -m sim.replay house.canlog --speed 10 --consumer home
+#   python -m sim.replay --synthesize house.canlog --minutes 10
+#
+import time
+import random
+import asyncio
+import argparse
+
+from phonecan.aggregate import NodeAggregator
+from phonecan.cache import NodeCache
+from phonecan.canlog import LogReader, LogWriter
+from phonecan.canrx import AsyncReceiver, RxDrain
+from phonecan.codec import encode_compact, encode_legacy
+from phonecan.display import ValueDisplay
+from phonecan.registry import NodeRegistry, compact_id, legacy_id
+from sim.fakecan import FakeBus, FakeMCP2515, Match, Message
+from sim.fakedisplay import Group, label, terminalio
+
+read_interval = 0.5 # Seconds, send node collectnodes() at --speed 1
+selected = 1 # Node on the home node display
+
+
+def synthesize(path, minutes=10.0, nnodes=4, legacy_nodes=(2,), seed=1):
+    # A household-like log: every node sends once a second with some jitter, legacy nodes
+    #   as two frames, plus an unrelated device chattering at 5 Hz
+    rng = random.Random(seed)
+    frames = []
+    seq = 0
+    for second in range(int(minutes*60)):
+        for node in range(nnodes):
+            t = second + rng.uniform(0, 0.05) + node*0.1
+            temperature = 21.0 + 0.5*rng.random()
+            humidity = 45.0 + rng.random()
+            if node in legacy_nodes:
+                frames.append((t, legacy_id(node, 0), encode_legacy(temperature)))
+                frames.append((t + 0.0003, legacy_id(node, 1), encode_legacy(humidity)))
+            else:
+                frames.append((t, compact_id(node), encode_compact(seq, temperature, humidity)))
+                seq += 1
+        for i in range(5):
+            frames.append((second + i*0.2, 0x18FEF100, bytes(8)))
+    frames.sort(key=lambda f: f[0])
+    with open(path, "wb") as f:
+        writer = LogWriter(f)
+        for t, can_id, data in frames:
+            writer.write(t, can_id, True, data)
+    return len(frames)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p/100*len(values)))]
+
+
+class Replay():
+    def __init__(self, log, speed=None, consumer="send", nnodes=8):
+        self.log = log
+        self.speed = speed # None for as fast as possible
+        self.consumer = consumer
+        self.registry = NodeRegistry(range(nnodes))
+        self.bus = FakeBus()
+        self.sender = FakeMCP2515(self.bus)
+        self.can_bus = FakeMCP2515(self.bus)
+        self.rxdrain = RxDrain(AsyncReceiver(self.can_bus, matches=self.registry.matches(Match), poll_interval=0),
+                               ring_size=64, node_of=self.registry.node_of)
+        self.latencies = []
+        self.handled = 0
+        self.injected = 0
+
+    async def inject(self):
+        start = time.perf_counter()
+        t0 = None
+        for timestamp, can_id, extended, data in self.log:
+            if t0 is None:
+                t0 = timestamp
+            if self.speed is not None:
+                delay = start + (timestamp - t0)/self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            msg = Message(can_id, bytes(data), extended)
+            msg.sent_at = time.perf_counter()
+            self.bus.transmit(msg, self.sender)
+            self.injected += 1
+            await asyncio.sleep(0)
+
+    def handle(self, msg):
+        self.latencies.append(time.perf_counter() - msg.sent_at)
+        self.handled += 1
+
+    async def collectnodes(self):
+        stats = NodeAggregator()
+        interval = 0 if self.speed is None else read_interval/self.speed
+        while True:
+            while True:
+                msg = self.rxdrain.get_nowait()
+                if msg is None:
+                    break
+                self.registry.decode(msg, stats.add)
+                self.handle(msg)
+            await asyncio.sleep(interval)
+
+    async def button_func(self):
+        cache = NodeCache()
+        valuedisplay = ValueDisplay(Group(), label, terminalio.FONT, [64, 64, 64], [10, 30, 50])
+        while True:
+            msg = await self.rxdrain.recv(timeout=5.0)
+            if msg is not None:
+                rxnodeid = self.registry.decode(msg, cache.update)
+                if rxnodeid == selected:
+                    valuedisplay.show_node(cache, rxnodeid, "Remote "+str(rxnodeid))
+                self.handle(msg)
+            valuedisplay.refresh()
+            await asyncio.sleep(0)
+
+    async def run(self):
+        consumer = self.collectnodes if self.consumer == "send" else self.button_func
+        tasks = [asyncio.create_task(self.rxdrain.run()), asyncio.create_task(consumer())]
+        start = time.perf_counter()
+        await self.inject()
+        # Let the receive path finish what is still in flight
+        idle = 0
+        while idle < 3:
+            busy = self.can_bus.rx_hw or self.can_bus.queue or len(self.rxdrain.ring)
+            idle = 0 if busy else idle + 1
+            await asyncio.sleep(0.01 if self.speed is None else read_interval/self.speed)
+        elapsed = time.perf_counter() - start
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return elapsed
+
+    def report(self, elapsed):
+        dropped = sum(counts[1] for counts in self.rxdrain.stats.nodes.values())
+        ms = [1000*latency for latency in self.latencies]
+        return {
+            "frames": self.injected,
+            "handled": self.handled,
+            "fps": self.handled/elapsed,
+            "p50": percentile(ms, 50),
+            "p90": percentile(ms, 90),
+            "p99": percentile(ms, 99),
+            "max": max(ms) if ms else 0.0,
+            "lost": self.can_bus.rx_overflows + dropped,
+        }
+
+
+def parse_speed(text):
+    return None if text == "max" else float(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a PhoneCAN log into the node receive logic")
+    parser.add_argument("log")
+    parser.add_argument("--speed", default="max", help="1 = real time, N = N times faster, max = as fast as possible")
+    parser.add_argument("--consumer", choices=("send", "home"), default="send")
+    parser.add_argument("--synthesize", action="store_true", help="Write a synthetic household log to LOG instead")
+    parser.add_argument("--minutes", type=float, default=10.0, help="Length of the synthetic log")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        print("Wrote {0} frames to {1}".format(synthesize(args.log, args.minutes), args.log))
+        return
+    log = LogReader(args.log)
+    replay = Replay(log, parse_speed(args.speed), args.consumer)
+    r = replay.report(asyncio.run(replay.run()))
+    log.close()
+    print("{frames} frames, {handled} handled, {fps:.0f} frames/s, lost {lost}".format(**r))
+    print("latency ms: p50 {p50:.3f}  p90 {p90:.3f}  p99 {p99:.3f}  max {max:.3f}".format(**r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#
+# Virtual clock for running several node scripts in one process
+#
+# Each node script runs in its own thread, but only one thread runs at a time:
+# the clock hands a token to the participant with the earliest wake-up time
+# and advances the virtual time to it.  A participant gives the token up by
+# sleeping (time.sleep() while patch() is active, or an asyncio loop from
+# VirtualEventLoop waiting for its next timer), so a blocking sleep on one
+# node stalls that node only, as on the hardware, and a simulated minute takes
+# as long as the code that runs in it.  Callbacks scheduled with call_at()/
+# call_later() run in whichever thread hands the token on (the shared CAN bus
+# uses them to put frames on the wire).
+#
+# The run ends at the time given to run(); participants still waiting then get
+# SimulationEnd raised from their sleep.
+#
+import time
+import heapq
+import asyncio
+import selectors
+import threading
+
+EPOCH = 1735689600.0 # time.time() at virtual time 0 (2025-01-01 UTC)
+
+
+class SimulationEnd(BaseException):
+    # Raised in participants when the run ends.  Not an Exception, so the node scripts'
+    #   broad "except Exception" handlers do not swallow it.
+    pass
+
+
+class _Participant():
+    def __init__(self, name):
+        self.name = name
+        self.gate = threading.Lock()
+        self.gate.acquire()
+        self.error = None
+
+
+class VirtualClock():
+    def __init__(self, start=0.0):
+        self.now = start
+        self.until = None
+        self.stopped = False
+        self.switches = 0
+        self._heap = [] # (time, seq, participant or callable)
+        self._seq = 0
+        self._local = threading.local()
+        self._threads = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return EPOCH + self.now
+
+    def _push(self, when, item):
+        heapq.heappush(self._heap, (when, self._seq, item))
+        self._seq += 1
+
+    def call_at(self, when, callback):
+        self._push(max(when, self.now), callback)
+
+    def call_later(self, delay, callback):
+        self._push(self.now + max(delay, 0.0), callback)
+
+    def _next(self):
+        # Run due callbacks and return the next participant to run, or None at the end of the run
+        while self._heap:
+            when, _seq, item = self._heap[0]
+            if self.until is not None and when > self.until:
+                self.now = self.until
+                break
+            heapq.heappop(self._heap)
+            self.now = max(self.now, when)
+            if isinstance(item, _Participant):
+                return item
+            item()
+        self._stop()
+        return None
+
+    def _stop(self):
+        self.stopped = True
+        for _when, _seq, item in self._heap:
+            if isinstance(item, _Participant):
+                item.gate.release()
+        self._heap = []
+
+    def _hand_on(self):
+        participant = self._next()
+        if participant is not None:
+            self.switches += 1
+            participant.gate.release()
+
+    def sleep(self, seconds):
+        participant = getattr(self._local, "participant", None)
+        if participant is None:
+            raise RuntimeError("VirtualClock.sleep() outside a participant thread")
+        if self.stopped:
+            raise SimulationEnd()
+        self._push(self.now + max(seconds, 0.0), participant)
+        self._hand_on()
+        participant.gate.acquire()
+        if self.stopped:
+            raise SimulationEnd()
+
+    def spawn(self, name, target):
+        # Add a participant that runs target() from the current virtual time
+        participant = _Participant(name)
+
+        def body():
+            self._local.participant = participant
+            participant.gate.acquire()
+            try:
+                if not self.stopped:
+                    target()
+            except SimulationEnd:
+                pass
+            except BaseException as e:  # pylint: disable=broad-except
+                participant.error = e
+            finally:
+                if not self.stopped:
+                    self._hand_on()
+
+        thread = threading.Thread(target=body, name=name, daemon=True)
+        self._threads.append(thread)
+        self._push(self.now, participant)
+        thread.start()
+        return participant
+
+    def run(self, until):
+        # Run every participant until virtual time until (seconds), then stop them
+        self.until = until
+        self._hand_on()
+        for thread in self._threads:
+            thread.join()
+
+    def patch(self):
+        return _TimePatch(self)
+
+
+class _TimePatch():
+    # Context manager pointing time.monotonic/time.time/time.sleep at the clock
+    def __init__(self, clock):
+        self.clock = clock
+        self.saved = None
+
+    def __enter__(self):
+        self.saved = (time.monotonic, time.time, time.sleep)
+        time.monotonic = self.clock.monotonic
+        time.time = self.clock.time
+        time.sleep = self.clock.sleep
+        return self.clock
+
+    def __exit__(self, *args):
+        time.monotonic, time.time, time.sleep = self.saved
+
+
+class _VirtualSelector(selectors.SelectSelector):
+    # Waiting for I/O becomes a virtual sleep.  Every pass of the event loop also costs
+    #   loop_cost seconds, so tasks that poll with asyncio.sleep(0) still let time advance.
+    def __init__(self, clock, loop_cost):
+        super().__init__()
+        self.clock = clock
+        self.loop_cost = loop_cost
+
+    def select(self, timeout=None):
+        if timeout is None:
+            timeout = 3600.0
+        self.clock.sleep(max(timeout, self.loop_cost))
+        return []
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock, loop_cost=0.0005):
+        super().__init__(_VirtualSelector(clock, loop_cost))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.now
@@ -0,0 +1,55 @@
+#
+# phonecan.aggregate.NodeAggregator: time-weighted averages from held values
+#
+# Run from the repository root:  python -m unittest discover tests
+#
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.aggregate import NodeAggregator, TEMPERATURE, HUMIDITY
+
+
+class HoldTickTest(unittest.TestCase):
+    def setUp(self):
+        self.stats = NodeAggregator(hold_for=60.0)
+
+    def test_values_count_for_as_long_as_they_are_current(self):
+        # 20 C for 90 s sent by heartbeat, then 10 frames of 30 C in the last 10 s: the mean is over time, not frames
+        for t in range(100):
+            if t % 50 == 0:
+                self.stats.hold(1, TEMPERATURE, 20.0, now=float(t))
+            if t >= 90:
+                self.stats.hold(1, TEMPERATURE, 30.0, now=float(t))
+            self.stats.tick(now=float(t))
+        stat = self.stats.stat(1, TEMPERATURE)
+        self.assertEqual(stat.count, 100)
+        self.assertAlmostEqual(stat.mean, 21.0)
+        self.assertEqual(stat.max, 30.0)
+
+    def test_quantities_not_received_are_not_added(self):
+        self.stats.hold(2, HUMIDITY, 45.0, now=0.0)
+        self.stats.tick(now=1.0)
+        self.assertEqual(self.stats.stat(2, TEMPERATURE).count, 0)
+        self.assertEqual(self.stats.stat(2, HUMIDITY).count, 1)
+
+    def test_quiet_node_drops_out_after_hold_for(self):
+        self.stats.hold(3, TEMPERATURE, 20.0, now=0.0)
+        for t in range(0, 120, 10):
+            self.stats.tick(now=float(t))
+        self.assertEqual(self.stats.stat(3, TEMPERATURE).count, 7) # Ticks at 0..60 s
+
+    def test_held_values_carry_over_a_reset(self):
+        self.stats.hold(1, TEMPERATURE, 20.0, now=0.0)
+        self.stats.tick(now=1.0)
+        self.stats.reset()
+        self.stats.tick(now=2.0)
+        stat = self.stats.stat(1, TEMPERATURE)
+        self.assertEqual(stat.count, 1)
+        self.assertEqual(stat.mean, 20.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+#
+# gateway.collector.decode() on every frame kind the nodes send
+#
+# Needs python-can (pip install -r gateway/requirements.txt).  Run from the
+# repository root:  python -m unittest discover tests
+#
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+try:
+    import can
+except ImportError:
+    can = None
+
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.codec import (encode_compact, encode_legacy, pack_summary_into, pack_health_into, pack_loop_into,
+                            SUMMARY_SIZE, HEALTH_SIZE, LOOP_SIZE)
+from phonecan.registry import (NodeRegistry, compact_id, legacy_id, plan_id, TELEMETRY, HEALTH, KIND_SUMMARY,
+                               KIND_HEALTH, KIND_LOOP)
+
+if can is not None:
+    from gateway.collector import decode
+
+
+def frame(can_id, data):
+    return can.Message(arbitration_id=can_id, data=data, is_extended_id=True, timestamp=100.0)
+
+
+@unittest.skipIf(can is None, "needs python-can")
+class DecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = NodeRegistry(range(4))
+        self.rows = []
+
+    def test_summary_frame_stores_the_mean(self):
+        data = pack_summary_into(bytearray(SUMMARY_SIZE), 7, HUMIDITY, 60, 45.5, 44.0, 47.25)
+        self.assertTrue(decode(self.registry, frame(plan_id(TELEMETRY, KIND_SUMMARY + HUMIDITY, 2), data), self.rows))
+        self.assertEqual(self.rows, [(100.0, 2, HUMIDITY, 45.5)])
+
+    def test_empty_summary_window_is_ignored(self):
+        data = pack_summary_into(bytearray(SUMMARY_SIZE), 7, TEMPERATURE, 0, 0.0, 0.0, 0.0)
+        self.assertFalse(decode(self.registry, frame(plan_id(TELEMETRY, KIND_SUMMARY, 2), data), self.rows))
+        self.assertEqual(self.rows, [])
+
+    def test_health_and_loop_frames_are_ignored(self):
+        health = pack_health_into(bytearray(HEALTH_SIZE), 1, 100, 3, 1, 0, 5, 0)
+        loop = pack_loop_into(bytearray(LOOP_SIZE), 2, 120, 30, 4)
+        self.assertFalse(decode(self.registry, frame(plan_id(HEALTH, KIND_HEALTH, 1), health), self.rows))
+        self.assertFalse(decode(self.registry, frame(plan_id(HEALTH, KIND_LOOP, 1), loop), self.rows))
+        self.assertEqual(self.rows, [])
+
+    def test_compact_and_legacy_frames(self):
+        self.assertTrue(decode(self.registry, frame(compact_id(1), encode_compact(3, 21.5, 45.0, 1013.2)), self.rows))
+        self.assertTrue(decode(self.registry, frame(legacy_id(3, TEMPERATURE), encode_legacy(19.25)), self.rows))
+        self.assertEqual([row[:3] for row in self.rows],
+                         [(100.0, 1, TEMPERATURE), (100.0, 1, HUMIDITY), (100.0, 1, PRESSURE), (100.0, 3, TEMPERATURE)])
+        self.assertAlmostEqual(self.rows[-1][3], 19.25, places=3)
+
+    def test_foreign_frame_is_ignored(self):
+        self.assertFalse(decode(self.registry, frame(0x18FF0001, bytes(8)), self.rows))
+        self.assertEqual(self.rows, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
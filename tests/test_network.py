@@ -0,0 +1,69 @@
+#
+# phonecan.network.WifiLink: on_connect functions that raise
+#
+# Run from the repository root:  python -m unittest discover tests
+#
+import os
+import sys
+import asyncio
+import contextlib
+import io
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.network import WifiLink
+
+
+class Radio():
+    def __init__(self):
+        self.connected = False
+
+    def connect(self, ssid, password, timeout=None):
+        self.connected = True
+
+
+class FailingStart():
+    # Raises on the first failures calls, as the Adafruit IO client setup does while the broker is unreachable
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OSError("Failed to establish a connection")
+
+
+class OnConnectTest(unittest.TestCase):
+    def run_link(self, link, seconds):
+        async def main():
+            task = asyncio.create_task(link.run())
+            await asyncio.sleep(seconds)
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(main())
+
+    def test_failing_callback_does_not_stop_the_link(self):
+        start = FailingStart(2)
+        flushes = []
+        link = WifiLink(Radio(), "ssid", "password", check_interval=0.01, start_delay=0.0,
+                        on_connect=[start, lambda: flushes.append(True)])
+        self.run_link(link, 0.2)
+        self.assertEqual(link.joins, 1)
+        self.assertEqual(link.callback_failures, 2)
+        self.assertEqual(start.calls, 3) # Called again at each check until it went through, then no more
+        self.assertEqual(len(flushes), 3) # The functions after it still run
+        self.assertFalse(link.callbacks_due)
+
+    def test_connect_reports_join_even_if_callback_fails(self):
+        link = WifiLink(Radio(), "ssid", "password", on_connect=[FailingStart(1)])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(link.connect())
+        self.assertTrue(link.callbacks_due)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#
+# phonecan.publish.Publisher.flush() with a board clock that is not set yet
+#
+# Run from the repository root:  python -m unittest discover tests
+#
+import os
+import sys
+import json
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.aggregate import NodeAggregator, TEMPERATURE
+from phonecan.clock import WallClock
+from phonecan.outbox import Outbox
+from phonecan.publish import Publisher, iso_time
+
+BOOT_TIME = 946684800 # time.time() at boot on an unset clock (2000-01-01)
+NTP_TIME = 1700000000
+
+
+class BoardTime():
+    # time.time() and time.monotonic() of a board whose RTC is set by set_time()
+    def __init__(self):
+        self.monotonic = 0.0
+        self.base = BOOT_TIME
+        self.ntp_up = False
+
+    def time(self):
+        return self.base + int(self.monotonic)
+
+    def set_time(self):
+        if not self.ntp_up:
+            raise OSError("NTP timed out")
+        self.base = NTP_TIME - int(self.monotonic)
+
+
+class RecordingIO():
+    is_connected = True
+
+    def __init__(self):
+        self.payloads = []
+
+    def publish(self, group, data, is_group=False):
+        self.payloads.append(json.loads(data))
+
+
+class UnsyncedClockTest(unittest.TestCase):
+    def setUp(self):
+        self.board = BoardTime()
+        patches = [mock.patch.object(time, "time", self.board.time),
+                   mock.patch.object(time, "monotonic", lambda: self.board.monotonic)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.clock = WallClock(self.board.set_time, retry_interval=60.0)
+        self.io = RecordingIO()
+
+    def publisher(self, outbox):
+        return Publisher(self.io, "g", outbox=outbox, flush_interval=0.0, clock=self.clock, clock_wait=600.0)
+
+    def queue(self, outbox, value):
+        stats = NodeAggregator()
+        stats.add(1, TEMPERATURE, value)
+        outbox.put_stats(self.clock.stamp(), stats, [1])
+
+    def test_interval_queued_before_the_clock_is_set_keeps_its_time(self):
+        outbox = Outbox(8)
+        publisher = self.publisher(outbox)
+        self.board.monotonic = 900.0
+        self.queue(outbox, 21.0)
+        self.assertEqual(outbox.peek(0)[0], 900) # Monotonic stamp
+        self.assertEqual(publisher.flush(now=900.0), 0) # NTP down: held back
+        self.board.ntp_up = True
+        self.board.monotonic = 1000.0
+        self.assertEqual(publisher.flush(now=1000.0), 1)
+        self.assertEqual(self.io.payloads, [{"feeds": {"node1-temp": 21.0}, "created_at": iso_time(NTP_TIME - 100)}])
+
+    def test_interval_goes_without_time_after_clock_wait(self):
+        outbox = Outbox(8)
+        publisher = self.publisher(outbox)
+        self.board.monotonic = 900.0
+        self.queue(outbox, 21.0)
+        self.assertEqual(publisher.flush(now=900.0), 0)
+        self.assertEqual(publisher.flush(now=1400.0), 0)
+        self.assertEqual(publisher.flush(now=1500.0), 1)
+        self.assertEqual(self.io.payloads, [{"feeds": {"node1-temp": 21.0}}])
+        self.assertEqual(self.clock.failures, 3) # One attempt per flush, as they are retry_interval apart
+
+    def test_restored_interval_from_an_earlier_boot_is_not_dated(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.board.monotonic = 900.0
+        outbox = Outbox(8, path=path)
+        self.queue(outbox, 21.0)
+        outbox.file.close()
+        # Reset: monotonic starts again, and NTP sets the clock on the next join
+        self.board.monotonic = 50.0
+        self.board.ntp_up = True
+        outbox = Outbox(8, path=path)
+        self.addCleanup(outbox.file.close)
+        publisher = self.publisher(outbox)
+        self.assertEqual(outbox.restored, 1)
+        self.queue(outbox, 22.0)
+        self.assertEqual(publisher.flush(now=50.0), 1)
+        self.assertEqual(publisher.flush(now=50.0), 1)
+        self.assertEqual(self.io.payloads, [{"feeds": {"node1-temp": 21.0}},
+                                            {"feeds": {"node1-temp": 22.0}, "created_at": iso_time(NTP_TIME)}])
+
+
+if __name__ == "__main__":
+    unittest.main()
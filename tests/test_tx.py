@@ -0,0 +1,46 @@
+#
+# phonecan.tx.Transmitter: frames packed into the slot buffers go out with that payload
+#
+# sim.fakecan.Message copies its data as adafruit_mcp2515.canio.Message does.
+# Run from the repository root:  python -m unittest discover tests
+#
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from phonecan.aggregate import TEMPERATURE, HUMIDITY, PRESSURE
+from phonecan.codec import pack_compact_into, pack_legacy_into
+from phonecan.registry import NodeRegistry
+from phonecan.tx import Transmitter, node_slots
+from sim.fakecan import FakeMCP2515, Message
+
+
+class TransmitterTest(unittest.TestCase):
+    def setUp(self):
+        self.can_bus = FakeMCP2515()
+        self.registry = NodeRegistry(range(4))
+        self.values = []
+
+    def add(self, nodeid, quantity, value):
+        self.values.append((nodeid, quantity, round(value, 2)))
+
+    def test_compact_slot_payload_is_sent(self):
+        tx = Transmitter(self.can_bus, Message, node_slots(2, "compact", plan=True))
+        pack_compact_into(tx.buffer(0), 1, 21.5, 45.25, 1013.2)
+        self.assertTrue(tx.send(0))
+        self.assertEqual(self.registry.decode(self.can_bus.last_sent, self.add), 2)
+        self.assertEqual(self.values, [(2, TEMPERATURE, 21.5), (2, HUMIDITY, 45.25), (2, PRESSURE, 1013.2)])
+
+    def test_repacked_legacy_slots_are_sent(self):
+        tx = Transmitter(self.can_bus, Message, node_slots(3, "legacy"))
+        for temperature in (19.0, 20.5):
+            pack_legacy_into(tx.buffer(TEMPERATURE), temperature)
+            tx.send(TEMPERATURE)
+            self.registry.decode(self.can_bus.last_sent, self.add)
+        self.assertEqual(self.values, [(3, TEMPERATURE, 19.0), (3, TEMPERATURE, 20.5)])
+
+
+if __name__ == "__main__":
+    unittest.main()
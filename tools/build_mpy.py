@@ -0,0 +1,62 @@
+#
+# Precompile the phonecan library to .mpy files for the boards
+#
+# CircuitPython compiles every .py module it imports, at every boot, which
+# takes time and leaves heap fragmented before the node scripts start.
+# Copying build/phonecan (made here with mpy-cross) to CIRCUITPY instead of
+# the phonecan sources skips that.  Use the mpy-cross that matches the
+# boards' CircuitPython major version (9.x here); CircuitPython refuses .mpy
+# files from another.  __init__.py is only comments, so it is copied as it
+# is.  The node scripts themselves stay .py (the board runs code.py).
+#
+#   python tools/build_mpy.py --mpy-cross ~/bin/mpy-cross-9 --out build
+#   cp -r build/phonecan /media/$USER/CIRCUITPY/
+#
+# Remove any phonecan/*.py left on the board when switching to the .mpy
+# files: CircuitPython imports the .py when both are there.
+#
+import os
+import sys
+import shutil
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "phonecan"
+
+
+def build(mpy_cross, out):
+    # Compile every module of the package into out/phonecan; returns the files written
+    source = os.path.join(ROOT, PACKAGE)
+    target = os.path.join(out, PACKAGE)
+    os.makedirs(target, exist_ok=True)
+    written = []
+    for name in sorted(os.listdir(source)):
+        if not name.endswith(".py"):
+            continue
+        path = os.path.join(source, name)
+        if name == "__init__.py":
+            dest = os.path.join(target, name)
+            shutil.copyfile(path, dest)
+        else:
+            dest = os.path.join(target, name[:-3] + ".mpy")
+            # -s names the source in tracebacks as it would be on the board
+            subprocess.run([mpy_cross, "-s", PACKAGE + "/" + name, "-o", dest, path], check=True)
+        written.append(dest)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the phonecan library as .mpy files")
+    parser.add_argument("--mpy-cross", default="mpy-cross", help="mpy-cross executable for the boards' CircuitPython")
+    parser.add_argument("--out", default=os.path.join(ROOT, "build"), help="Output directory")
+    args = parser.parse_args()
+    if shutil.which(args.mpy_cross) is None:
+        sys.exit("{0} not found; pass --mpy-cross with the path to CircuitPython's mpy-cross".format(args.mpy_cross))
+    written = build(args.mpy_cross, args.out)
+    total = sum(os.path.getsize(path) for path in written)
+    print("{0} files, {1} bytes in {2}".format(len(written), total, os.path.join(args.out, PACKAGE)))
+
+
+if __name__ == "__main__":
+    main()